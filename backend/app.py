@@ -1,14 +1,169 @@
-from ctypes.wintypes import tagSIZE
 from flask import Flask, render_template, request
 from flask_cors import CORS
-from regex import S
-from helpers.MySQLDatabaseHandler import MySQLDatabaseHandler
-import pandas as pd
 import numpy as np
 
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+
+import bm25
 import helper_functions
-from helper_functions import average_park_ratings, park_token_dict, idf_dict
-from svd import park_dict, truncated_mat, park_norms
+import live_index
+import metrics
+import query_cache
+import results
+import scoring
+import search_index
+import spatial
+import spelling
+import suggest
+import vector_index
+
+# LOG_LEVEL=DEBUG also logs the candidate counts of every search
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO"),
+                    format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger(__name__)
+
+# load the prebuilt search index, rebuilding it first if parks_details.json
+# has changed since it was written; new reviews and parks can be ingested into
+# it while the app is running
+with metrics.timed("load_index", metrics.LOAD_SECONDS):
+    index = live_index.LiveIndex(search_index.load_index())
+index_lock = threading.Lock()
+
+# optional SQL database of the parks and reviews, reloaded, keeping what was
+# ingested into it, if it was loaded from a different dataset than the index;
+# when PARKS_DB_URL is set, the search filters are answered by the database
+# instead of the index columns, and ingested parks and reviews are stored in
+# it and added to the index from there, so that every worker picks up what
+# any of them ingested
+database = None
+# sequence number of the last ingest in the database added to the index, and
+# when the database was last polled for newer ingests
+ingest_sequence = 0
+last_poll = 0.0
+INGEST_POLL_SECONDS = float(os.environ.get("INGEST_POLL_SECONDS", 2))
+# whether /ingest may add updates to the index of this process alone, with no
+# database to share them through; gunicorn.conf.py turns it off in workers
+# that serve alongside others, which would never see the updates
+local_ingest = True
+
+def sync_ingested():
+    """
+    Function to add what was ingested into the database since the last sync,
+    by this or any other process, to the index. Must be called with
+    index_lock held.
+    """
+    global ingest_sequence, last_poll
+    last_poll = time.monotonic()
+    new_parks, new_reviews, ingest_sequence = database.ingested(ingest_sequence)
+    for park, record, park_reviews in new_parks:
+        index.add_park(park, record, park_reviews)
+    for review in new_reviews:
+        index.add_reviews(review['business_id'], [review])
+
+def version_label():
+    # processes that added the same ingests from the database share the index
+    # version, so that the cursors one issues are accepted by the others
+    return ingest_sequence if database is not None else None
+
+if os.environ.get("PARKS_DB_URL"):
+    # SQLAlchemy is only imported when a database is configured
+    from helpers.ParkDatabase import ParkDatabase
+    database = ParkDatabase(os.environ["PARKS_DB_URL"])
+    if database.source_checksum() != index.manifest['source_checksum']:
+        database.load()
+    with metrics.timed("replay_ingested", metrics.LOAD_SECONDS):
+        sync_ingested()
+        index.refresh(version_label())
+
+class SearchState(object):
+    """
+    The structures the search path derives from a snapshot of the index: the
+    scoring engines, the vector index of the park embeddings, the spatial
+    index over park coordinates, the per-park response fragments, the query
+    completions and the spelling corrections. A state is never changed once
+    built; refreshes build a new one and swap it in, and every batch of
+    searches reads the one state that was current when it started.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        with metrics.timed("scoring_engine", metrics.LOAD_SECONDS):
+            self.engine = scoring.ScoringEngine(index)
+        with metrics.timed("bm25", metrics.LOAD_SECONDS):
+            self.ranker = bm25.BM25Scorer(index)
+        with metrics.timed("vector_index", metrics.LOAD_SECONDS):
+            self.park_vectors = vector_index.build_vector_index(index.svd_embeddings,
+                                                                normalized=True)
+        with metrics.timed("locator", metrics.LOAD_SECONDS):
+            self.locator = spatial.ParkLocator(index.park_latitudes, index.park_longitudes)
+        with metrics.timed("fragments", metrics.LOAD_SECONDS):
+            self.fragments = results.build_fragments(index)
+        with metrics.timed("suggester", metrics.LOAD_SECONDS):
+            self.suggester = suggest.Suggester(index)
+        with metrics.timed("corrector", metrics.LOAD_SECONDS):
+            self.corrector = spelling.SpellingCorrector(index)
+        logger.info("loaded search state for %d parks and %d terms (index version %s)",
+                    len(index.park_ids), len(index.vocabulary), index.version)
+
+# serializes refreshes, so that states are swapped in the order they were built
+refresh_lock = threading.Lock()
+# thread running refresh_index in the background, if one was started, and
+# the lock guarding its start
+refresher = None
+refresher_lock = threading.Lock()
+
+def refresh_index():
+    """
+    Function to merge what was ingested into the index and swap in the search
+    state rebuilt from it; with a database, what was ingested into it since
+    the last sync is fetched first. Searches keep using the previous state
+    until the new one is swapped in, and never wait for a refresh.
+    """
+    global search_state
+    with refresh_lock:
+        with index_lock:
+            if database is not None:
+                sync_ingested()
+            if not index.dirty:
+                return
+            with metrics.timed("refresh", metrics.LOAD_SECONDS):
+                index.refresh(version_label())
+            snapshot = index.snapshot()
+        search_state = SearchState(snapshot)
+
+def request_refresh():
+    """
+    Function to start refresh_index in a background thread if the index has
+    additions to merge, or the database is due to be polled for ingests, and
+    no refresh is running yet.
+    """
+    global refresher
+    due = index.dirty or (database is not None
+                          and time.monotonic() - last_poll >= INGEST_POLL_SECONDS)
+    if not due or (refresher is not None and refresher.is_alive()):
+        return
+    with refresher_lock:
+        if refresher is None or not refresher.is_alive():
+            refresher = threading.Thread(target=refresh_index, name="refresh", daemon=True)
+            refresher.start()
+
+search_state = SearchState(index.snapshot())
+
+def warm_up():
+    """
+    Function to load what the first searches would otherwise load on demand:
+    the tokenizer, and the ball tree of the travel distance filter along with
+    scikit-learn.
+    """
+    with metrics.timed("tokenizer", metrics.LOAD_SECONDS):
+        helper_functions.load_tokenizer()
+    with metrics.timed("locator_tree", metrics.LOAD_SECONDS):
+        search_state.locator.tree
 
 # for region location
 region_to_states = {
@@ -20,126 +175,313 @@ region_to_states = {
 }
 
 app = Flask(__name__)
-CORS(app)
-
-def calculate_similarities(query_tokens, query_norm, inverted_dict, idf_dict, \
-                            park_norms) -> dict[str, int]:
-    """
-    Function to create and return a dictionary that maps business ids to
-    the cosine similarity scores between their associated tokenized reviews and
-    the input tokenized query.
-    """
-    scores = {}
-    for token, frequency in query_tokens.items():
-        if inverted_dict.get(token) is not None and idf_dict.get(token) is not None:
-            for park, count in inverted_dict[token]:
-                # initialize or update score accumulator
-                if scores.get(park) is None:
-                    scores[park] = frequency * idf_dict[token] \
-                                    * count * idf_dict[token]
-                else:
-                    scores[park] += frequency * idf_dict[token] \
-                                    * count * idf_dict[token]
-    for park, score in scores.items():
-        scores[park] = score / (query_norm * park_norms[park])
-    return scores
-
-def find_similar_parks(query_tokens, park_token_dict, idf_dict) -> dict[str, int]:
-     """
-     Function to create and return a dictionary that maps amusement park names to
-     Function to create and return a dictionary that maps business ids to
-     the cosine similarity scores between their associated tokenized reviews and
-     the input tokenized query.
-     """
-     scores = {}
-     n_query_tokens = len(query_tokens)
-     for park, park_tokens in park_token_dict.items():
-         dot_product = 0
-         common_tokens = 0     # variable to store number of tokens in common
-                               # between the query and the reviews for this park
-         for token in query_tokens:
-             if park_tokens.get(token) is not None:
-                 dot_product += query_tokens.get(token) * idf_dict[token] \
-                                * park_tokens.get(token) * idf_dict[token]
-                 common_tokens += 1
-         total_tokens = n_query_tokens + len(park_tokens) - common_tokens
-         scores[park] = (dot_product / total_tokens)
-     return scores
+CORS(app, expose_headers=["X-Next-Cursor", "X-Query-Corrections"])
+
+result_cache = query_cache.QueryCache()
+
+# rankings of recent searches, from which their pages are sliced; a search is
+# ranked RANKING_DEPTH parks deep, or deeper when a page past that is asked for
+RANKING_DEPTH = results.MAX_RESULTS
+rankings = query_cache.QueryCache(max_bytes=8 * 1024 * 1024, ttl=600)
+
+# counters and gauges read from the cache and index when /metrics is scraped
+for stat, kind, description in (
+        ("hits", "counter", "Searches answered from the result cache."),
+        ("misses", "counter", "Searches not found in the result cache."),
+        ("evictions", "counter", "Results evicted from the result cache."),
+        ("entries", "gauge", "Results held in the result cache."),
+        ("bytes", "gauge", "Size of the results held in the result cache.")):
+    metrics.register(metrics.Gauge(f"parks_cache_{stat}" + ("_total" if kind == "counter" else ""),
+                                   description, kind=kind,
+                                   callback=lambda stat=stat: result_cache.stats()[stat]))
+metrics.register(metrics.Gauge("parks_rankings_entries", "Search rankings kept for paging.",
+                               callback=lambda: rankings.stats()['entries']))
+metrics.register(metrics.Gauge("parks_index_parks", "Parks in the search index.",
+                               callback=lambda: len(search_state.index.park_ids)))
+metrics.register(metrics.Gauge("parks_index_updates_total",
+                               "Ingested updates merged into the search index.",
+                               kind="counter", callback=lambda: index.updates))
+search_count = metrics.register(metrics.Counter("parks_searches_total",
+                                                "Searches run, by ranking mode.", "mode"))
+
+# weight of the latent similarity against the lexical score when ranking with
+# mode=latent
+LATENT_WEIGHT = 0.5
+# ranking modes a search may ask for; None ranks by similarity to the best
+# lexical match
+MODES = (None, "latent", "bm25")
 
 # Sample search using json with pandas
-def json_search(query, locations=None, latitude=None, longitude=None, distance=None, good_for_kids=None):
+def json_search(query, locations=None, latitude=None, longitude=None, distance=None, good_for_kids=None,
+                k=results.DEFAULT_RESULTS, offset=0, mode=None, cursor=None):
+    page = json_search_batch([(query, locations, latitude, longitude, distance,
+                               good_for_kids, k, offset, mode, cursor)])[0]
+    if isinstance(page, Exception):
+        raise page
+    return page[0]
+
+def json_search_batch(searches) -> list:
+    """
+    Function to answer a batch of searches, each a tuple of json_search
+    arguments, returning the response to each search along with the cursor
+    of its next page, or None if it has no next page, and the spelling
+    corrections made to its query, mapping each corrected word to its
+    correction. The response is None if the search's cursor has expired,
+    and a search that failed is answered with the exception it raised
+    instead, so that it does not fail the rest of the batch; a cursor that
+    the app did not issue fails with query_cache.InvalidCursor.
+    The searches whose ranking is not kept are scored together, with one
+    sparse matrix product for the lexical scores and one dense product for
+    the latent similarities.
+    """
+    # the batch is answered from the search state current when it starts,
+    # while a refresh may build the next one in the background
+    request_refresh()
+    state = search_state
+    version = state.index.version
+
+    pages = [None] * len(searches)
+    corrections = [{} for _ in searches]
+    pending = []
+    for position, search in enumerate(searches):
+        # an error answering one search only fails that search, not the
+        # others batched with it
+        try:
+            query, locations, latitude, longitude, distance, good_for_kids, k, offset, mode, cursor = search
+
+            if cursor:
+                # a cursor holds the search it pages through, which must have
+                # been ranked on the current index
+                parsed = query_cache.parse_cursor(cursor, version, len(state.index.vocabulary))
+                if parsed is None:
+                    raise query_cache.InvalidCursor("invalid cursor")
+                if parsed[0] != version or parsed[3] > results.MAX_OFFSET:
+                    pages[position] = (None, None)
+                    continue
+                _, key, mode, offset = parsed
+                query_counts, locations, latitude, longitude, distance, good_for_kids = \
+                    query_cache.key_search(key)
+            else:
+                # tokenize query against the vocabulary of the prebuilt index,
+                # correcting the words missing from it
+                with metrics.timed("tokenize"):
+                    query_counts = helper_functions.query_term_counts(query, state.index,
+                                                                      state.corrector,
+                                                                      corrections[position])
+                metrics.QUERY_TERMS.observe(len(query_counts))
+
+                # serve repeated searches from the result cache; coordinates are
+                # rounded so that nearby users share entries, and the search
+                # itself uses the rounded coordinates so that every entry is well
+                # defined
+                latitude, longitude = query_cache.quantize_location(latitude, longitude)
+                key = query_cache.make_key(query_counts, locations, latitude, longitude,
+                                           distance, good_for_kids)
+            with metrics.timed("cache"):
+                pages[position] = result_cache.get((key, k, offset, mode), version)
+            if pages[position] is not None:
+                continue
+            search_count.inc(mode or "lexical")
+
+            # later pages of a search are sliced from its ranking while it is kept
+            with metrics.timed("cache"):
+                ranking = rankings.get((key, mode), version)
+            if ranking is not None and (offset + k <= len(ranking[0]) or ranking[2]):
+                pages[position] = serve_page(state, key, k, offset, mode, query_counts, ranking)
+                continue
+            pending.append((position, key, k, offset, mode,
+                            (query_counts, locations, latitude, longitude, distance, good_for_kids,
+                             max(RANKING_DEPTH, offset + k), mode)))
+        except Exception as error:
+            pages[position] = error
+    if pending:
+        score_pending(state, pending, pages)
+    return [page if isinstance(page, Exception) else page + (corrected,)
+            for page, corrected in zip(pages, corrections)]
+
+def score_pending(state, pending, pages):
+    """
+    Function to rank the pending searches of a batch, whose rankings are not
+    kept, on the given search state, and fill in the page each asked for, or
+    the exception raised while answering it.
+    """
+    version = state.index.version
+    # score every pending query against every park at once
+    try:
+        queries = [arguments[0] for *_, arguments in pending]
+        with metrics.timed("lexical"):
+            query_mat = state.engine.query_matrix(queries)
+            lexical_scores = state.engine.jaccard_scores(query_mat)
+        latent_columns = [column for column, (*_, arguments) in enumerate(pending)
+                          if arguments[-1] == "latent"]
+        latent_sims = None
+        if latent_columns:
+            with metrics.timed("latent"):
+                query_vectors = latent_queries(state, query_mat[latent_columns])
+                # an exhaustive index scores every park with one dense product,
+                # while an approximate one only searches the parks near each query
+                if isinstance(state.park_vectors, vector_index.ExactVectorIndex):
+                    latent_sims = state.park_vectors.embeddings @ query_vectors.T
+            latent_columns = {column : i for i, column in enumerate(latent_columns)}
+    except Exception as error:
+        # score the searches one at a time, so that only the one at fault fails
+        if len(pending) == 1:
+            pages[pending[0][0]] = error
+        else:
+            for search in pending:
+                score_pending(state, [search], pages)
+        return
+
+    for column, (position, key, k, offset, mode, arguments) in enumerate(pending):
+        try:
+            latent = query_vector = None
+            if column in latent_columns:
+                if latent_sims is not None:
+                    latent = latent_sims[:, latent_columns[column]]
+                else:
+                    query_vector = query_vectors[latent_columns[column]]
+            rows, scores = rank_parks(state, *arguments, similar_parks=lexical_scores[:, column],
+                                      latent_sims=latent, query_vector=query_vector)
+            # a ranking shorter than requested holds every candidate park
+            ranking = rows, scores, len(rows) < arguments[-2]
+            with metrics.timed("cache"):
+                rankings.put((key, mode), version, ranking)
+            pages[position] = serve_page(state, key, k, offset, mode, arguments[0], ranking)
+        except Exception as error:
+            pages[position] = error
+
+def serve_page(state, key, k, offset, mode, query_counts, ranking) -> tuple[str, str]:
+    """
+    Function to serialize the page of k results at offset of ranking, the
+    ranked rows and scores of the search with the given cache key and mode
+    and whether they hold every candidate park, on the given search state,
+    and cache it. Returns the response and the cursor of the next page.
+    """
+    version = state.index.version
+    rows, scores, complete = ranking
+    with metrics.timed("serialize"):
+        response = results.serialize(state.fragments, rows[offset:offset + k],
+                                     scores[offset:offset + k], state.index, query_counts)
+    cursor = None
+    if k > 0 and offset + k <= results.MAX_OFFSET and (offset + k < len(rows) or not complete):
+        cursor = query_cache.make_cursor(version, key, mode, offset + k)
+    with metrics.timed("cache"):
+        result_cache.put((key, k, offset, mode), version, (response, cursor))
+    return response, cursor
+
+def rank_parks(state, query_counts, locations=None, latitude=None, longitude=None, distance=None,
+               good_for_kids=None, n=RANKING_DEPTH, mode=None, similar_parks=None,
+               latent_sims=None, query_vector=None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Function to rank the parks passing the filters against query_counts, on
+    the given search state. Returns the rows and scores of the best n parks,
+    best first.
+    """
+    index = state.index
     # filter dataset according to user preferences
-    park_dict_filtered, park_tokens_filtered = helper_functions.apply_filters(park_dict,
-                                                                     park_token_dict,
-                                                                     locations,
-                                                                     latitude,
-                                                                     longitude,
-                                                                     distance,
-                                                                     good_for_kids)
-    # obtain term frequency dictionary
-    all_tokens = helper_functions.unique_tokens(park_dict_filtered)
-    
-    # tokenize query
-    query_tokens = {token : 0 for token in all_tokens}
-
-    for token in helper_functions.tokenize(query):
-        if query_tokens.get(token) is not None:
-            query_tokens[token] += 1
-
-    # obtain vector of query term frequency counts
-    updated_query = list(query_tokens.values())
-    
-    # use cosine similarity to find the park most similar to the user query
-    similar_parks = find_similar_parks(query_tokens, park_tokens_filtered, idf_dict)
-    park_reverse_index = {park : index for index, park in enumerate(park_dict_filtered)}
-    most_similar_park = max(similar_parks, key=similar_parks.get)
-    top_park_index = park_reverse_index[most_similar_park]
+    with metrics.timed("filter"):
+        if database is not None:
+            mask = database.apply_filters(index, locations, latitude, longitude,
+                                          distance, good_for_kids, state.locator)
+        else:
+            mask = helper_functions.apply_filters(index,
+                                                  locations,
+                                                  latitude,
+                                                  longitude,
+                                                  distance,
+                                                  good_for_kids,
+                                                  state.locator)
+        candidates = np.flatnonzero(mask)
+    metrics.CANDIDATE_PARKS.observe(len(candidates))
+    if len(candidates) == 0:
+        return candidates, np.zeros(0)
+
+    if mode == "bm25":
+        with metrics.timed("bm25"):
+            rows, scores, decoded = state.ranker.search(query_counts, n, mask)
+        metrics.POSTINGS_DECODED.observe(decoded)
+        with metrics.timed("select"):
+            return results.top_k(rows, scores, n)
+
+    # find the candidate park most similar to the user query
+    if similar_parks is None:
+        with metrics.timed("lexical"):
+            similar_parks = state.engine.score(query_counts)
+    if mode == "latent":
+        with metrics.timed("latent"):
+            rows, scores = latent_rank(state, query_counts, mask, candidates, similar_parks,
+                                       n, latent_sims, query_vector)
+        with metrics.timed("select"):
+            return results.top_k(rows, scores, n)
 
     # use SVD matrix to find parks similar to top park from cosine similarity
-    park_ids = [id for id in park_dict_filtered.keys()]
-    inner_products = truncated_mat.dot(truncated_mat[top_park_index,:])
-    cosine_sims = inner_products / (park_norms * np.inner(updated_query, updated_query))
-    park_scores = sorted(zip(park_ids, cosine_sims))
-
-    # create a dataframe to store the parks and their associated locations,
-    # average user ratings, and similarity scores with the user query
-    park_df = pd.DataFrame(columns=['name', 'location', 'score', 'rating', 'reviews'])
-    for park, score in park_scores:
-        top_reviews = [review['text'] for review in park_dict_filtered[park]['reviews'][:3]]
-
-        image_url = park_dict_filtered[park].get('image_url')
-        if not image_url or image_url == "None":
-            image_url = "static/images/default-park.jpg"
-
-        new_row = pd.DataFrame({
-            'name': park_dict_filtered[park]['name'],
-            'location': park_dict_filtered[park]['state'],
-            'score': score,
-            'rating': average_park_ratings[park],
-            'reviews': [top_reviews],
-            'image_url': image_url,
-            'website_url': park_dict_filtered[park].get('website_url'),
-            'tag1': park_dict_filtered[park]['tags'][0],
-            'tag2': park_dict_filtered[park]['tags'][1],
-            'tag3': park_dict_filtered[park]['tags'][2]
-        }, index=[0])
-        park_df = pd.concat([park_df, new_row])
-    # sort the dataframe by score in descending order
-    park_df = park_df.sort_values(by='score', ascending=False)
-    # return the top 10 parks
-    return park_df.head(10).to_json(orient='records')
+    with metrics.timed("svd"):
+        top_park_index = candidates[np.argmax(similar_parks[candidates])]
+        query_norm = sum(count * count for count in query_counts.values()) or 1
+        inner_products = index.truncated_mat[candidates].dot(index.truncated_mat[top_park_index,:])
+        # a park ingested without reviews has no latent vector and scores 0
+        norms = index.svd_norms[candidates] * query_norm
+        cosine_sims = np.divide(inner_products, norms, out=np.zeros_like(inner_products),
+                                where=norms > 0)
 
-@app.route("/")
-def home():
-    return render_template('base.html',title="sample html")
+    # rank the best n parks; pages of results are sliced from the ranking
+    with metrics.timed("select"):
+        return results.top_k(candidates, cosine_sims, n)
 
-@app.route("/parks")
-def park_search():
-    text = request.args.get("title")
+def latent_queries(state, query_mat) -> np.ndarray:
+    """
+    Function to project a batch of queries, given as a sparse matrix of term
+    counts, into the SVD latent space of the given search state with one
+    matrix product. Returns the unit length query vectors, one row per query.
+    """
+    index = state.index
+    term_weights = index.idf if index.manifest['svd']['weighting'] == 'tfidf' else None
+    query_vectors = vector_index.project_queries(query_mat, index.svd_components, term_weights)
+    return vector_index.normalize_rows(query_vectors)
+
+def latent_rank(state, query_counts, mask, candidates, similar_parks, n, latent_sims=None,
+                query_vector=None):
+    """
+    Function to rank parks by projecting the query into the SVD latent space
+    and searching the park embeddings, blended with the lexical score. The
+    best n parks of each ranking are blended, so that a park strong in
+    either one can make the final page. latent_sims, if given, holds the
+    query's precomputed similarity to every park; otherwise the vector index
+    is searched with query_vector, the query's projection as returned by
+    latent_queries, which is computed if not given.
+    """
+    index = state.index
+    if latent_sims is None:
+        if query_vector is None:
+            term_weights = index.idf if index.manifest['svd']['weighting'] == 'tfidf' else None
+            query_vector = vector_index.project_query(query_counts, index.svd_components,
+                                                      term_weights)
+        latent_rows, _ = state.park_vectors.search(query_vector, n, mask)
+    else:
+        latent_rows, _ = results.top_k(candidates, latent_sims[candidates], n)
+    lexical_rows, _ = results.top_k(candidates, similar_parks[candidates], n)
+    rows = np.union1d(latent_rows, lexical_rows)
+
+    if latent_sims is None:
+        latent_scores = state.park_vectors.embeddings[rows] @ vector_index.normalize_rows([query_vector])[0]
+    else:
+        latent_scores = latent_sims[rows]
+    lexical_scores = similar_parks[rows]
+    if lexical_scores.max(initial=0) > 0:
+        lexical_scores = lexical_scores / lexical_scores.max()
+    return rows, LATENT_WEIGHT * latent_scores + (1 - LATENT_WEIGHT) * lexical_scores
+
+def search_arguments(args) -> tuple:
+    """
+    Function to convert the query parameters of a /parks request, given as a
+    mapping from names to strings, into the arguments of json_search.
+    Raises ValueError if a parameter is invalid.
+    """
+    text = args.get("title")
     if not text:
         text = ""
     # apply location option selected by user
-    regions = request.args.get("regions")
+    regions = args.get("regions")
     if regions:
         regions = regions.split(",")
         states = []
@@ -149,14 +491,162 @@ def park_search():
         states = None
 
     # apply geolocation filter (distance)
-    latitude = request.args.get("latitude")
-    longitude = request.args.get("longitude")
-    distance = request.args.get("travel-distance")
+    latitude = args.get("latitude")
+    longitude = args.get("longitude")
+    distance = args.get("travel-distance")
+    if distance and distance != "fly" and (latitude or longitude) and \
+            query_cache.quantize_location(latitude, longitude) == (None, None):
+        raise ValueError("latitude and longitude must be finite numbers")
 
     # apply good for kids filter
-    good_for_kids = request.args.get("good_for_kids")
+    good_for_kids = args.get("good_for_kids")
+
+    # page of results to return
+    k = min(max(_int_argument(args, "k", results.DEFAULT_RESULTS), 0), results.MAX_RESULTS)
+    offset = min(max(_int_argument(args, "offset", 0), 0), results.MAX_OFFSET)
+
+    # "latent" ranks by the query's projection into the SVD latent space
+    # instead of by similarity to the best lexical match, and "bm25" by the
+    # BM25 score of each park's reviews
+    mode = args.get("mode") or None
+    if mode not in MODES:
+        raise ValueError(f"unknown mode {mode!r}")
+
+    # cursor returned with the previous page, in the X-Next-Cursor header,
+    # which replaces the query, filters, mode and offset
+    cursor = args.get("cursor")
+    return text, states, latitude, longitude, distance, good_for_kids, k, offset, mode, cursor
+
+def suggest_response(args) -> str:
+    """
+    Function to complete the partial query in the "q" parameter of a
+    /suggest request, given as a mapping from names to strings. Returns the
+    completing park names and query texts as JSON.
+    """
+    limit = min(max(_int_argument(args, "limit", suggest.DEFAULT_SUGGESTIONS), 0),
+                suggest.MAX_SUGGESTIONS)
+    with metrics.timed("suggest"):
+        return json.dumps(search_state.suggester.complete(args.get("q") or "", limit))
+
+def response_headers(cursor, corrections) -> dict[str, str]:
+    """
+    Function to build the headers of a /parks response: the cursor of the
+    next page, and the spelling corrections made to the query as a JSON
+    object, each if there is one.
+    """
+    headers = {}
+    if cursor:
+        headers["X-Next-Cursor"] = cursor
+    if corrections:
+        headers["X-Query-Corrections"] = json.dumps(corrections)
+    return headers
+
+def _int_argument(args, name, default) -> int:
+    try:
+        return int(args.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+@app.route("/")
+def home():
+    return render_template('base.html',title="sample html")
+
+@app.route("/parks")
+def park_search():
+    try:
+        arguments = search_arguments(request.args)
+    except ValueError as error:
+        return {"error": str(error)}, 400
+
+    # requests carrying the PROFILE_TOKEN environment variable in the
+    # X-Profile-Token header are always profiled, others at PROFILE_RATE
+    token = os.environ.get("PROFILE_TOKEN")
+    profile = bool(token) and request.headers.get("X-Profile-Token") == token
+    with metrics.timed("/parks", metrics.REQUEST_SECONDS), \
+            metrics.profiled(request.full_path, force=profile):
+        page = json_search_batch([arguments])[0]
+    if isinstance(page, query_cache.InvalidCursor):
+        return {"error": str(page)}, 400
+    if isinstance(page, Exception):
+        raise page
+    response, cursor, corrections = page
+    if response is None:
+        return {"error": "cursor expired"}, 410
+    return response, 200, response_headers(cursor, corrections)
+
+@app.route("/suggest")
+def suggest_endpoint():
+    """
+    Serves completions of a partially typed query, for the typeahead of the
+    search box.
+    """
+    with metrics.timed("/suggest", metrics.REQUEST_SECONDS):
+        return suggest_response(request.args), 200, {"Content-Type": "application/json"}
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """
+    Serves the search latency histograms, candidate set sizes and cache and
+    index statistics of this process in the Prometheus text format.
+    """
+    return metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+@app.route("/ingest", methods=["POST"])
+def ingest():
+    """
+    Adds new parks and reviews to the running index. The body is a JSON object
+    with optional "parks" (entries in the parks_details.json format) and
+    "reviews" (reviews carrying the business_id of an existing park) lists.
+    Only enabled when the INGEST_TOKEN environment variable is set, and the
+    request must carry it in the X-Ingest-Token header. When several workers
+    serve the app, ingests are shared through the park database, and are
+    refused without one.
+    """
+    token = os.environ.get("INGEST_TOKEN")
+    if not token or not hmac.compare_digest(request.headers.get("X-Ingest-Token", "").encode(),
+                                            token.encode()):
+        return {"error": "forbidden"}, 403
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return {"error": "the body must be a JSON object"}, 400
+
+    if database is None and not local_ingest:
+        return {"error": "ingesting while several workers serve needs PARKS_DB_URL"}, 503
 
-    return json_search(text, states, latitude, longitude, distance, good_for_kids)
+    with metrics.timed("/ingest", metrics.REQUEST_SECONDS):
+        with index_lock:
+            # catch up with the ingests of other processes, whose parks the
+            # payload may refer to
+            if database is not None:
+                sync_ingested()
+            # the whole payload is checked before anything is added, so that a
+            # bad entry leaves the index as it was
+            try:
+                new_parks = [(entry['business_id'], helper_functions.park_record(entry),
+                              entry['reviews'])
+                             for entry in payload.get("parks", [])]
+                new_reviews = payload.get("reviews", [])
+                index.check_additions(new_parks, new_reviews)
+            except (KeyError, ValueError, TypeError) as error:
+                return {"error": str(error)}, 400
+            if database is None:
+                for park, record, park_reviews in new_parks:
+                    index.add_park(park, record, park_reviews)
+                for review in new_reviews:
+                    index.add_reviews(review['business_id'], [review])
+            else:
+                # the ingest is stored in one transaction, so that a park
+                # another process already stored is rejected before the index
+                # changes; the refresh below adds it to the index from the
+                # database, in sequence with the ingests of other processes
+                try:
+                    database.add(new_parks, new_reviews)
+                except ValueError as error:
+                    return {"error": str(error)}, 409
+        # the ingest is searchable in this process once the response is sent;
+        # searches meanwhile carry on with the previous search state
+        refresh_index()
+    return {"parks": len(new_parks), "reviews": len(new_reviews)}
 
 # if 'DB_NAME' not in os.environ:
 #     app.run(debug=True,host="0.0.0.0",port=5000)
\ No newline at end of file
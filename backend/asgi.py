@@ -0,0 +1,183 @@
+"""
+ASGI entry point that serves /parks asynchronously and coalesces concurrent
+searches into batches. Incoming searches wait up to BATCH_WINDOW seconds for
+others to arrive and are then scored together by app.json_search_batch, so
+that under load the scoring cost grows with the size of a few matrix
+products rather than with the number of requests.
+
+Run it with an ASGI server, e.g. `uvicorn asgi:application` in the backend
+folder. It accepts the same /parks query parameters and returns the same
+responses and cursors as the Flask app, and also serves /metrics; the page itself and
+/ingest are only served by the Flask app.
+"""
+
+import asyncio
+import json
+import os
+import time
+from urllib.parse import parse_qsl
+
+import app
+import metrics
+import query_cache
+
+# how long a search waits for others to batch with, and the largest batch
+BATCH_WINDOW = float(os.environ.get("BATCH_WINDOW_MS", 5)) / 1000
+MAX_BATCH = int(os.environ.get("MAX_BATCH", 64))
+
+class SearchBatcher(object):
+    """
+    Queue of pending searches, drained by a single background task that
+    answers them in batches in a worker thread and hands every response back
+    to the request that is waiting for it.
+    """
+
+    def __init__(self, window=BATCH_WINDOW, max_batch=MAX_BATCH):
+        self.window = window
+        self.max_batch = max_batch
+        self.queue = None
+        self.task = None
+
+    def start(self):
+        self.queue = asyncio.Queue()
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def search(self, arguments) -> tuple[str, str]:
+        """
+        Function to queue a search, given as a tuple of json_search arguments,
+        and wait for its response and next page cursor.
+        """
+        if self.task is None:
+            self.start()
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((arguments, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            metrics.BATCH_SIZE.observe(len(batch))
+
+            # scoring releases the GIL in numpy and scipy, but runs in a thread
+            # so that the event loop keeps accepting requests meanwhile
+            try:
+                responses = await loop.run_in_executor(
+                    None, app.json_search_batch, [arguments for arguments, _ in batch])
+            except Exception as error:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+            else:
+                # a search that failed fails alone
+                for (_, future), response in zip(batch, responses):
+                    if future.done():
+                        continue
+                    if isinstance(response, Exception):
+                        future.set_exception(response)
+                    else:
+                        future.set_result(response)
+
+batcher = SearchBatcher()
+
+def query_arguments(scope) -> dict[str, str]:
+    # like Flask's request.args.get, the first value of a repeated parameter
+    # wins
+    args = {}
+    for name, value in parse_qsl(scope['query_string'].decode('latin-1'),
+                                 keep_blank_values=True):
+        args.setdefault(name, value)
+    return args
+
+async def send_response(send, status, body, content_type, headers=()):
+    body = body.encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', content_type.encode('latin-1')),
+                    (b'content-length', str(len(body)).encode('latin-1')),
+                    (b'access-control-allow-origin', b'*'),
+                    (b'access-control-expose-headers', b'X-Next-Cursor, X-Query-Corrections')]
+                   + [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+def without_body(send):
+    """
+    Function to wrap send so that response bodies are dropped, for HEAD
+    requests, whose responses carry the headers of the GET response,
+    including its content length, but no body.
+    """
+    async def send_headers(message):
+        if message['type'] == 'http.response.body':
+            message = dict(message, body=b'')
+        await send(message)
+    return send_headers
+
+async def application(scope, receive, send):
+    """
+    The ASGI application.
+    """
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                batcher.start()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await batcher.stop()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    if scope['type'] != 'http':
+        return
+    if scope['method'] == 'HEAD':
+        send = without_body(send)
+    if scope['method'] not in ('GET', 'HEAD'):
+        await send_response(send, 405, '{"error": "method not allowed"}', 'application/json')
+    elif scope['path'] == '/parks':
+        start = time.perf_counter()
+        try:
+            arguments = app.search_arguments(query_arguments(scope))
+        except ValueError as error:
+            await send_response(send, 400, json.dumps({"error": str(error)}), 'application/json')
+            return
+        try:
+            response, cursor, corrections = await batcher.search(arguments)
+        except query_cache.InvalidCursor as error:
+            await send_response(send, 400, json.dumps({"error": str(error)}), 'application/json')
+            return
+        if response is None:
+            await send_response(send, 410, '{"error": "cursor expired"}', 'application/json')
+        else:
+            await send_response(send, 200, response, 'text/html; charset=utf-8',
+                                list(app.response_headers(cursor, corrections).items()))
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - start, '/parks')
+    elif scope['path'] == '/suggest':
+        start = time.perf_counter()
+        await send_response(send, 200, app.suggest_response(query_arguments(scope)),
+                            'application/json')
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - start, '/suggest')
+    elif scope['path'] == '/metrics':
+        await send_response(send, 200, metrics.render(),
+                            'text/plain; version=0.0.4; charset=utf-8')
+    else:
+        await send_response(send, 404, '{"error": "not found"}', 'application/json')
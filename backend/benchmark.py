@@ -0,0 +1,194 @@
+"""
+Script to benchmark index building, app startup and query latency on synthetic
+corpora of increasing size. Each corpus size is measured in a fresh process, so
+that startup time and peak memory are not affected by earlier runs.
+
+Run `python benchmark.py --sizes 266 2000 10000` in the backend folder. Results
+are written as JSON to --output so that runs can be compared for regressions.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+import synthetic_corpus
+
+QUERY_WORDS = synthetic_corpus.PARK_WORDS
+
+# filters applied to the benchmark queries, named by the mix they represent
+FILTER_MIXES = {
+    'none': {},
+    'kids': {'good_for_kids': "yes"},
+    'states': {'locations': ["California", "Florida", "Texas"]},
+    'local': {'distance': "local"},
+    'regional_kids': {'distance': "regional", 'good_for_kids': "yes"},
+    'long': {'distance': "long"},
+    'fly': {'distance': "fly"},
+}
+
+def summarize(samples) -> dict[str, float]:
+    """
+    Function to summarize latency samples, in seconds, as milliseconds.
+    """
+    samples = np.asarray(samples) * 1000
+    return {
+        'n': len(samples),
+        'mean_ms': float(samples.mean()),
+        'p50_ms': float(np.percentile(samples, 50)),
+        'p95_ms': float(np.percentile(samples, 95)),
+        'p99_ms': float(np.percentile(samples, 99)),
+    }
+
+def bench_corpus(n_parks, args) -> dict:
+    """
+    Function to generate a corpus of n_parks parks, build its index, start the
+    app on it and time a mix of queries. Must run in a fresh process, since
+    the app reads the dataset location when it is first imported. The corpus
+    and index are removed afterwards.
+    """
+    with tempfile.TemporaryDirectory(prefix='adventura-bench-') as workdir:
+        return time_corpus(workdir, n_parks, args)
+
+def time_corpus(workdir, n_parks, args) -> dict:
+    """
+    Function to run the benchmark of bench_corpus with its files in workdir.
+    """
+    corpus_path = os.path.join(workdir, 'parks_details.json')
+    index_dir = os.path.join(workdir, 'index')
+    result = {'n_parks': n_parks}
+
+    start = time.perf_counter()
+    result['n_reviews'] = synthetic_corpus.write_corpus(
+        corpus_path, n_parks, reviews_per_park=args.reviews_per_park,
+        words_per_review=args.words_per_review, seed=args.seed)
+    result['generate_seconds'] = time.perf_counter() - start
+
+    os.environ['PARKS_JSON'] = corpus_path
+    os.environ['PARKS_INDEX_DIR'] = index_dir
+    from scipy import sparse
+    import search_index
+    import svd
+
+    start = time.perf_counter()
+    arrays, manifest = search_index.build_index(corpus_path, args.workers)
+    search_index.save_index(arrays, manifest, index_dir)
+    result['build_seconds'] = time.perf_counter() - start
+    result['n_terms'] = manifest['n_terms']
+
+    counts = sparse.csc_matrix((arrays['postings_counts'], arrays['postings_parks'],
+                                arrays['postings_indptr']),
+                               shape=(len(arrays['park_ids']), len(arrays['vocabulary'])))
+    start = time.perf_counter()
+    svd.fit_latent_model(counts, arrays['idf'], manifest['svd'])
+    result['svd_fit_seconds'] = time.perf_counter() - start
+    del arrays, counts
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app
+    result['startup_seconds'] = time.perf_counter() - start
+
+    rng = np.random.default_rng(args.seed)
+    result['queries'] = {}
+    for mix, filters in FILTER_MIXES.items():
+        filter_samples = []
+        search_samples = []
+        cached_samples = []
+        for _ in range(args.queries):
+            query = ' '.join(rng.choice(QUERY_WORDS, size=rng.integers(1, 7)))
+            latitude = float(rng.uniform(25.0, 48.0))
+            longitude = float(rng.uniform(-124.0, -68.0))
+            arguments = dict(filters, latitude=latitude, longitude=longitude) \
+                if 'distance' in filters else dict(filters)
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                app.helper_functions.apply_filters(app.search_state.index,
+                                                   arguments.get('locations'),
+                                                   arguments.get('latitude'),
+                                                   arguments.get('longitude'),
+                                                   arguments.get('distance'),
+                                                   arguments.get('good_for_kids'),
+                                                   app.search_state.locator)
+                filter_samples.append(time.perf_counter() - start)
+
+                app.result_cache.clear()
+                app.rankings.clear()
+                start = time.perf_counter()
+                app.json_search(query, **arguments)
+                search_samples.append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                app.json_search(query, **arguments)
+                cached_samples.append(time.perf_counter() - start)
+        result['queries'][mix] = {
+            'apply_filters': summarize(filter_samples),
+            'search': summarize(search_samples),
+            'cached_search': summarize(cached_samples),
+        }
+
+    # ru_maxrss is reported in kilobytes on Linux and bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result['peak_rss_mb'] = peak_rss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the park search on synthetic corpora.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[266, 2000, 10000],
+                        help="numbers of parks to benchmark")
+    parser.add_argument('--reviews-per-park', type=float, default=5)
+    parser.add_argument('--words-per-review', type=float, default=60)
+    parser.add_argument('--queries', type=int, default=200,
+                        help="queries timed per filter mix")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="processes used to build the index")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--single', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single is not None:
+        result = bench_corpus(args.single, args)
+        with open(args.output, 'w') as file:
+            json.dump(result, file)
+        return
+
+    results = []
+    for n_parks in args.sizes:
+        with tempfile.NamedTemporaryFile(suffix='.json') as result_file:
+            command = [sys.executable, os.path.abspath(__file__), '--single', str(n_parks),
+                       '--reviews-per-park', str(args.reviews_per_park),
+                       '--words-per-review', str(args.words_per_review),
+                       '--queries', str(args.queries), '--workers', str(args.workers),
+                       '--seed', str(args.seed), '--output', result_file.name]
+            subprocess.run(command, check=True, stdout=subprocess.DEVNULL,
+                           cwd=os.path.dirname(os.path.abspath(__file__)))
+            result = json.load(result_file)
+        results.append(result)
+        search = result['queries']['none']['search']
+        print(f"{n_parks:>8} parks {result['n_reviews']:>9} reviews: "
+              f"build {result['build_seconds']:.2f}s, startup {result['startup_seconds']:.2f}s, "
+              f"search p50 {search['p50_ms']:.2f}ms p99 {search['p99_ms']:.2f}ms, "
+              f"peak RSS {result['peak_rss_mb']:.0f}MB")
+
+    with open(args.output, 'w') as file:
+        json.dump({
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'settings': {key: value for key, value in vars(args).items()
+                         if key not in ('output', 'single')},
+            'results': results,
+        }, file, indent=2)
+    print(f"Wrote results to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+"""
+Helper file implementing BM25 ranking over the postings of the search index.
+The postings of each term, sorted by park row, are stored as row gaps and
+counts packed with the fewest bytes that hold the term's values, and are
+split into blocks of BLOCK_SIZE parks, each recording its first and last
+park and an upper bound of its BM25 term frequency factor.
+
+Searches run term at a time with MaxScore pruning: terms are visited from
+the one that can contribute the most down, and once the best parks found so
+far outscore anything the remaining terms could add to an unseen park, the
+remaining terms only decode the blocks holding parks that can still make
+the top results. A selective filter starts the search in that mode, with
+the parks passing the filters as the candidates.
+"""
+
+import numpy as np
+
+# BM25 term frequency saturation and park length normalization; the block
+# bounds saved with the index depend on both, so changing them requires
+# bumping search_index.INDEX_FORMAT_VERSION
+K1 = 1.2
+B = 0.75
+# postings per block
+BLOCK_SIZE = 64
+# filters passing fewer parks than this fraction of a query's postings are
+# traversed park by park from the start
+SELECTIVE_FILTER = 0.25
+# relative slack on pruning comparisons, so that rounding never prunes a park
+# whose score ties the threshold
+PRUNING_SLACK = 1e-9
+
+# byte width of the values of a term, by the largest value it must hold
+WIDTHS = ((1, np.uint8), (2, np.dtype('<u2')), (4, np.dtype('<u4')))
+DTYPES = {width : dtype for width, dtype in WIDTHS}
+
+def pack_values(values, postings_indptr) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Function to pack the values of every term's postings little-endian with
+    the fewest bytes, 1, 2 or 4, that hold all of that term's values, so
+    that any run of a term's postings can be read back as a view. Returns
+    the bytes along with the width of each term.
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    term_sizes = np.diff(postings_indptr)
+    term_terms = np.repeat(np.arange(len(term_sizes)), term_sizes)
+    term_max = np.zeros(len(term_sizes), dtype=np.uint64)
+    np.maximum.at(term_max, term_terms, values)
+    widths = np.select([term_max < 1 << 8, term_max < 1 << 16], [1, 2], 4).astype(np.int64)
+    widths[term_sizes == 0] = 0
+    offsets = value_offsets(widths, term_sizes)
+
+    posting_widths = widths[term_terms]
+    positions = offsets[term_terms] + (np.arange(len(values)) - postings_indptr[term_terms]) \
+        * posting_widths
+    data = np.zeros(int(offsets[-1]), dtype=np.uint8)
+    for byte in range(4):
+        selected = posting_widths > byte
+        data[positions[selected] + byte] = (values[selected] >> np.uint64(8 * byte)) & np.uint64(0xFF)
+    return data, widths.astype(np.uint8)
+
+def value_offsets(widths, term_sizes) -> np.ndarray:
+    """
+    Function to compute the byte offset of every term's packed values.
+    """
+    sizes = np.asarray(widths, dtype=np.int64) * np.asarray(term_sizes, dtype=np.int64)
+    return np.concatenate(([0], np.cumsum(sizes))).astype(np.int64)
+
+def block_indptr(term_sizes) -> np.ndarray:
+    """
+    Function to compute the range of blocks of every term.
+    """
+    indptr = np.zeros(len(term_sizes) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(-(-np.asarray(term_sizes, dtype=np.int64) // BLOCK_SIZE))
+    return indptr
+
+def frequency_factors(counts, lengths, average_length) -> np.ndarray:
+    """
+    Function to compute the BM25 term frequency factor of postings with the
+    given counts in parks of the given lengths, in terms.
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    norms = K1 * (1 - B + B * np.asarray(lengths, dtype=np.float64) / max(average_length, 1e-9))
+    return counts * (K1 + 1) / (counts + norms)
+
+def postings_arrays(postings_indptr, postings_parks, postings_counts, n_parks) -> dict[str, np.ndarray]:
+    """
+    Function to build the blocked, compressed BM25 postings from the postings
+    arrays of the index, along with the length of every park.
+    """
+    postings_indptr = np.asarray(postings_indptr, dtype=np.int64)
+    parks = np.asarray(postings_parks, dtype=np.int64)
+    counts = np.asarray(postings_counts, dtype=np.int64)
+    park_lengths = np.bincount(parks, weights=counts, minlength=n_parks).astype(np.int64)
+    average_length = park_lengths.mean() if n_parks else 1.0
+
+    term_sizes = np.diff(postings_indptr)
+    blocks = block_indptr(term_sizes)
+    block_terms = np.repeat(np.arange(len(term_sizes)), np.diff(blocks))
+    block_starts = postings_indptr[block_terms] \
+        + (np.arange(len(block_terms)) - blocks[block_terms]) * BLOCK_SIZE
+    block_ends = np.minimum(block_starts + BLOCK_SIZE, postings_indptr[block_terms + 1])
+
+    # row gaps restart at zero at the start of every block, whose first row
+    # is stored separately
+    gaps = np.diff(parks, prepend=0)
+    gaps[block_starts] = 0
+    gap_bytes, gap_widths = pack_values(gaps, postings_indptr)
+    count_bytes, count_widths = pack_values(counts, postings_indptr)
+    factors = frequency_factors(counts, park_lengths[parks], average_length)
+    # single precision bounds, rounded up so that they remain bounds
+    block_max = np.maximum.reduceat(factors, block_starts) if len(block_starts) else np.zeros(0)
+    rounded_max = block_max.astype(np.float32)
+    low = rounded_max < block_max
+    rounded_max[low] = np.nextafter(rounded_max[low], np.float32(np.inf))
+
+    return {
+        'park_lengths': park_lengths,
+        'bm25_block_first': parks[block_starts].astype(np.int32),
+        'bm25_block_last': parks[block_ends - 1].astype(np.int32),
+        'bm25_block_max': rounded_max,
+        'bm25_gap_widths': gap_widths,
+        'bm25_gap_bytes': gap_bytes,
+        'bm25_count_widths': count_widths,
+        'bm25_count_bytes': count_bytes,
+    }
+
+class BM25Scorer(object):
+    """
+    Ranks parks by BM25 over the compressed postings of a search index.
+    Queries are passed as dictionaries mapping vocabulary columns to counts
+    (see helper_functions.query_term_counts).
+    """
+
+    def __init__(self, index):
+        self.n_parks = len(index.park_ids)
+        self.park_lengths = np.asarray(index.park_lengths)
+        self.average_length = self.park_lengths.mean() if self.n_parks else 1.0
+        self.block_first = np.asarray(index.bm25_block_first)
+        self.block_last = np.asarray(index.bm25_block_last)
+        self.block_max = np.asarray(index.bm25_block_max, dtype=np.float64)
+        self.gap_bytes = index.bm25_gap_bytes
+        self.count_bytes = index.bm25_count_bytes
+
+        # the number of parks holding each term gives the BM25 idf, and the
+        # blocks of every term and the offsets of its values follow from it
+        term_sizes = np.diff(np.asarray(index.postings_indptr))
+        self.term_sizes = term_sizes
+        self.block_indptr = block_indptr(term_sizes)
+        self.gap_offsets = value_offsets(index.bm25_gap_widths, term_sizes)
+        self.count_offsets = value_offsets(index.bm25_count_widths, term_sizes)
+        self.idf = np.log1p((self.n_parks - term_sizes + 0.5) / (term_sizes + 0.5))
+        block_terms = np.repeat(np.arange(len(term_sizes)), np.diff(self.block_indptr))
+        block_ranks = np.arange(len(block_terms)) - self.block_indptr[block_terms]
+        self.block_sizes = np.minimum(term_sizes[block_terms] - block_ranks * BLOCK_SIZE, BLOCK_SIZE)
+        self.term_max = np.zeros(len(term_sizes))
+        if len(block_terms):
+            nonempty = term_sizes > 0
+            self.term_max[nonempty] = np.maximum.reduceat(self.block_max,
+                                                          self.block_indptr[:-1][nonempty])
+
+    def decode(self, term, blocks, weight) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Function to decode the given blocks of term, in ascending order,
+        returning the park rows of their postings and the weighted BM25 score
+        of each.
+        """
+        gaps = self._values(self.gap_bytes, self.gap_offsets, term)
+        counts = self._values(self.count_bytes, self.count_offsets, term)
+        sizes = self.block_sizes[blocks]
+        if len(blocks) < self.block_indptr[term + 1] - self.block_indptr[term]:
+            # the positions of the blocks' postings among the term's postings
+            starts = np.repeat((blocks - self.block_indptr[term]) * BLOCK_SIZE, sizes)
+            block_offsets = np.cumsum(sizes) - sizes
+            positions = starts + np.arange(len(starts)) - np.repeat(block_offsets, sizes)
+            gaps, counts = gaps[positions], counts[positions]
+        sums = np.cumsum(gaps, dtype=np.int64)
+        rows = np.repeat(self.block_first[blocks], sizes) + sums \
+            - np.repeat(sums[np.cumsum(sizes) - sizes], sizes)
+        return rows, weight * frequency_factors(counts, self.park_lengths[rows], self.average_length)
+
+    def _values(self, data, offsets, term) -> np.ndarray:
+        # the packed values of term, viewed with their width
+        start, end = int(offsets[term]), int(offsets[term + 1])
+        width = (end - start) // int(self.term_sizes[term])
+        return np.asarray(data[start:end]).view(DTYPES[width])
+
+    def search(self, query_counts, n, mask=None) -> tuple[np.ndarray, np.ndarray, int]:
+        """
+        Function to score the parks passing mask, a boolean array over the
+        park rows, against query_counts, pruning the parks that cannot make
+        the best n. Returns the rows and scores of a set of parks containing
+        the best n, with complete scores for those, and the number of
+        postings decoded.
+        """
+        terms = [term for term in query_counts if self.term_sizes[term] > 0]
+        weights = {term : query_counts[term] * self.idf[term] for term in terms}
+        bounds = {term : weights[term] * self.term_max[term] for term in terms}
+        terms.sort(key=lambda term: (-bounds[term], term))
+        remaining = sum(bounds.values())
+
+        allowed = np.arange(self.n_parks) if mask is None else np.flatnonzero(mask)
+        scores = np.zeros(self.n_parks)
+        # parks that may still make the best n, in ascending order; None while
+        # any allowed park may
+        candidates = None
+        if mask is not None and len(allowed) < SELECTIVE_FILTER * sum(self.term_sizes[terms]):
+            candidates = allowed
+        # the best n parks so far, and the lowest of their scores, below which
+        # a park cannot make the best n
+        best = np.zeros(0, dtype=np.int64)
+        threshold = 0.0
+        decoded = 0
+
+        for term in terms:
+            if candidates is not None and len(candidates) == 0:
+                break
+            remaining -= bounds[term]
+            cutoff = threshold * (1 - PRUNING_SLACK)
+            first, end = self.block_indptr[term], self.block_indptr[term + 1]
+            if candidates is None:
+                rows, term_scores = self.decode(term, np.arange(first, end), weights[term])
+                decoded += len(rows)
+                if mask is not None:
+                    keep = mask[rows]
+                    rows, term_scores = rows[keep], term_scores[keep]
+            else:
+                # the blocks holding a candidate that could still reach the
+                # threshold with the block's best score
+                blocks = first + np.searchsorted(self.block_last[first:end], candidates)
+                inside = blocks < end
+                inside[inside] &= self.block_first[blocks[inside]] <= candidates[inside]
+                reachable = scores[candidates[inside]] + remaining \
+                    + weights[term] * self.block_max[blocks[inside]] >= cutoff
+                blocks = np.unique(blocks[inside][reachable])
+                if len(blocks) == 0:
+                    continue
+                rows, term_scores = self.decode(term, blocks, weights[term])
+                decoded += len(rows)
+                positions = np.minimum(np.searchsorted(candidates, rows), len(candidates) - 1)
+                keep = candidates[positions] == rows
+                rows, term_scores = rows[keep], term_scores[keep]
+            scores[rows] += term_scores
+
+            # parks outside the best n whose scores did not change cannot
+            # overtake them, so the new best n are among the old ones and the
+            # best n of the parks just scored
+            if len(rows) > n > 0:
+                rows = rows[np.argpartition(-scores[rows], n - 1)[:n]]
+            pool = np.union1d(best, rows)
+            if len(pool) >= n > 0:
+                best = pool[np.argpartition(-scores[pool], n - 1)[:n]]
+                threshold = max(threshold, scores[best].min())
+            if threshold <= 0:
+                continue
+            # a park is dropped once even the remaining terms cannot lift it to
+            # the threshold; parks no term has reached yet are all dropped at
+            # once when the remaining terms cannot lift a park from zero
+            cutoff = threshold * (1 - PRUNING_SLACK)
+            if candidates is None and cutoff > remaining:
+                candidates = allowed[scores[allowed] + remaining >= cutoff]
+            elif candidates is not None:
+                candidates = candidates[scores[candidates] + remaining >= cutoff]
+
+        rows = allowed if candidates is None else candidates
+        return rows, scores[rows], decoded
@@ -0,0 +1,523 @@
+"""
+Helper file implementing the crawler that builds the parks dataset. A list
+page is fetched for links to the detail page of each park, the detail pages
+are fetched concurrently, and each page is parsed as soon as it arrives into
+an entry of the parks_details.json schema and streamed to the output file.
+
+Detail pages are parsed from their schema.org JSON-LD (an AmusementPark,
+TouristAttraction or other LocalBusiness, with its address, geo coordinates,
+aggregate rating, amenity features and reviews), which is how review and
+listing sites describe places. A page whose JSON-LD lacks the name or the
+coordinates falls back to its first heading and its geo microformat
+coordinates, as found on Wikipedia articles.
+
+Every response is kept in a content-addressed cache on disk, so rerunning a
+crawl only fetches pages that are not cached yet. Run
+`python crawler.py <list url> --output parks_details.json` in the backend
+folder.
+"""
+
+import argparse
+import asyncio
+import collections
+import hashlib
+import html.parser
+import json
+import logging
+import os
+import random
+import re
+import tempfile
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'crawl_cache')
+USER_AGENT = "parks-crawler/1.0"
+# requests in flight at once, across every host
+MAX_CONNECTIONS = 8
+# requests started per second against any one host
+HOST_RATE = 2.0
+# attempts per page, and the delay before the first retry, doubled after
+# every further failure
+MAX_ATTEMPTS = 4
+BACKOFF_SECONDS = 1.0
+REQUEST_TIMEOUT = 30
+# statuses worth retrying; other errors are final
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# schema.org types of the entities a detail page may describe
+PLACE_TYPES = {'AmusementPark', 'TouristAttraction', 'LocalBusiness', 'Place',
+               'Park', 'WaterPark', 'Zoo', 'Aquarium', 'EntertainmentBusiness'}
+
+STATE_NAMES = {
+    'AL': 'Alabama', 'AK': 'Alaska', 'AZ': 'Arizona', 'AR': 'Arkansas',
+    'CA': 'California', 'CO': 'Colorado', 'CT': 'Connecticut', 'DE': 'Delaware',
+    'DC': 'District of Columbia', 'FL': 'Florida', 'GA': 'Georgia', 'HI': 'Hawaii',
+    'ID': 'Idaho', 'IL': 'Illinois', 'IN': 'Indiana', 'IA': 'Iowa', 'KS': 'Kansas',
+    'KY': 'Kentucky', 'LA': 'Louisiana', 'ME': 'Maine', 'MD': 'Maryland',
+    'MA': 'Massachusetts', 'MI': 'Michigan', 'MN': 'Minnesota', 'MS': 'Mississippi',
+    'MO': 'Missouri', 'MT': 'Montana', 'NE': 'Nebraska', 'NV': 'Nevada',
+    'NH': 'New Hampshire', 'NJ': 'New Jersey', 'NM': 'New Mexico', 'NY': 'New York',
+    'NC': 'North Carolina', 'ND': 'North Dakota', 'OH': 'Ohio', 'OK': 'Oklahoma',
+    'OR': 'Oregon', 'PA': 'Pennsylvania', 'RI': 'Rhode Island', 'SC': 'South Carolina',
+    'SD': 'South Dakota', 'TN': 'Tennessee', 'TX': 'Texas', 'UT': 'Utah',
+    'VT': 'Vermont', 'VA': 'Virginia', 'WA': 'Washington', 'WV': 'West Virginia',
+    'WI': 'Wisconsin', 'WY': 'Wyoming',
+}
+
+Response = collections.namedtuple('Response', ['url', 'status', 'content_type', 'body'])
+
+class FetchError(Exception):
+    pass
+
+class HTTPCache(object):
+    """
+    On-disk HTTP cache. Bodies are stored once under the SHA-256 of their
+    content, and each URL maps to a small entry naming its body, so pages
+    with identical content share storage. Files are written to a temporary
+    name and renamed into place, so an interrupted crawl never leaves a
+    partial entry behind.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR):
+        self.directory = directory
+        os.makedirs(os.path.join(directory, 'objects'), exist_ok=True)
+        os.makedirs(os.path.join(directory, 'urls'), exist_ok=True)
+
+    def _url_path(self, url):
+        return os.path.join(self.directory, 'urls', hashlib.sha256(url.encode('utf-8')).hexdigest() + '.json')
+
+    def _object_path(self, digest):
+        return os.path.join(self.directory, 'objects', digest[:2], digest[2:])
+
+    def get(self, url):
+        """
+        Returns the cached Response for url, or None if it is not cached.
+        """
+        try:
+            with open(self._url_path(url), 'r', encoding='utf-8') as file:
+                entry = json.load(file)
+            with open(self._object_path(entry['body']), 'rb') as file:
+                body = file.read()
+        except (OSError, ValueError, KeyError):
+            return None
+        return Response(url, entry['status'], entry['content_type'], body)
+
+    def put(self, response):
+        """
+        Function to store response, replacing any cached response for its URL.
+        """
+        digest = hashlib.sha256(response.body).hexdigest()
+        object_path = self._object_path(digest)
+        if not os.path.exists(object_path):
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            self._write(object_path, response.body)
+        entry = {
+            'url': response.url,
+            'status': response.status,
+            'content_type': response.content_type,
+            'body': digest,
+            'fetched': time.time(),
+        }
+        self._write(self._url_path(response.url), json.dumps(entry).encode('utf-8'))
+
+    def _write(self, path, data):
+        descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(descriptor, 'wb') as file:
+                file.write(data)
+            os.replace(temporary_path, path)
+        except BaseException:
+            os.unlink(temporary_path)
+            raise
+
+class HostRateLimiter(object):
+    """
+    Spaces out the requests started against each host so that no host sees
+    more than rate requests per second, while requests to different hosts
+    proceed independently.
+    """
+
+    def __init__(self, rate=HOST_RATE):
+        self.interval = 1.0 / rate
+        self.next_start = {}
+        self.locks = collections.defaultdict(asyncio.Lock)
+
+    async def wait(self, host):
+        async with self.locks[host]:
+            loop = asyncio.get_running_loop()
+            delay = self.next_start.get(host, 0.0) - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.next_start[host] = loop.time() + self.interval
+
+class Fetcher(object):
+    """
+    Fetches pages through the cache, with at most max_connections requests
+    in flight, per host rate limiting, and retries with exponential backoff
+    on connection errors and on the statuses in RETRY_STATUSES. Requests are
+    made with urllib, which blocks, in the threads of the event loop's
+    default executor.
+    """
+
+    def __init__(self, cache, max_connections=MAX_CONNECTIONS, host_rate=HOST_RATE,
+                 max_attempts=MAX_ATTEMPTS, backoff=BACKOFF_SECONDS):
+        self.cache = cache
+        self.max_connections = max_connections
+        self.semaphore = asyncio.Semaphore(max_connections)
+        self.limiter = HostRateLimiter(host_rate)
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.stats = collections.Counter()
+
+    async def fetch(self, url) -> Response:
+        """
+        Function to fetch url, from the cache if it is cached. Raises
+        FetchError once every attempt has failed.
+        """
+        response = self.cache.get(url)
+        if response is not None:
+            self.stats['cached'] += 1
+            return response
+        host = urllib.parse.urlsplit(url).netloc
+        for attempt in range(self.max_attempts):
+            retry_after = None
+            async with self.semaphore:
+                await self.limiter.wait(host)
+                try:
+                    response = await asyncio.to_thread(_get, url)
+                except urllib.error.HTTPError as error:
+                    if error.code not in RETRY_STATUSES:
+                        self.stats['failed'] += 1
+                        raise FetchError(f"{url}: HTTP {error.code}") from error
+                    failure = f"HTTP {error.code}"
+                    retry_after = _retry_after(error.headers.get('Retry-After'))
+                except (urllib.error.URLError, OSError) as error:
+                    failure = str(error)
+                else:
+                    self.stats['fetched'] += 1
+                    self.cache.put(response)
+                    return response
+            if attempt + 1 < self.max_attempts:
+                delay = retry_after if retry_after is not None else \
+                    self.backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+                logger.info("retrying %s in %.1fs after %s", url, delay, failure)
+                self.stats['retried'] += 1
+                await asyncio.sleep(delay)
+        self.stats['failed'] += 1
+        raise FetchError(f"{url}: {failure} after {self.max_attempts} attempts")
+
+def _get(url) -> Response:
+    request = urllib.request.Request(url, headers={'User-Agent': USER_AGENT})
+    with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT) as response:
+        return Response(url, response.status, response.headers.get('Content-Type', ''), response.read())
+
+def _retry_after(value):
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+def page_text(response) -> str:
+    match = re.search(r'charset=([\w-]+)', response.content_type or '')
+    try:
+        return response.body.decode(match.group(1) if match else 'utf-8', errors='replace')
+    except LookupError:
+        return response.body.decode('utf-8', errors='replace')
+
+class PageParser(html.parser.HTMLParser):
+    """
+    Collects the links, the JSON-LD blocks, the first heading and the geo
+    microformat coordinates of a page in one pass.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.links = []
+        self.json_ld = []
+        self.heading = None
+        self.geo = None
+        self._capture = None
+        self._tag = None
+        self._buffer = []
+        self._depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if self._capture is not None:
+            if tag == self._tag:
+                self._depth += 1
+            return
+        if tag == 'a' and attrs.get('href'):
+            self.links.append(attrs['href'])
+        elif tag == 'script' and attrs.get('type') == 'application/ld+json':
+            self._start('json_ld', tag)
+        elif tag == 'h1' and self.heading is None:
+            self._start('heading', tag)
+        elif tag == 'span' and 'geo' in (attrs.get('class') or '').split() and self.geo is None:
+            self._start('geo', tag)
+
+    def handle_endtag(self, tag):
+        if self._capture is None or tag != self._tag:
+            return
+        if self._depth:
+            self._depth -= 1
+        else:
+            text = ''.join(self._buffer).strip()
+            if self._capture == 'json_ld':
+                self.json_ld.append(text)
+            elif self._capture == 'heading':
+                self.heading = text
+            else:
+                self.geo = text
+            self._capture = None
+            self._tag = None
+
+    def handle_data(self, data):
+        if self._capture is not None:
+            self._buffer.append(data)
+
+    def _start(self, capture, tag):
+        self._capture = capture
+        self._tag = tag
+        self._buffer = []
+        self._depth = 0
+
+def parse_page(response) -> PageParser:
+    parser = PageParser()
+    parser.feed(page_text(response))
+    parser.close()
+    return parser
+
+def detail_links(response, link_pattern) -> list[str]:
+    """
+    Function to extract the absolute URLs of the links of a list page
+    matching link_pattern, a regular expression, in page order and without
+    duplicates or fragments.
+    """
+    pattern = re.compile(link_pattern)
+    links = {}
+    for href in parse_page(response).links:
+        url = urllib.parse.urldefrag(urllib.parse.urljoin(response.url, href))[0]
+        if pattern.search(url):
+            links.setdefault(url, None)
+    return list(links)
+
+def _places(node):
+    # every object of a JSON-LD document, including those inside @graph
+    if isinstance(node, list):
+        for item in node:
+            yield from _places(item)
+    elif isinstance(node, dict):
+        yield node
+        yield from _places(node.get('@graph', []))
+
+def _is_place(node):
+    types = node.get('@type', [])
+    types = types if isinstance(types, list) else [types]
+    return any(place_type in PLACE_TYPES for place_type in types)
+
+def _number(value, kind=float):
+    try:
+        return kind(value)
+    except (TypeError, ValueError):
+        return None
+
+def _text(value):
+    if isinstance(value, dict):
+        value = value.get('name')
+    return value.strip() if isinstance(value, str) else None
+
+def _state(region):
+    region = _text(region)
+    if region is None:
+        return None
+    return STATE_NAMES.get(region.upper(), region)
+
+def park_entry(response) -> dict:
+    """
+    Function to parse a detail page into an entry of the parks_details.json
+    schema. Returns None if the page does not name a park with a state and
+    coordinates, which every park in the dataset needs.
+    """
+    page = parse_page(response)
+    place = {}
+    for block in page.json_ld:
+        try:
+            document = json.loads(block)
+        except ValueError:
+            continue
+        place = next((node for node in _places(document) if _is_place(node)), place)
+        if place:
+            break
+
+    address = place.get('address') or {}
+    address = address if isinstance(address, dict) else {'streetAddress': address}
+    geo = place.get('geo') or {}
+    latitude = _number(geo.get('latitude'))
+    longitude = _number(geo.get('longitude'))
+    if (latitude is None or longitude is None) and page.geo:
+        coordinates = re.findall(r'-?\d+(?:\.\d+)?', page.geo)
+        if len(coordinates) >= 2:
+            latitude, longitude = float(coordinates[0]), float(coordinates[1])
+    name = _text(place.get('name')) or page.heading
+    state = _state(address.get('addressRegion'))
+    if not name or not state or latitude is None or longitude is None:
+        return None
+
+    identifier = place.get('identifier') or place.get('@id') or response.url
+    business_id = identifier if isinstance(identifier, str) and len(identifier) <= 64 \
+        else hashlib.sha256(str(identifier).encode('utf-8')).hexdigest()[:32]
+    rating = place.get('aggregateRating') or {}
+    image = place.get('image')
+    image = image[0] if isinstance(image, list) and image else image
+    image = image.get('url') if isinstance(image, dict) else image
+
+    attributes = {}
+    features = place.get('amenityFeature') or []
+    for feature in features if isinstance(features, list) else [features]:
+        if isinstance(feature, dict) and _text(feature.get('name')):
+            attributes[_text(feature.get('name'))] = str(bool(feature.get('value', True)))
+
+    reviews = []
+    place_reviews = place.get('review') or []
+    for position, review in enumerate(place_reviews if isinstance(place_reviews, list) else [place_reviews]):
+        if not isinstance(review, dict) or not _text(review.get('reviewBody')):
+            continue
+        reviews.append({
+            'review_id': review.get('@id') or f"{business_id}-{position}",
+            'user_id': _text(review.get('author')) or "",
+            'business_id': business_id,
+            'stars': _number((review.get('reviewRating') or {}).get('ratingValue')) or 0,
+            'useful': 0,
+            'funny': 0,
+            'cool': 0,
+            'text': _text(review.get('reviewBody')),
+            'date': review.get('datePublished', ""),
+        })
+
+    street = _text(address.get('streetAddress'))
+    city = _text(address.get('addressLocality'))
+    postal_code = _text(address.get('postalCode'))
+    return {
+        'business_id': business_id,
+        'name': name,
+        'address': ", ".join(part for part in (street, city, address.get('addressRegion'), postal_code)
+                             if isinstance(part, str) and part),
+        'city': city,
+        'state': state,
+        'postal_code': postal_code,
+        'latitude': latitude,
+        'longitude': longitude,
+        'stars': _number(rating.get('ratingValue')),
+        'review_count': _number(rating.get('reviewCount') or rating.get('ratingCount'), int) or len(reviews),
+        'is_open': 1,
+        'attributes': attributes,
+        'reviews': reviews,
+        'image_url': image if isinstance(image, str) else None,
+        'website_url': place.get('url') if isinstance(place.get('url'), str) else response.url,
+    }
+
+class DatasetWriter(object):
+    """
+    Writes parks to a JSON list one entry at a time, in the layout of
+    parks_details.json, so that the crawl never holds the dataset in memory.
+    The file is written under a temporary name and renamed into place once
+    complete.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        descriptor, self.temporary_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+        self.file = os.fdopen(descriptor, 'w', encoding='utf-8')
+        self.file.write('[')
+        self.count = 0
+
+    def write(self, entry):
+        self.file.write(',\n' if self.count else '\n')
+        self.file.write(json.dumps(entry, indent=2))
+        self.count += 1
+
+    def close(self):
+        self.file.write('\n]\n')
+        self.file.close()
+        os.replace(self.temporary_path, self.path)
+
+    def abort(self):
+        self.file.close()
+        os.unlink(self.temporary_path)
+
+async def crawl(list_urls, output_path, link_pattern, cache=None, fetcher=None) -> collections.Counter:
+    """
+    Function to crawl the detail pages linked from list_urls whose URLs match
+    link_pattern, writing the parks parsed from them to output_path in the
+    order they are linked. Up to a few times as many pages as there are
+    connections are fetched ahead of the page being written. Pages that fail
+    to fetch or do not describe a park are skipped. Returns the crawl's
+    statistics.
+    """
+    fetcher = fetcher or Fetcher(cache or HTTPCache())
+    urls = {}
+    for response in await asyncio.gather(*(fetcher.fetch(url) for url in list_urls)):
+        for url in detail_links(response, link_pattern):
+            urls.setdefault(url, None)
+    logger.info("found %d detail pages", len(urls))
+
+    window = 4 * fetcher.max_connections
+    pending = collections.deque()
+    remaining = iter(urls)
+    writer = DatasetWriter(output_path)
+    try:
+        while True:
+            while len(pending) < window:
+                url = next(remaining, None)
+                if url is None:
+                    break
+                pending.append((url, asyncio.ensure_future(fetcher.fetch(url))))
+            if not pending:
+                break
+            url, task = pending.popleft()
+            try:
+                entry = park_entry(await task)
+            except FetchError as error:
+                logger.warning("skipping %s", error)
+                continue
+            if entry is None:
+                fetcher.stats['unparsed'] += 1
+                logger.warning("skipping %s, which does not describe a park", url)
+                continue
+            writer.write(entry)
+    except BaseException:
+        for _, task in pending:
+            task.cancel()
+        writer.abort()
+        raise
+    writer.close()
+    fetcher.stats['parks'] = writer.count
+    return fetcher.stats
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    parser = argparse.ArgumentParser(description="Crawl park detail pages into a parks dataset.")
+    parser.add_argument('list_urls', nargs='+', help="pages linking to the park detail pages")
+    parser.add_argument('--output', default='parks_details.json', help="path to write the dataset to")
+    parser.add_argument('--link-pattern', default=r'/wiki/(?!\w+:)',
+                        help="regular expression matching the URLs of detail pages")
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help="directory of the HTTP cache")
+    parser.add_argument('--connections', type=int, default=MAX_CONNECTIONS,
+                        help="requests in flight at once")
+    parser.add_argument('--host-rate', type=float, default=HOST_RATE,
+                        help="requests per second per host")
+    args = parser.parse_args()
+
+    async def main():
+        fetcher = Fetcher(HTTPCache(args.cache_dir), args.connections, args.host_rate)
+        return await crawl(args.list_urls, args.output, args.link_pattern, fetcher=fetcher)
+
+    stats = asyncio.run(main())
+    logger.info("wrote %d parks to %s (%d fetched, %d cached, %d retried, %d failed, %d unparsed)",
+                stats['parks'], args.output, stats['fetched'], stats['cached'],
+                stats['retried'], stats['failed'], stats['unparsed'])
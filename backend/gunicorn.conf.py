@@ -0,0 +1,44 @@
+"""
+Gunicorn settings for serving the app with several pre-forked workers, read
+automatically by `gunicorn app:app` in the backend folder.
+
+The app is loaded once in the master process, which builds the search index
+artifact if it is missing or stale, before the workers are forked. The index
+arrays are memory-mapped from that artifact, so every worker reads the same
+pages of the OS page cache and additional workers add next to no index
+memory. The remaining Python objects created at startup are moved out of the
+garbage collector's reach before forking, so that collections in the workers
+do not write to, and thereby copy, the pages they share with the master.
+"""
+
+import gc
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("WEB_CONCURRENCY", 4))
+preload_app = True
+
+# this file is read before the app is loaded; hold off collections until the
+# app has loaded, since they would leave holes in the pages the workers share
+gc.disable()
+
+def when_ready(server):
+    # runs in the master after the app has loaded and before any worker is
+    # forked; what the app loads on demand is loaded here once, for every
+    # worker to share, and frozen objects are never examined by later
+    # collections
+    import app
+    app.warm_up()
+    gc.freeze()
+    gc.enable()
+
+def post_fork(server, worker):
+    # connections the master opened to the park database cannot be shared
+    # across processes; give each worker a pool of its own connections
+    import app
+    if app.database is not None:
+        app.database.engine.dispose(close=False)
+    # without a database, what one worker ingests would never reach the
+    # others
+    elif server.cfg.workers > 1:
+        app.local_ingest = False
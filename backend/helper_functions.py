@@ -4,172 +4,262 @@ and cosine similarity calculations.
 """
 
 import json
+import logging
 import os
-from nltk import NLTKWordTokenizer, PorterStemmer
-from nltk.corpus import stopwords
-from geopy.distance import geodesic
+from functools import lru_cache
+import numpy as np
 import re
-import nltk
-nltk.download('stopwords')
-STOPWORDS = set(stopwords.words("english"))
+import park_store
+import spatial
+
+logger = logging.getLogger(__name__)
 
 # Get the directory of the current script
 current_directory = os.path.dirname(os.path.abspath(__file__))
 
-# Specify the path to the JSON file relative to the current script
-json_file_path = os.path.join(current_directory, 'parks_details.json')
-
-with open(json_file_path, 'r') as file:
-    data = json.load(file)
-    park_dict = {}
-    for entry in data:
-        park_dict[entry['business_id']] = {
-            'name': entry['name'],
-            'state': entry['state'],
-            'reviews': entry['reviews'],
-            'latitude': entry['latitude'],
-            'longitude': entry['longitude'],
-            'image_url': entry.get('image_url'),
-            'website_url': entry.get('website_url'),
-        }
-        # if good for kids is in attributes, add it to the dictionary
-        if entry['attributes'] and 'GoodForKids' in entry['attributes']:
-            park_dict[entry['business_id']]['good_for_kids'] = entry['attributes']['GoodForKids']
-        else:
-            park_dict[entry['business_id']]['good_for_kids'] = "False"
-
-def apply_filters(parks, park_token_dict, locations=None, latitude=None, longitude=None, distance=None, good_for_kids=None):
-    """
-    Function to apply location and good for kids filters to the park dictionary.
-    """
-    print(f"Length of parks dictionary: {len(parks)}")
-    print(f"Length of park_token_dict: {len(park_token_dict)}")
+# Specify the path to the JSON file relative to the current script; PARKS_JSON
+# points the app at another dataset, such as a synthetic benchmark corpus
+json_file_path = os.environ.get('PARKS_JSON',
+                                os.path.join(current_directory, 'parks_details.json'))
+
+# characters read from the dataset at a time while streaming its entries
+READ_CHUNK_SIZE = 1 << 20
+
+def iter_parks(json_file_path):
+    """
+    Function to stream the entries of the dataset at json_file_path, a JSON
+    list of park objects, one at a time, so that only the entry being parsed
+    is held in memory rather than the whole dataset.
+    """
+    decoder = json.JSONDecoder()
+    with open(json_file_path, 'r', encoding='utf-8') as file:
+        buffer = ''
+        position = 0
+        started = False
+        exhausted = False
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position < len(buffer):
+                if not started:
+                    if buffer[position] != '[':
+                        raise ValueError(f"{json_file_path} does not hold a JSON list")
+                    started = True
+                    position += 1
+                    continue
+                if buffer[position] == ']':
+                    return
+                try:
+                    entry, end = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    # the entry continues past the end of the buffer
+                    if exhausted:
+                        raise
+                else:
+                    position = end
+                    yield entry
+                    continue
+            elif exhausted:
+                raise ValueError(f"{json_file_path} ends before its JSON list is closed")
+            chunk = file.read(READ_CHUNK_SIZE)
+            exhausted = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+
+def park_record(entry) -> dict:
+    """
+    Function to extract the attributes the app uses from one park entry of
+    parks_details.json. Review texts are not kept; they are served from the
+    review store of the search index.
+    """
+    record = {
+        'name': entry['name'],
+        'state': entry['state'],
+        'latitude': entry['latitude'],
+        'longitude': entry['longitude'],
+        'image_url': entry.get('image_url'),
+        'website_url': entry.get('website_url'),
+    }
+    # if good for kids is in attributes, add it to the dictionary
+    if entry.get('attributes') and 'GoodForKids' in entry['attributes']:
+        record['good_for_kids'] = entry['attributes']['GoodForKids']
+    else:
+        record['good_for_kids'] = "False"
+    return record
+
+def apply_filters(index, locations=None, latitude=None, longitude=None, distance=None, good_for_kids=None, locator=None) -> np.ndarray:
+    """
+    Function to apply location, distance and good for kids filters to the parks
+    of index, using its columnar park metadata. Returns a boolean mask over
+    the park rows marking the parks that pass every filter. The distance
+    filter is answered by locator, a spatial.ParkLocator over the parks of
+    index, which is built on the fly if not given.
+    """
+    n_parks = len(index.park_ids)
+    mask = np.ones(n_parks, dtype=bool)
 
     # filter by location
-    if (parks.items() is None):
-        print("No parks found")
-        return {}
     if locations is not None and len(locations) > 0:
-        parks = {k: v for (k, v) in parks.items() if v['state'] in locations}
-        # park_token_dict = {k: v for (k, v) in park_token_dict.items() if parks[k]['state'] in locations}
+        state_codes = np.flatnonzero(np.isin(index.state_names, locations))
+        mask &= np.isin(index.park_state_codes, state_codes)
+
+    # filter by good for kids
+    if good_for_kids == "yes":
+        mask &= park_store.unpack_flags(index.park_kids_bits, n_parks)
 
     # filter by distance
     if latitude and longitude and distance:
-        f_parks = {}
-        for k, v in parks.items():
-            coord1 = (latitude, longitude)
-            coord2 = (v['latitude'], v['longitude'])
-            calc_dist = geodesic(coord1, coord2).miles
-
-            # print(f"Distance to park {k} (state {v['state']}): {calc_dist} miles")
-            if distance == "local" and calc_dist <= 100:
-                f_parks[k] = v
-            elif distance == "regional" and calc_dist <= 250:
-                f_parks[k] = v
-            elif distance == "long" and calc_dist <= 500:
-                f_parks[k] = v
-            elif distance == "fly":
-                f_parks[k] = v
-
-        parks = f_parks
+        if locator is None:
+            locator = spatial.ParkLocator(index.park_latitudes, index.park_longitudes)
+        mask &= locator.distance_mask(latitude, longitude, distance)
 
-    # filter by good for kids
-    if good_for_kids == "yes":
-        parks = {k: v for (k, v) in parks.items() if v['good_for_kids'] == "True"}
-        # park_token_dict = {k: v for (k, v) in park_token_dict.items() if parks[k]['good_for_kids'] == "True"}
+    logger.debug("%d candidate parks", int(mask.sum()))
+    return mask
 
-    park_token_dict = {k: v for (k, v) in park_token_dict.items() if k in parks}
-    return parks, park_token_dict
+# one tokenizer and stemmer shared by every call to tokenize, created on first
+# use by load_tokenizer, since importing nltk takes longer than the rest of
+# startup put together
+TOKENIZER = None
+STEMMER = None
+STEM_CACHE_SIZE = 1 << 16
+# English stopwords dropped by tokenize; the search index is built with
+# NLTK's list and bundles it, and loading the index sets it from there, so
+# that serving never needs the NLTK data or the network
+STOPWORDS = None
 
-def tokenize(text):
-    stemmer = PorterStemmer()
-    tokenizer = NLTKWordTokenizer()
-    tokens = tokenizer.tokenize(text.lower())
+def load_tokenizer():
+    """
+    Function to create the shared tokenizer and stemmer if they do not exist
+    yet. Neither needs any NLTK data.
+    """
+    global TOKENIZER, STEMMER
+    if TOKENIZER is None:
+        from nltk import NLTKWordTokenizer, PorterStemmer
+        STEMMER = PorterStemmer()
+        TOKENIZER = NLTKWordTokenizer()
+
+def stopword_list() -> list[str]:
+    """
+    Function to read NLTK's English stopword list, downloading the NLTK
+    stopwords corpus only if it is not installed. Only building the index
+    needs it; the index bundles the list.
+    """
+    import nltk
+    try:
+        nltk.data.find('corpora/stopwords')
+    except LookupError:
+        nltk.download('stopwords', quiet=True)
+    from nltk.corpus import stopwords
+    return sorted(set(stopwords.words("english")))
 
+def use_stopwords(words):
+    """
+    Function to set the stopwords dropped by tokenize.
+    """
+    global STOPWORDS
+    STOPWORDS = frozenset(words)
+    normalize_token.cache_clear()
+
+@lru_cache(maxsize=STEM_CACHE_SIZE)
+def normalize_token(token):
+    """
+    Function to strip non-word characters from a lowercased surface token and
+    stem it. Returns None for tokens that are empty or stopwords. Results are
+    memoized, since the same surface forms recur across reviews.
+    """
     # AMANDA ADDED
-    tokens = [re.sub(r'\W+', '', token) for token in tokens]
-    tokens = [stemmer.stem(token) for token in tokens if token and token not in STOPWORDS]
+    token = re.sub(r'\W+', '', token)
+    if STOPWORDS is None:
+        use_stopwords(stopword_list())
+    if STEMMER is None:
+        load_tokenizer()
+    if not token or token in STOPWORDS:
+        return None
+    return STEMMER.stem(token)
+
+def tokenize(text, surface_counts=None):
+    if TOKENIZER is None:
+        load_tokenizer()
+    surfaces = TOKENIZER.tokenize(text.lower())
+    # the lowercased tokens before stemming, from which the words shown for
+    # stemmed terms are picked
+    if surface_counts is not None:
+        surface_counts.update(surfaces)
+    tokens = (normalize_token(token) for token in surfaces)
+    return [token for token in tokens if token is not None]
 
-    return tokens
+def tokenize_many(texts, surface_counts=None) -> list[list[str]]:
+    """
+    Function to tokenize a batch of texts, returning one token list per text.
+    If surface_counts, a collections.Counter, is given, the unstemmed tokens
+    of the texts are counted into it.
+    """
+    return [tokenize(text, surface_counts) for text in texts]
+
+def tokenize_corpus(parks, surface_counts=None) -> dict[str, list[list[str]]]:
+    """
+    Function to tokenize every review in the dataset exactly once. Returns a
+    dictionary mapping business ids to a list holding the tokens of each of
+    that park's reviews, which the index builders below consume instead of
+    re-tokenizing the reviews themselves. The unstemmed tokens are counted
+    into surface_counts, if given.
+    """
+    return {park : tokenize_many((review['text'] for review in attributes['reviews']),
+                                 surface_counts)
+            for park, attributes in parks.items()}
 
-def num_docs(parks) -> int:
+def num_docs(review_tokens) -> int:
     """
     Function to determine the total number of amusement park reviews contained
-    in yelp.json.
+    in the tokenized dataset.
     """
     sum = 0
-    for attributes in parks.values():
-        sum += len(attributes['reviews'])
+    for reviews in review_tokens.values():
+        sum += len(reviews)
     return sum
 
-def unique_tokens(parks):
+def get_doc_freqs(review_tokens) -> dict[str, int]:
     """
-    Function to return a set of all of the unique terms that appear at least
-    once across all park reviews in the dataset.
+    Function to create a dictionary mapping every term that appears in at least
+    one park review to the number of reviews it appears in.
     """
-    all_tokens = set()
-    for attributes in parks.values():
-        for review in attributes['reviews']:
-            all_tokens = all_tokens.union(tokenize(review['text']))
-    all_tokens = sorted(all_tokens)
-    return all_tokens
+    doc_freqs = {}
+    for reviews in review_tokens.values():
+        for tokens in reviews:
+            for token in set(tokens):
+                if doc_freqs.get(token) is None:
+                    doc_freqs[token] = 1
+                else:
+                    doc_freqs[token] += 1
+    return doc_freqs
 
-def get_idf_values(parks, num_docs) -> dict[str, int]:
+def count_review_terms(review_tokens) -> dict[str, list[dict[str, int]]]:
     """
-    Function to create a dictionary mapping every term that appears in at least
-    one park review to its associated inverse document frequency value.
+    Function to create, for each distinct amusement park in the input dictionary,
+    a list holding a dictionary for each of its reviews that maps the terms of
+    that review to their frequency in it, from which the review-level index
+    is built.
     """
-    idf_dict = {}
-    for attributes in parks.values():
-        for review in attributes['reviews']:
-            tokens = set(tokenize(review['text']))
+    review_term_dict = {}
+    for park, reviews in review_tokens.items():
+        review_term_dict[park] = []
+        for tokens in reviews:
+            token_dict = {}
             for token in tokens:
-                # token = token.lower()
-                if idf_dict.get(token) is None:
-                    idf_dict[token] = 1
-                else:
-                    idf_dict[token] += 1
-    for token, count in idf_dict.items():
-        idf_dict[token] = num_docs / count
-    return idf_dict
-
-def build_inverted_index(parks) -> dict[str, list[(str, int)]]:
-    """
-    Function to create an inverted index dictionary for all unique terms across
-    the entire set of amusement park reviews. The dictionary maps each unique
-    term to a list of tuples, where the first value in the tuple is a park
-    business ID, and the second value represents the number of times that the
-    token appears in a review for that park.
-    """
-    inverted_dict = {}
-    for park, attributes in parks.items():
-        for review in attributes['reviews']:
-            for token in tokenize(review['text']):
-                # token = token.lower()
-                if inverted_dict.get(token) is None:
-                    inverted_dict[token] = [(park, 1)]
-                else:
-                    last_pair = inverted_dict[token][len(inverted_dict[token]) - 1]
-                    # check if the token has already been found in a review for
-                    # this park
-                    if last_pair[0] == park:
-                        inverted_dict[token][len(inverted_dict[token]) - 1] = \
-                                                (last_pair[0], last_pair[1] + 1)
-                    else:
-                        inverted_dict[token].append((park, 1))
-    return inverted_dict
-
-def aggregate_reviews(parks) -> dict[str, dict[str, int]]:
+                token_dict[token] = token_dict.get(token, 0) + 1
+            review_term_dict[park].append(token_dict)
+    return review_term_dict
+
+def aggregate_reviews(review_tokens) -> dict[str, dict[str, int]]:
     """
     Function to create, for each distinct amusement park in the input dictionary,
     a dictionary mapping terms that appear in that park's reviews to their
     associated frequency values.
     """
     park_token_dict = {}
-    for park, attributes in parks.items():
+    for park, reviews in review_tokens.items():
         token_dict = {}
-        for review in attributes['reviews']:
-            tokens = tokenize(review['text'])
+        for tokens in reviews:
             for token in tokens:
                 if token_dict.get(token) is None:
                     token_dict[token] = 1
@@ -178,69 +268,27 @@ def aggregate_reviews(parks) -> dict[str, dict[str, int]]:
         park_token_dict[park] = token_dict
     return park_token_dict
 
-def calculate_average_ratings(parks) -> dict[str, int]:
-    """
-    Function to calculate each distinct park's average rating, out of five stars,
-    across all of its associated reviews. Returns a dictionary mapping business
-    ids to their average ratings.
-    """
-    rating_dict = {}
-    for park, attributes in parks.items():
-        rating_sum = 0
-        review_count = 0
-        for review in attributes['reviews']:
-            rating_sum += review['stars']
-            review_count += 1
-        rating_dict[park] = rating_sum / review_count
-    return rating_dict
-
-def calculate_similarities(query_tokens, query_norm, inverted_dict, idf_dict, \
-                            park_norms) -> dict[str, int]:
-    """
-    Function to create and return a dictionary that maps business ids to
-    the cosine similarity scores between their associated tokenized reviews and
-    the input tokenized query.
-    """
-    scores = {}
-    for token, frequency in query_tokens.items():
-        if inverted_dict.get(token) is not None and idf_dict.get(token) is not None:
-            for park, count in inverted_dict[token]:
-                # initialize or update score accumulator
-                if scores.get(park) is None:
-                    scores[park] = frequency * idf_dict[token] \
-                                    * count * idf_dict[token]
-                else:
-                    scores[park] += frequency * idf_dict[token] \
-                                    * count * idf_dict[token]
-    for park, score in scores.items():
-        scores[park] = score / (query_norm * park_norms[park])
-    return scores
-
-def find_similar_parks(query_tokens, park_token_dict, idf_dict) -> dict[str, int]:
-     """
-     Function to create and return a dictionary that maps amusement park names to
-     Function to create and return a dictionary that maps business ids to
-     the cosine similarity scores between their associated tokenized reviews and
-     the input tokenized query.
-     """
-     scores = {}
-     n_query_tokens = len(query_tokens)
-     for park, park_tokens in park_token_dict.items():
-         dot_product = 0
-         common_tokens = 0     # variable to store number of tokens in common
-                               # between the query and the reviews for this park
-         for token in query_tokens:
-             if park_tokens.get(token) is not None:
-                 dot_product += query_tokens.get(token) * idf_dict[token] \
-                                * park_tokens.get(token) * idf_dict[token]
-                 common_tokens += 1
-         total_tokens = n_query_tokens + len(park_tokens) - common_tokens
-         scores[park] = (dot_product / total_tokens)
-     return scores
-
-all_tokens = unique_tokens(park_dict)
-inverted_dict = build_inverted_index(park_dict)
-n_docs = num_docs(park_dict)
-idf_dict = get_idf_values(park_dict, n_docs)
-park_token_dict = aggregate_reviews(park_dict)
-average_park_ratings = calculate_average_ratings(park_dict)
\ No newline at end of file
+def query_term_counts(query, index, corrector=None, corrections=None) -> dict[int, int]:
+    """
+    Function to tokenize the query and map the vocabulary column of each query
+    term found in the index to the number of times it appears in the query.
+    Terms that never appear in a review are dropped, unless corrector, a
+    spelling.SpellingCorrector, corrects them to a term that does. If
+    corrections, a dict, is given, each corrected word of the query is
+    mapped in it to the word of its correction.
+    """
+    if TOKENIZER is None:
+        load_tokenizer()
+    term_counts = {}
+    for surface in TOKENIZER.tokenize(query.lower()):
+        token = normalize_token(surface)
+        if token is None:
+            continue
+        term_index = index.term_id(token)
+        if term_index < 0 and corrector is not None:
+            term_index = corrector.correct(token)
+            if term_index >= 0 and corrections is not None:
+                corrections[re.sub(r'\W+', '', surface)] = str(index.surface_forms[term_index])
+        if term_index >= 0:
+            term_counts[term_index] = term_counts.get(term_index, 0) + 1
+    return term_counts
@@ -1,12 +1,69 @@
+import logging
 import os
 import sqlalchemy as db
 
+logger = logging.getLogger(__name__)
+
+def split_sql_statements(script):
+    """
+    Function to split a SQL script into its statements at the semicolons that
+    are not inside quotes or comments. Comments are kept with the statement
+    they precede, and statements holding only comments are dropped.
+    """
+    statements = []
+    current = []
+    has_code = False
+    quote = None
+    position = 0
+    while position < len(script):
+        char = script[position]
+        if quote is not None:
+            current.append(char)
+            if char == '\\' and quote != '`' and position + 1 < len(script):
+                current.append(script[position + 1])
+                position += 1
+            elif char == quote:
+                quote = None
+        elif script.startswith('--', position) or char == '#' or script.startswith('/*', position):
+            if char == '/':
+                end = script.find('*/', position + 2)
+                end = len(script) if end < 0 else end + 2
+            else:
+                end = script.find('\n', position)
+                end = len(script) if end < 0 else end
+            current.append(script[position:end])
+            position = end
+            continue
+        elif char == ';':
+            if has_code:
+                statements.append(''.join(current).strip())
+            current = []
+            has_code = False
+        else:
+            if char in ("'", '"', '`'):
+                quote = char
+            current.append(char)
+            has_code = has_code or not char.isspace()
+        position += 1
+    if has_code:
+        statements.append(''.join(current).strip())
+    return statements
+
 class MySQLDatabaseHandler(object):
-    
+
     IS_DOCKER = True if 'DB_NAME' in os.environ else False
 
+    # connections kept open by the pool, extra connections allowed under load,
+    # and seconds to wait for a free connection before giving up; connections
+    # older than POOL_RECYCLE seconds are replaced before MySQL's wait_timeout
+    # closes them
+    POOL_SIZE = 5
+    POOL_OVERFLOW = 5
+    POOL_TIMEOUT = 10
+    POOL_RECYCLE = 3600
+
     def __init__(self,MYSQL_USER,MYSQL_USER_PASSWORD,MYSQL_PORT,MYSQL_DATABASE,MYSQL_HOST = "localhost"):
-        
+
         self.MYSQL_HOST = os.environ['DB_NAME'] if MySQLDatabaseHandler.IS_DOCKER else MYSQL_HOST
         self.MYSQL_USER = "admin" if MySQLDatabaseHandler.IS_DOCKER else MYSQL_USER
         self.MYSQL_USER_PASSWORD = "admin" if MySQLDatabaseHandler.IS_DOCKER else MYSQL_USER_PASSWORD
@@ -15,33 +72,43 @@ class MySQLDatabaseHandler(object):
         self.engine = self.validate_connection()
 
     def validate_connection(self):
-        print(f"mysql+pymysql://{self.MYSQL_USER}:{self.MYSQL_USER_PASSWORD}@{self.MYSQL_HOST}:{self.MYSQL_PORT}/{self.MYSQL_DATABASE}")
-        return db.create_engine(f"mysql+pymysql://{self.MYSQL_USER}:{self.MYSQL_USER_PASSWORD}@{self.MYSQL_HOST}:{self.MYSQL_PORT}/{self.MYSQL_DATABASE}")
+        engine = db.create_engine(f"mysql+pymysql://{self.MYSQL_USER}:{self.MYSQL_USER_PASSWORD}@{self.MYSQL_HOST}:{self.MYSQL_PORT}/{self.MYSQL_DATABASE}",
+                                  pool_size=MySQLDatabaseHandler.POOL_SIZE,
+                                  max_overflow=MySQLDatabaseHandler.POOL_OVERFLOW,
+                                  pool_timeout=MySQLDatabaseHandler.POOL_TIMEOUT,
+                                  pool_recycle=MySQLDatabaseHandler.POOL_RECYCLE,
+                                  pool_pre_ping=True)
+        # the URL's repr masks the password
+        logger.info("connecting to %r", engine.url)
+        return engine
 
     def lease_connection(self):
+        """
+        Returns a pooled connection, which must be closed (or used in a with
+        block) to return it to the pool.
+        """
         return self.engine.connect()
-    
+
     def query_executor(self,query):
-        conn = self.lease_connection()
-        if type(query) == list:
-            for i in query:
-                conn.execute(i)
-        else:
-            conn.execute(query)
-        
+        # run every statement in one transaction, and return the connection
+        # to the pool afterwards
+        with self.engine.begin() as conn:
+            if type(query) == list:
+                for i in query:
+                    conn.execute(db.text(i) if isinstance(i, str) else i)
+            else:
+                conn.execute(db.text(query) if isinstance(query, str) else query)
 
     def query_selector(self,query):
-        conn = self.lease_connection()
-        data = conn.execute(query)
-        return data
+        # fetch every row before the connection returns to the pool
+        with self.lease_connection() as conn:
+            return conn.execute(db.text(query) if isinstance(query, str) else query).fetchall()
 
     def load_file_into_db(self,file_path  = None):
         if MySQLDatabaseHandler.IS_DOCKER:
             return
         if file_path is None:
             file_path = os.path.join(os.environ['ROOT_PATH'],'init.sql')
-        sql_file = open(file_path,"r")
-        sql_file_data = list(filter(lambda x:x != '',sql_file.read().split(";\n")))
+        with open(file_path,"r") as sql_file:
+            sql_file_data = split_sql_statements(sql_file.read())
         self.query_executor(sql_file_data)
-        sql_file.close()
-
@@ -0,0 +1,421 @@
+"""
+Storage backend holding the parks and reviews of the dataset in indexed SQL
+tables, for MySQL in deployment and SQLite locally. Parks are keyed by their
+business id. The parks of the dataset also hold their row in the search index
+built from it, so that filters answered in SQL map directly onto index rows;
+parks ingested while serving have no such row, since each process numbers
+them as it adds them to its index, and are mapped by business id instead.
+
+Every ingest takes the next number of an ingest sequence, which its parks
+and reviews are stored with, so that each process serving the app can pick
+up what was ingested since it last looked, whichever process ingested it.
+
+Load a database with `python -m helpers.ParkDatabase sqlite:///parks.db` in
+the backend folder.
+"""
+
+import argparse
+import logging
+import numpy as np
+import sqlalchemy as db
+from sqlalchemy.pool import QueuePool, StaticPool
+
+import helper_functions
+import search_index
+import spatial
+from helpers.MySQLDatabaseHandler import MySQLDatabaseHandler
+
+logger = logging.getLogger(__name__)
+
+# parks inserted per bulk insert while loading
+BULK_BATCH_SIZE = 1000
+# bump whenever the tables change, so that databases loaded with older tables
+# are reloaded
+SCHEMA_VERSION = 3
+
+metadata = db.MetaData()
+
+parks = db.Table(
+    'parks', metadata,
+    db.Column('business_id', db.String(64), primary_key=True),
+    # row in the index built from the dataset, NULL for ingested parks
+    db.Column('row_id', db.Integer, unique=True),
+    db.Column('name', db.String(255), nullable=False),
+    db.Column('state', db.String(64), nullable=False),
+    db.Column('latitude', db.Float(precision=53), nullable=False),
+    db.Column('longitude', db.Float(precision=53), nullable=False),
+    db.Column('good_for_kids', db.Boolean, nullable=False),
+    db.Column('image_url', db.String(1024)),
+    db.Column('website_url', db.String(1024)),
+    # sequence number of the ingest that added the park, NULL for the parks
+    # of the dataset
+    db.Column('ingest_id', db.Integer),
+    db.Index('ix_parks_state_kids', 'state', 'good_for_kids'),
+    db.Index('ix_parks_location', 'latitude', 'longitude'),
+    db.Index('ix_parks_ingest', 'ingest_id'),
+)
+
+reviews = db.Table(
+    'reviews', metadata,
+    db.Column('id', db.Integer, primary_key=True, autoincrement=True),
+    db.Column('park_id', db.String(64), db.ForeignKey('parks.business_id'), nullable=False),
+    db.Column('position', db.Integer, nullable=False),
+    db.Column('review_id', db.String(64)),
+    db.Column('stars', db.Float, nullable=False),
+    db.Column('text', db.Text, nullable=False),
+    # sequence number of the ingest that added the review, NULL for the
+    # reviews of the dataset
+    db.Column('ingest_id', db.Integer),
+    db.Index('ix_reviews_park', 'park_id', 'position'),
+    db.Index('ix_reviews_ingest', 'ingest_id'),
+)
+
+# key/value facts about the loaded data, such as the checksum of its source
+properties = db.Table(
+    'properties', metadata,
+    db.Column('name', db.String(64), primary_key=True),
+    db.Column('value', db.String(255), nullable=False),
+)
+
+# counters, such as the sequence number of the last ingest
+sequences = db.Table(
+    'sequences', metadata,
+    db.Column('name', db.String(64), primary_key=True),
+    db.Column('value', db.Integer, nullable=False),
+)
+
+def create_engine(url):
+    """
+    Function to create an engine for url with a bounded connection pool.
+    Connections are checked before use, so that connections dropped by the
+    server are replaced instead of failing a request.
+    """
+    url = db.engine.make_url(url)
+    if url.get_backend_name() == 'sqlite':
+        if url.database in (None, '', ':memory:'):
+            # every connection to an in-memory database is a new database, so
+            # the pool holds exactly one
+            return db.create_engine(url, poolclass=StaticPool,
+                                    connect_args={'check_same_thread': False})
+        return db.create_engine(url, poolclass=QueuePool,
+                                pool_size=MySQLDatabaseHandler.POOL_SIZE,
+                                max_overflow=MySQLDatabaseHandler.POOL_OVERFLOW,
+                                pool_timeout=MySQLDatabaseHandler.POOL_TIMEOUT,
+                                connect_args={'check_same_thread': False})
+    if url.get_backend_name() == 'mysql' and 'charset' not in url.query:
+        url = url.update_query_dict({'charset': 'utf8mb4'})
+    return db.create_engine(url, pool_size=MySQLDatabaseHandler.POOL_SIZE,
+                            max_overflow=MySQLDatabaseHandler.POOL_OVERFLOW,
+                            pool_timeout=MySQLDatabaseHandler.POOL_TIMEOUT,
+                            pool_recycle=MySQLDatabaseHandler.POOL_RECYCLE,
+                            pool_pre_ping=True)
+
+def park_row(business_id, record, row=None, ingest_id=None) -> dict:
+    return {
+        'business_id': business_id,
+        'row_id': row,
+        'ingest_id': ingest_id,
+        'name': record['name'],
+        'state': record['state'],
+        'latitude': record['latitude'],
+        'longitude': record['longitude'],
+        'good_for_kids': record['good_for_kids'] == "True",
+        'image_url': record['image_url'],
+        'website_url': record['website_url'],
+    }
+
+def review_rows(business_id, reviews, first_position=0, ingest_id=None) -> list[dict]:
+    return [{
+        'park_id': business_id,
+        'position': position,
+        'review_id': review.get('review_id'),
+        'stars': review['stars'],
+        'text': review['text'],
+        'ingest_id': ingest_id,
+    } for position, review in enumerate(reviews, first_position)]
+
+def row_record(row) -> dict:
+    """
+    Function to convert a row of the parks table back to park attributes, as
+    returned by helper_functions.park_record.
+    """
+    return {
+        'name': row.name,
+        'state': row.state,
+        'latitude': row.latitude,
+        'longitude': row.longitude,
+        'image_url': row.image_url,
+        'website_url': row.website_url,
+        'good_for_kids': "True" if row.good_for_kids else "False",
+    }
+
+class ParkDatabase(object):
+    """
+    Parks and reviews stored in SQL tables, reached through a pooled engine.
+    Every method leases a connection for the duration of its statements and
+    returns it to the pool, even when a statement fails.
+    """
+
+    def __init__(self, url):
+        self.engine = create_engine(url)
+        logger.info("using park database %r", self.engine.url)
+
+    def source_checksum(self):
+        """
+        Returns the checksum of the dataset the database was loaded from, or
+        None if it has not been loaded, or was loaded with older tables.
+        """
+        values = self._properties()
+        if values.get('schema_version') != str(SCHEMA_VERSION):
+            return None
+        return values.get('source_checksum')
+
+    def load(self, json_file_path=helper_functions.json_file_path, batch_size=BULK_BATCH_SIZE):
+        """
+        Function to (re)create the tables and bulk load the dataset at
+        json_file_path into them, streaming it and inserting batch_size parks
+        at a time. Parks get the rows they have in the search index: a
+        business id appearing more than once keeps the row of its first entry
+        and the data of its last.
+
+        What was ingested while serving is carried over, with its sequence
+        numbers, except for ingested parks that the dataset now holds itself,
+        which are replaced by the dataset's entry along with the reviews they
+        were ingested with. Raises RuntimeError, changing nothing, if older
+        tables hold ingested parks or reviews, which cannot be carried over.
+        """
+        rows = {}
+        last_positions = {}
+        for position, entry in enumerate(helper_functions.iter_parks(json_file_path)):
+            rows.setdefault(entry['business_id'], len(rows))
+            last_positions[entry['business_id']] = position
+        kept_parks, kept_reviews, sequence = self._kept_ingests()
+        replaced = {park['business_id'] : park['ingest_id'] for park in kept_parks
+                    if park['business_id'] in rows}
+        kept_parks = [park for park in kept_parks if park['business_id'] not in replaced]
+        kept_reviews = [review for review in kept_reviews
+                        if replaced.get(review['park_id']) != review['ingest_id']]
+
+        metadata.drop_all(self.engine)
+        metadata.create_all(self.engine)
+        park_batch = []
+        review_batch = []
+        review_counts = {}
+        with self.engine.begin() as conn:
+            for position, entry in enumerate(helper_functions.iter_parks(json_file_path)):
+                if last_positions[entry['business_id']] != position:
+                    continue
+                record = helper_functions.park_record(entry)
+                park_batch.append(park_row(entry['business_id'], record, rows[entry['business_id']]))
+                review_batch.extend(review_rows(entry['business_id'], entry['reviews']))
+                review_counts[entry['business_id']] = len(entry['reviews'])
+                if len(park_batch) >= batch_size:
+                    self._insert(conn, park_batch, review_batch)
+                    park_batch, review_batch = [], []
+            self._insert(conn, park_batch, review_batch)
+
+            # the ingested reviews of a park follow its reviews in the dataset
+            for review in kept_reviews:
+                review['position'] = review_counts.get(review['park_id'], 0)
+                review_counts[review['park_id']] = review['position'] + 1
+            self._insert(conn, kept_parks, kept_reviews)
+            conn.execute(properties.insert(), [{
+                'name': 'source_checksum',
+                'value': search_index.source_checksum(json_file_path),
+            }, {
+                'name': 'schema_version',
+                'value': str(SCHEMA_VERSION),
+            }])
+            conn.execute(sequences.insert(), [{'name': 'ingest', 'value': sequence}])
+        logger.info("loaded %d parks into the park database, keeping %d ingested parks and "
+                    "%d ingested reviews", len(rows), len(kept_parks), len(kept_reviews))
+
+    def add(self, new_parks, new_reviews) -> int:
+        """
+        Function to store, in one transaction, new_parks, given as (business
+        id, record, reviews) tuples as LiveIndex.add_park takes them, and
+        new_reviews, each carrying the business id of its park, as the next
+        ingest. Returns the sequence number of the ingest. Raises ValueError,
+        storing nothing, if a park is already in the database.
+        """
+        try:
+            with self.engine.begin() as conn:
+                # taking the next sequence number locks its row until the
+                # transaction commits, so that ingests commit in sequence order
+                # and a reader seeing one has every earlier one committed
+                conn.execute(sequences.update().where(sequences.c.name == 'ingest')
+                             .values(value=sequences.c.value + 1))
+                sequence = conn.execute(db.select(sequences.c.value)
+                                        .where(sequences.c.name == 'ingest')).scalar_one()
+                self._insert(conn, [park_row(park, record, ingest_id=sequence)
+                                    for park, record, _ in new_parks],
+                             [review for park, _, park_reviews in new_parks
+                              for review in review_rows(park, park_reviews, ingest_id=sequence)])
+                positions = {}
+                review_batch = []
+                for review in new_reviews:
+                    park = review['business_id']
+                    if park not in positions:
+                        positions[park] = conn.execute(
+                            db.select(db.func.count()).select_from(reviews)
+                            .where(reviews.c.park_id == park)).scalar()
+                    review_batch.extend(review_rows(park, [review], positions[park], sequence))
+                    positions[park] += 1
+                self._insert(conn, [], review_batch)
+        except db.exc.IntegrityError as error:
+            raise ValueError(f"a park is already in the park database: {error.orig}") from error
+        return sequence
+
+    def ingested(self, after=0) -> tuple[list[tuple[str, dict, list[dict]]], list[dict], int]:
+        """
+        Function to read back what was ingested into the database while
+        serving, by this or any other process, after the ingest numbered
+        after, in the form add takes it: the ingested parks with the reviews
+        they were ingested with, and the other ingested reviews, in ingest
+        order. Also returns the sequence number of the last ingest read.
+        """
+        with self.engine.connect() as conn:
+            # the sequence is read first, so that every ingest up to it has
+            # been committed
+            sequence = conn.execute(db.select(sequences.c.value)
+                                    .where(sequences.c.name == 'ingest')).scalar() or 0
+            if sequence <= after:
+                return [], [], after
+            park_list = conn.execute(
+                db.select(parks).where(parks.c.ingest_id.between(after + 1, sequence))
+                .order_by(parks.c.ingest_id, parks.c.business_id)).all()
+            review_list = conn.execute(
+                db.select(reviews.c.park_id, reviews.c.review_id, reviews.c.stars,
+                          reviews.c.text, reviews.c.ingest_id,
+                          parks.c.ingest_id.label('park_ingest_id'))
+                .join(parks, reviews.c.park_id == parks.c.business_id)
+                .where(reviews.c.ingest_id.between(after + 1, sequence))
+                .order_by(reviews.c.ingest_id, reviews.c.park_id, reviews.c.position)).all()
+        park_reviews = {}
+        new_reviews = []
+        for row in review_list:
+            review = {'business_id': row.park_id, 'review_id': row.review_id,
+                      'stars': row.stars, 'text': row.text}
+            if row.ingest_id == row.park_ingest_id:
+                park_reviews.setdefault(row.park_id, []).append(review)
+            else:
+                new_reviews.append(review)
+        return ([(row.business_id, row_record(row), park_reviews.get(row.business_id, []))
+                 for row in park_list], new_reviews, sequence)
+
+    def filter_rows(self, states=None, good_for_kids=False, box=None) -> tuple[np.ndarray, list[str]]:
+        """
+        Function to select, in SQL, the parks in one of states, good for kids
+        if good_for_kids is set, and inside box, a bounding box as returned
+        by spatial.bounding_box. Returns the sorted index rows of the
+        selected parks of the dataset, and the business ids of the selected
+        ingested parks.
+        """
+        query = db.select(parks.c.row_id, parks.c.business_id)
+        if states:
+            query = query.where(parks.c.state.in_(states))
+        if good_for_kids:
+            query = query.where(parks.c.good_for_kids == db.true())
+        if box is not None:
+            min_latitude, max_latitude, min_longitude, max_longitude = box
+            query = query.where(parks.c.latitude.between(min_latitude, max_latitude))
+            if min_longitude <= max_longitude:
+                query = query.where(parks.c.longitude.between(min_longitude, max_longitude))
+            else:
+                query = query.where(db.or_(parks.c.longitude >= min_longitude,
+                                           parks.c.longitude <= max_longitude))
+        with self.engine.connect() as conn:
+            selected = conn.execute(query).all()
+        rows = np.array(sorted(row for row, _ in selected if row is not None), dtype=np.int64)
+        return rows, [park for row, park in selected if row is None]
+
+    def apply_filters(self, index, locations=None, latitude=None, longitude=None,
+                      distance=None, good_for_kids=None, locator=None) -> np.ndarray:
+        """
+        Function with the semantics of helper_functions.apply_filters, with
+        the state, good for kids and travel distance bounding box filters
+        pushed down into SQL. The exact travel distance of the parks in the
+        box is then checked with locator. Returns a boolean mask over the
+        parks of index, a LiveIndex; ingested parks that are not in it are
+        left out.
+        """
+        n_parks = len(index.park_ids)
+        box = None
+        if latitude and longitude and distance and distance != "fly":
+            if distance not in spatial.DISTANCE_MILES or not spatial.is_location(latitude, longitude):
+                return np.zeros(n_parks, dtype=bool)
+            box = spatial.bounding_box(latitude, longitude, spatial.DISTANCE_MILES[distance])
+        if not locations and good_for_kids != "yes" and box is None:
+            return np.ones(n_parks, dtype=bool)
+
+        rows, new_parks = self.filter_rows(locations, good_for_kids == "yes", box)
+        new_rows = [index.park_row(park) for park in new_parks]
+        rows = np.concatenate([rows, np.array([row for row in new_rows if row >= 0],
+                                              dtype=np.int64)])
+        rows = rows[rows < n_parks]
+        if box is not None:
+            rows = locator.rows_within(rows, latitude, longitude, spatial.DISTANCE_MILES[distance])
+        mask = np.zeros(n_parks, dtype=bool)
+        mask[rows] = True
+        return mask
+
+    def _kept_ingests(self) -> tuple[list[dict], list[dict], int]:
+        """
+        Function to read what was ingested while serving, for load to carry
+        over: the ingested rows of the parks and reviews tables, the reviews
+        in the order of their positions, and the sequence number of the last
+        ingest.
+        """
+        inspector = db.inspect(self.engine)
+        if not inspector.has_table(reviews.name):
+            return [], [], 0
+        if self._properties().get('schema_version') != str(SCHEMA_VERSION):
+            # older tables marked ingested reviews, and left the row of
+            # ingested parks empty
+            columns = {column['name'] for column in inspector.get_columns(reviews.name)}
+            park_columns = {column['name'] for column in inspector.get_columns(parks.name)}
+            with self.engine.connect() as conn:
+                ingested = ('ingested' in columns and conn.execute(db.text(
+                    "SELECT COUNT(*) FROM reviews WHERE ingested <> 0")).scalar()) or \
+                    ('row_id' in park_columns and conn.execute(db.text(
+                        "SELECT COUNT(*) FROM parks WHERE row_id IS NULL")).scalar())
+            if ingested:
+                raise RuntimeError("the park database holds ingested parks or reviews in older "
+                                   "tables; export them before reloading it")
+            return [], [], 0
+
+        with self.engine.connect() as conn:
+            park_list = conn.execute(db.select(parks).where(parks.c.ingest_id.is_not(None))
+                                     .order_by(parks.c.ingest_id, parks.c.business_id)).all()
+            review_list = conn.execute(
+                db.select(*[column for column in reviews.c if column.name != 'id'])
+                .where(reviews.c.ingest_id.is_not(None))
+                .order_by(reviews.c.park_id, reviews.c.position)).all()
+            sequence = conn.execute(db.select(sequences.c.value)
+                                    .where(sequences.c.name == 'ingest')).scalar() or 0
+        return ([dict(row._mapping) for row in park_list],
+                [dict(row._mapping) for row in review_list], sequence)
+
+    def _properties(self) -> dict[str, str]:
+        # the properties table is missing until the database is first loaded
+        try:
+            with self.engine.connect() as conn:
+                return dict(conn.execute(db.select(properties.c.name, properties.c.value)).all())
+        except db.exc.DBAPIError:
+            return {}
+
+    def _insert(self, conn, park_batch, review_batch):
+        # executemany, which the MySQL driver sends as multi-row inserts
+        if park_batch:
+            conn.execute(parks.insert(), park_batch)
+        if review_batch:
+            conn.execute(reviews.insert(), review_batch)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Load the parks dataset into a database.")
+    parser.add_argument('url', help="SQLAlchemy database URL, e.g. sqlite:///parks.db")
+    parser.add_argument('--source', default=helper_functions.json_file_path,
+                        help="path to the parks dataset")
+    args = parser.parse_args()
+    ParkDatabase(args.url).load(args.source)
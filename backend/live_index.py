@@ -0,0 +1,405 @@
+"""
+Helper file to apply new reviews and parks to a loaded search index in place,
+so that fresh reviews can be streamed in without restarting the app or
+rebuilding the index artifact.
+"""
+
+import copy
+import math
+import numpy as np
+from scipy import sparse
+
+import bm25
+import helper_functions
+import park_store
+import search_index
+import spelling
+import suggest
+import svd
+import vector_index
+
+# the SVD is refit once the tokens ingested since the last fit exceed this
+# fraction of the tokens it was fit on; until then, new and updated parks are
+# folded into the existing latent space using the fitted components
+REFIT_DRIFT = 0.2
+
+def check_reviews(reviews):
+    """
+    Function to check that reviews is a list of reviews in the
+    parks_details.json format, each with a text and a numeric star rating,
+    raising ValueError otherwise.
+    """
+    if not isinstance(reviews, list):
+        raise ValueError("reviews must be a list")
+    for review in reviews:
+        if not isinstance(review, dict) or not isinstance(review.get('text'), str):
+            raise ValueError("every review needs a text")
+        if not is_number(review.get('stars')):
+            raise ValueError("every review needs a number of stars")
+
+def check_record(record):
+    """
+    Function to check that record, as returned by helper_functions.park_record,
+    holds park attributes of the types the index stores, raising ValueError
+    otherwise.
+    """
+    for name in ('name', 'state', 'good_for_kids'):
+        if not isinstance(record[name], str):
+            raise ValueError(f"park {name} must be a string")
+    for name in ('latitude', 'longitude'):
+        if not is_number(record[name]):
+            raise ValueError(f"park {name} must be a number")
+    for name in ('image_url', 'website_url'):
+        if record[name] is not None and not isinstance(record[name], str):
+            raise ValueError(f"park {name} must be a string")
+
+def is_number(value) -> bool:
+    if not isinstance(value, (int, float)) or isinstance(value, bool):
+        return False
+    try:
+        return math.isfinite(value)
+    except OverflowError:
+        return False
+
+class LiveIndex(object):
+    """
+    Search index that accepts new reviews and parks on top of a saved,
+    memory-mapped SearchIndex. Additions are kept in a small in-memory delta
+    and merged into the postings, IDF, norms and latent matrix lazily by
+    refresh(), which bumps the version so that cached results expire. The
+    arrays and methods used by the search path mirror those of SearchIndex;
+    searches read a snapshot() of the index, so that additions can go on
+    while they run.
+
+    Updates only live in the memory of the process they were added to, and
+    the saved artifact is left untouched; processes share updates by adding
+    them from the park database, in the same order.
+    """
+
+    def __init__(self, index):
+        self.base = index
+        self.manifest = index.manifest
+        for name in search_index.ARRAY_NAMES:
+            setattr(self, name, getattr(index, name))
+        self.version = index.version
+        self.updates = 0
+
+        self.park_rows = None
+        self.new_park_ids = []
+        self.new_records = []
+        self.new_terms = []
+        self.new_term_ids = {}
+        self.delta_counts = {}      # park row -> {term column : count}
+        self.delta_doc_freq = {}    # term column -> number of new reviews
+        self.new_reviews = {}       # park row -> texts of its new reviews
+        self.new_review_terms = {}  # park row -> {term column : count} of each new review
+        self.touched_rows = set()
+        self.n_docs = index.manifest['n_reviews']
+        self.review_counts = np.array(index.review_counts)
+        self.rating_sums = np.asarray(index.ratings) * self.review_counts
+        self.fitted_tokens = int(np.sum(index.postings_counts))
+        self.drift_tokens = 0
+        self.suggested = (0, 0)     # new terms and parks in the suggestion arrays
+        self.dirty = False
+
+    def term_id(self, token) -> int:
+        """
+        Returns the column of token in the vocabulary, or -1 if the token does
+        not appear in any review.
+        """
+        term_index = self.base.term_id(token)
+        if term_index < 0:
+            return self.new_term_ids.get(token, -1)
+        return term_index
+
+    def park_row(self, park) -> int:
+        """
+        Returns the row of the park with the given business id, or -1 if the
+        park is not in the index.
+        """
+        return self._park_rows().get(park, -1)
+
+    def postings(self, term_index):
+        """
+        Returns the park rows and counts of every posting for term_index.
+        """
+        start = self.postings_indptr[term_index]
+        end = self.postings_indptr[term_index + 1]
+        return self.postings_parks[start:end], self.postings_counts[start:end]
+
+    def review_texts(self, row, limit=None) -> list[str]:
+        """
+        Returns the texts of the reviews of the park at row, or of its first
+        limit reviews, including reviews added since the index was loaded.
+        """
+        texts = []
+        if row < len(self.base.park_ids):
+            texts = self.base.review_texts(row, limit)
+        new_texts = self.new_reviews.get(row, [])
+        texts.extend(new_texts if limit is None else new_texts[:max(limit - len(texts), 0)])
+        return texts
+
+    def review_texts_at(self, row, positions) -> list[str]:
+        """
+        Returns the texts of the reviews of the park at row at the given
+        positions among its reviews, including reviews added since the index
+        was loaded.
+        """
+        n_base = self._base_review_count(row)
+        new_texts = self.new_reviews.get(row, [])
+        base_positions = [position for position in positions if position < n_base]
+        base_texts = iter(self.base.review_texts_at(row, base_positions) if base_positions else [])
+        return [next(base_texts) if position < n_base else new_texts[position - n_base]
+                for position in positions]
+
+    def review_postings(self, row) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Returns the review-level postings of the park at row, as
+        SearchIndex.review_postings does, including reviews added since the
+        index was loaded.
+        """
+        if self._base_review_count(row):
+            indptr, terms, counts, lengths = self.base.review_postings(row)
+        else:
+            indptr, terms, counts, lengths = np.zeros(1, dtype=np.int64), [], [], []
+        new_terms = self.new_review_terms.get(row)
+        if not new_terms:
+            return indptr, terms, counts, lengths
+        sizes = [len(term_counts) for term_counts in new_terms]
+        indptr = np.concatenate([indptr, indptr[-1] + np.cumsum(sizes)])
+        terms = np.concatenate([terms, [term for term_counts in new_terms
+                                        for term in sorted(term_counts)]]).astype(np.int64)
+        counts = np.concatenate([counts, [term_counts[term] for term_counts in new_terms
+                                          for term in sorted(term_counts)]]).astype(np.int32)
+        lengths = np.concatenate([lengths, [sum(term_counts.values())
+                                            for term_counts in new_terms]]).astype(np.int32)
+        return indptr, terms, counts, lengths
+
+    def add_park(self, park, record, reviews) -> int:
+        """
+        Function to append a new park, given its business id, its attributes
+        as returned by helper_functions.park_record and its list of reviews,
+        to the index. Returns the row of the park.
+        """
+        self.check_additions([(park, record, reviews)], [])
+        rows = self._park_rows()
+        rows[park] = len(rows)
+        self.new_park_ids.append(park)
+        self.new_records.append(record)
+        self.review_counts = np.append(self.review_counts, 0)
+        self.rating_sums = np.append(self.rating_sums, 0.0)
+        return self.add_reviews(park, reviews)
+
+    def check_additions(self, parks, reviews):
+        """
+        Function to check, without changing anything, that parks, given as
+        (business id, record, reviews) tuples as add_park takes them, and
+        reviews, each carrying the business id of its park, can all be
+        added to the index. Raises ValueError, or KeyError for a review of
+        an unknown park, at the first problem, so that a batch of additions
+        is either checked in full and applied or not applied at all.
+        """
+        rows = self._park_rows()
+        new_parks = set()
+        for park, record, park_reviews in parks:
+            if not isinstance(park, str) or not park:
+                raise ValueError("every park needs a business_id")
+            if park in rows or park in new_parks:
+                raise ValueError(f"park {park} is already in the index")
+            check_record(record)
+            check_reviews(park_reviews)
+            new_parks.add(park)
+        check_reviews(reviews)
+        for review in reviews:
+            if review.get('business_id') not in rows and review.get('business_id') not in new_parks:
+                raise KeyError(f"park {review.get('business_id')} is not in the index")
+
+    def add_reviews(self, park, reviews) -> int:
+        """
+        Function to add reviews, in the parks_details.json review format, to
+        an existing park. Returns the row of the park.
+        """
+        row = self._park_rows().get(park)
+        if row is None:
+            raise KeyError(f"park {park} is not in the index")
+        check_reviews(reviews)
+        park_counts = self.delta_counts.setdefault(row, {})
+        for tokens, review in zip(helper_functions.tokenize_many(
+                review['text'] for review in reviews), reviews):
+            for token in tokens:
+                term_index = self.term_id(token)
+                if term_index < 0:
+                    term_index = len(self.base.vocabulary) + len(self.new_terms)
+                    self.new_terms.append(token)
+                    self.new_term_ids[token] = term_index
+                park_counts[term_index] = park_counts.get(term_index, 0) + 1
+            review_counts = {}
+            for token in tokens:
+                term_index = self.term_id(token)
+                review_counts[term_index] = review_counts.get(term_index, 0) + 1
+            for term_index in review_counts:
+                self.delta_doc_freq[term_index] = self.delta_doc_freq.get(term_index, 0) + 1
+            self.new_review_terms.setdefault(row, []).append(review_counts)
+            self.new_reviews.setdefault(row, []).append(review['text'])
+            self.rating_sums[row] += review['stars']
+            self.review_counts[row] += 1
+            self.n_docs += 1
+            self.drift_tokens += len(tokens)
+        self.touched_rows.add(row)
+        self.dirty = True
+        return row
+
+    def snapshot(self) -> 'LiveIndex':
+        """
+        Returns a copy of the index, taken with no additions pending (e.g.
+        right after refresh()), that later additions and refreshes leave
+        unchanged, for searches to read. The arrays are
+        shared, since a refresh replaces them rather than changing them, and
+        only what additions change in place is copied.
+        """
+        view = copy.copy(self)
+        view.park_rows = dict(self._park_rows())
+        view.new_term_ids = dict(self.new_term_ids)
+        view.new_reviews = {row : list(texts) for row, texts in self.new_reviews.items()}
+        view.new_review_terms = {row : list(term_counts)
+                                 for row, term_counts in self.new_review_terms.items()}
+        view.review_counts = self.review_counts.copy()
+        return view
+
+    def refresh(self, label=None) -> bool:
+        """
+        Function to merge every pending addition into the search arrays,
+        recomputing IDF and norms and updating the latent matrix. The new
+        version is the base version followed by label, by default the number
+        of refreshes, so that processes that added the same updates can
+        agree on it. Returns whether anything changed.
+        """
+        if not self.dirty:
+            return False
+        n_parks = len(self.base.park_ids) + len(self.new_park_ids)
+        n_terms = len(self.base.vocabulary) + len(self.new_terms)
+
+        counts = self._count_matrix(n_parks, n_terms)
+        self.park_ids = np.concatenate([np.asarray(self.base.park_ids),
+                                        np.array(self.new_park_ids, dtype=str)])
+        self.vocabulary = np.concatenate([np.asarray(self.base.vocabulary),
+                                          np.array(self.new_terms, dtype=str)])
+        self.postings_indptr = counts.indptr.astype(np.int64)
+        self.postings_parks = counts.indices.astype(np.int32)
+        self.postings_counts = counts.data.astype(np.int32)
+
+        doc_freq = np.zeros(n_terms, dtype=np.int32)
+        doc_freq[:len(self.base.doc_freq)] = self.base.doc_freq
+        for term_index, count in self.delta_doc_freq.items():
+            doc_freq[term_index] += count
+        self.doc_freq = doc_freq
+        self.idf = self.n_docs / doc_freq
+        posting_terms = np.repeat(np.arange(n_terms), np.diff(self.postings_indptr))
+        self.park_norms = np.sqrt(np.bincount(self.postings_parks,
+                                              weights=(self.postings_counts * self.idf[posting_terms]) ** 2,
+                                              minlength=n_parks))
+        self.park_term_counts = np.bincount(self.postings_parks,
+                                            minlength=n_parks).astype(np.int32)
+        self.ratings = self.rating_sums / np.maximum(self.review_counts, 1)
+        if self.new_records:
+            for name, array in park_store.metadata_arrays(self.new_records, self.base).items():
+                setattr(self, name, array)
+        # new terms are suggested as their stem, since their reviews were not
+        # kept unstemmed
+        if self.suggested != (len(self.new_terms), len(self.new_records)):
+            # the deletes of the whole vocabulary are sorted together, so new
+            # terms rebuild the spelling arrays
+            if self.suggested[0] != len(self.new_terms):
+                for name, array in spelling.correction_arrays(self.vocabulary).items():
+                    setattr(self, name, array)
+            self.surface_forms = np.concatenate([np.asarray(self.base.surface_forms),
+                                                 np.array(self.new_terms, dtype=str)])
+            for name, array in suggest.suggestion_arrays(
+                    self.new_terms, [record['name'] for record in self.new_records],
+                    self.base).items():
+                setattr(self, name, array)
+            self.suggested = (len(self.new_terms), len(self.new_records))
+
+        if self.drift_tokens > REFIT_DRIFT * self.fitted_tokens:
+            self._refit(counts)
+        else:
+            self._fold_in(counts)
+        self.svd_norms = np.linalg.norm(self.truncated_mat, axis=1)
+        self.svd_embeddings = vector_index.normalize_rows(self.truncated_mat)
+        for name, array in search_index.tfidf_arrays(counts, self.idf).items():
+            setattr(self, name, array)
+        for name, array in bm25.postings_arrays(self.postings_indptr, self.postings_parks,
+                                                self.postings_counts, n_parks).items():
+            setattr(self, name, array)
+
+        self.updates += 1
+        self.version = f"{self.base.version}+{self.updates if label is None else label}"
+        self.touched_rows = set()
+        self.dirty = False
+        return True
+
+    def _base_review_count(self, row) -> int:
+        if row >= len(self.base.park_ids):
+            return 0
+        first, end = self.base.review_ranges[row]
+        return int(end - first)
+
+    def _park_rows(self) -> dict[str, int]:
+        if self.park_rows is None:
+            self.park_rows = {park : row for row, park in
+                              enumerate(np.asarray(self.base.park_ids).tolist())}
+        return self.park_rows
+
+    def _count_matrix(self, n_parks, n_terms) -> sparse.csc_matrix:
+        """
+        Returns the park x term count matrix of the base index plus every
+        ingested review, in the CSC layout of the postings arrays.
+        """
+        base = self.base
+        counts = sparse.csc_matrix((np.asarray(base.postings_counts),
+                                    np.asarray(base.postings_parks),
+                                    np.asarray(base.postings_indptr)),
+                                   shape=(len(base.park_ids), len(base.vocabulary)))
+        counts.resize((n_parks, n_terms))
+        rows, columns, values = [], [], []
+        for row, park_counts in self.delta_counts.items():
+            rows.extend([row] * len(park_counts))
+            columns.extend(park_counts.keys())
+            values.extend(park_counts.values())
+        counts = (counts + sparse.csc_matrix((values, (rows, columns)),
+                                             shape=(n_parks, n_terms),
+                                             dtype=counts.dtype)).tocsc()
+        counts.sort_indices()
+        return counts
+
+    def _fold_in(self, counts):
+        """
+        Projects every new or updated park onto the fitted SVD components.
+        Terms added since the fit have no component weights and are ignored.
+        """
+        n_fitted_terms = self.svd_components.shape[1]
+        truncated_mat = np.zeros((counts.shape[0], self.svd_components.shape[0]))
+        truncated_mat[:len(self.truncated_mat)] = self.truncated_mat
+        tags = np.asarray(self.tags).tolist()
+        tags.extend([[''] * 3] * (counts.shape[0] - len(tags)))
+        rows = sorted(self.touched_rows)
+        weighted = svd.weight_matrix(counts.tocsr()[rows, :n_fitted_terms], self.idf,
+                                     self.manifest['svd']['weighting'])
+        truncated_mat[rows] = weighted @ self.svd_components.T
+        for row, row_tags in zip(rows, svd.assign_tags(truncated_mat[rows])):
+            tags[row] = row_tags
+        self.truncated_mat = truncated_mat
+        self.tags = np.array(tags)
+
+    def _refit(self, counts):
+        """
+        Refits the SVD on the full count matrix, with the options the index was
+        built with, and reassigns every park's tags.
+        """
+        model, self.truncated_mat, _ = svd.fit_latent_model(counts, self.idf,
+                                                            self.manifest['svd'])
+        self.svd_components = model.components_
+        self.svd_singular_values = model.singular_values_
+        self.tags = np.array(svd.assign_tags(self.truncated_mat))
+        self.fitted_tokens = int(counts.sum())
+        self.drift_tokens = 0
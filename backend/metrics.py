@@ -0,0 +1,269 @@
+"""
+Helper file to record the latency of each stage of the search path, along with
+candidate set sizes and other counters, and to render them in the Prometheus
+text format served by the /metrics endpoint. It also holds an opt-in sampling
+profiler that can be attached to individual requests.
+
+Metrics are kept in the memory of the process that records them, so with
+several server workers each one reports its own.
+"""
+
+import bisect
+import collections
+import contextlib
+import logging
+import math
+import os
+import random
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# upper bounds of the candidate set size histogram buckets
+SIZE_BUCKETS = (0, 1, 10, 30, 100, 300, 1000, 3000, 10000, 30000, 100000)
+
+# fraction of requests to profile, and the interval between stack samples
+PROFILE_RATE = float(os.environ.get("PROFILE_RATE", 0))
+PROFILE_INTERVAL = 0.001
+# number of distinct stacks logged per profiled request
+PROFILE_TOP_STACKS = 40
+
+def _format_value(value) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def _format_labels(labels) -> str:
+    if not labels:
+        return ""
+    pairs = []
+    for name, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+class Histogram(object):
+    """
+    Cumulative histogram of observed values, optionally split by the value
+    of one label.
+    """
+
+    def __init__(self, name, description, buckets, label=None):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self.label = label
+        self.series = {}    # label value -> [bucket counts, sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, value, label_value=None):
+        """
+        Function to record one observation of value.
+        """
+        position = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label_value)
+            if series is None:
+                series = self.series[label_value] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][position] += 1
+            series[1] += value
+            series[2] += 1
+
+    def sums(self) -> dict:
+        """
+        Returns the sum of the observations of each label value.
+        """
+        with self.lock:
+            return {label_value : series[1] for label_value, series in self.series.items()}
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            series = sorted((key, list(value[0]), value[1], value[2])
+                            for key, value in self.series.items())
+        for label_value, counts, total, count in series:
+            labels = [(self.label, label_value)] if self.label else []
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket"
+                             f"{_format_labels(labels + [('le', _format_value(float(bound)))])} "
+                             f"{cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+class Counter(object):
+    """
+    Monotonic counter, optionally split by the value of one label.
+    """
+
+    def __init__(self, name, description, label=None):
+        self.name = name
+        self.description = description
+        self.label = label
+        self.values = collections.Counter()
+        self.lock = threading.Lock()
+
+    def inc(self, label_value=None, amount=1):
+        with self.lock:
+            self.values[label_value] += amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            values = sorted(self.values.items(), key=lambda item: str(item[0]))
+        for label_value, value in values:
+            labels = [(self.label, label_value)] if self.label else []
+            lines.append(f"{self.name}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+class Gauge(object):
+    """
+    Value that can go up and down, optionally split by the value of one
+    label. If callback is given, it is called at render time and returns
+    either a number or a dictionary mapping label values to numbers.
+    """
+
+    def __init__(self, name, description, label=None, callback=None, kind="gauge"):
+        self.name = name
+        self.description = description
+        self.label = label
+        self.callback = callback
+        self.kind = kind
+        self.values = {}
+
+    def set(self, value, label_value=None):
+        self.values[label_value] = value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        values = self.values
+        if self.callback is not None:
+            values = self.callback()
+            if not isinstance(values, dict):
+                values = {None: values}
+        for label_value, value in sorted(values.items(), key=lambda item: str(item[0])):
+            labels = [(self.label, label_value)] if self.label else []
+            lines.append(f"{self.name}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+REGISTRY = []
+
+def register(metric):
+    """
+    Function to add metric to those rendered by the /metrics endpoint.
+    Returns the metric.
+    """
+    REGISTRY.append(metric)
+    return metric
+
+STAGE_SECONDS = register(Histogram("parks_search_stage_seconds",
+                                   "Time spent in each stage of a park search.",
+                                   LATENCY_BUCKETS, "stage"))
+REQUEST_SECONDS = register(Histogram("parks_request_seconds",
+                                     "Time spent handling a request.",
+                                     LATENCY_BUCKETS, "endpoint"))
+CANDIDATE_PARKS = register(Histogram("parks_search_candidates",
+                                     "Number of parks passing the filters of a search.",
+                                     SIZE_BUCKETS))
+QUERY_TERMS = register(Histogram("parks_search_query_terms",
+                                 "Number of distinct indexed terms in a search query.",
+                                 SIZE_BUCKETS))
+POSTINGS_DECODED = register(Histogram("parks_search_postings_decoded",
+                                     "Number of postings decoded by a BM25 search.",
+                                     SIZE_BUCKETS))
+BATCH_SIZE = register(Histogram("parks_search_batch_size",
+                                "Number of searches answered together by the batched server.",
+                                SIZE_BUCKETS))
+LOAD_SECONDS = register(Histogram("parks_load_seconds",
+                                  "Time spent in each stage of loading the search state, "
+                                  "at startup and after ingesting updates.",
+                                  LATENCY_BUCKETS, "stage"))
+
+@contextlib.contextmanager
+def timed(stage, histogram=STAGE_SECONDS):
+    """
+    Context manager recording the time spent in its body under the given
+    stage label of histogram.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - start, stage)
+
+def render() -> str:
+    """
+    Function to render every registered metric in the Prometheus text format.
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+class SamplingProfiler(object):
+    """
+    Profiler that samples the stack of one thread from a background thread
+    every interval seconds, counting how often each call stack is seen.
+    Sampling keeps the overhead on the profiled thread low and bounded,
+    unlike tracing every call.
+    """
+
+    def __init__(self, thread_id=None, interval=PROFILE_INTERVAL):
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.stopped = threading.Event()
+        self.sampler = threading.Thread(target=self._sample, daemon=True)
+
+    def start(self):
+        self.sampler.start()
+        return self
+
+    def stop(self) -> collections.Counter:
+        """
+        Function to stop sampling. Returns the sampled stacks, each a string
+        of semicolon separated frames from the outermost call inwards, mapped
+        to the number of samples it was seen in.
+        """
+        self.stopped.set()
+        self.sampler.join()
+        return self.stacks
+
+    def _sample(self):
+        while True:
+            frame = sys._current_frames().get(self.thread_id)
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if frames:
+                self.stacks[";".join(reversed(frames))] += 1
+            if self.stopped.wait(self.interval):
+                return
+
+@contextlib.contextmanager
+def profiled(name, force=False):
+    """
+    Context manager profiling its body with a SamplingProfiler if force is
+    set, or otherwise for a PROFILE_RATE fraction of calls, and logging the
+    most frequent stacks in the folded format read by flame graph tools.
+    """
+    if not force and (PROFILE_RATE <= 0 or random.random() >= PROFILE_RATE):
+        yield
+        return
+    profiler = SamplingProfiler().start()
+    try:
+        yield
+    finally:
+        stacks = profiler.stop()
+        lines = [f"{stack} {count}" for stack, count in stacks.most_common(PROFILE_TOP_STACKS)]
+        logger.info("profile of %s (%d samples):\n%s", name,
+                    sum(stacks.values()), "\n".join(lines))
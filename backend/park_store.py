@@ -0,0 +1,108 @@
+"""
+Helper file implementing the columnar park metadata saved with the search
+index. Each attribute of the parks is one array indexed by park row: the
+coordinates are float arrays, states are small integer codes into a table of
+state names, the good for kids attribute is a bitset, and names and URLs are
+codes into a pool of interned strings, so that a park costs a few dozen
+bytes rather than a dictionary of Python objects, and filters become array
+operations.
+"""
+
+from array import array
+import numpy as np
+
+# string code of a missing value
+NO_STRING = -1
+
+class StringPool(object):
+    """
+    Interns strings into one UTF-8 byte array with the offset of each string,
+    so that repeated strings, such as a shared default URL, are stored once.
+    The pool can extend the arrays of an existing pool.
+    """
+
+    def __init__(self, data=None, offsets=None):
+        self.chunks = [] if data is None else [bytes(data)]
+        self.offsets = array('q', [0] if offsets is None else np.asarray(offsets).tolist())
+        self.codes = {}
+
+    def intern(self, text) -> int:
+        """
+        Function to add text to the pool, if not already added, returning its
+        code. Returns NO_STRING for None.
+        """
+        if text is None:
+            return NO_STRING
+        code = self.codes.get(text)
+        if code is None:
+            data = text.encode('utf-8')
+            self.chunks.append(data)
+            self.offsets.append(self.offsets[-1] + len(data))
+            code = self.codes[text] = len(self.offsets) - 2
+        return code
+
+    def arrays(self) -> tuple[np.ndarray, np.ndarray]:
+        return np.frombuffer(b''.join(self.chunks), dtype=np.uint8).copy(), \
+               np.frombuffer(self.offsets, dtype=np.int64).copy()
+
+def read_string(data, offsets, code):
+    """
+    Function to read the string with the given code from a pool's arrays.
+    Returns None for NO_STRING.
+    """
+    if code == NO_STRING:
+        return None
+    return bytes(data[int(offsets[code]):int(offsets[code + 1])]).decode('utf-8')
+
+def unpack_flags(bits, n_parks) -> np.ndarray:
+    """
+    Function to expand a bitset of n_parks flags into a boolean array.
+    """
+    return np.unpackbits(np.asarray(bits), count=n_parks).astype(bool)
+
+def metadata_arrays(records, base=None) -> dict[str, np.ndarray]:
+    """
+    Function to build the metadata columns of the parks whose records, as
+    returned by helper_functions.park_record, are given in row order. If
+    base, an index holding metadata columns, is given, the parks are
+    appended to its parks.
+    """
+    if base is None:
+        latitudes, longitudes, state_codes, kids = [], [], [], []
+        state_names = []
+        pool = StringPool()
+        name_codes, image_codes, website_codes = [], [], []
+    else:
+        latitudes = np.asarray(base.park_latitudes).tolist()
+        longitudes = np.asarray(base.park_longitudes).tolist()
+        state_codes = np.asarray(base.park_state_codes).tolist()
+        kids = unpack_flags(base.park_kids_bits, len(state_codes)).tolist()
+        state_names = np.asarray(base.state_names).tolist()
+        pool = StringPool(base.park_strings, base.park_string_offsets)
+        name_codes = np.asarray(base.park_name_codes).tolist()
+        image_codes = np.asarray(base.park_image_codes).tolist()
+        website_codes = np.asarray(base.park_website_codes).tolist()
+
+    state_index = {state : code for code, state in enumerate(state_names)}
+    for record in records:
+        latitudes.append(record['latitude'])
+        longitudes.append(record['longitude'])
+        state_codes.append(state_index.setdefault(record['state'], len(state_index)))
+        kids.append(record['good_for_kids'] == "True")
+        name_codes.append(pool.intern(record['name']))
+        image_codes.append(pool.intern(record['image_url']))
+        website_codes.append(pool.intern(record['website_url']))
+
+    strings, string_offsets = pool.arrays()
+    return {
+        'park_latitudes': np.array(latitudes, dtype=np.float64),
+        'park_longitudes': np.array(longitudes, dtype=np.float64),
+        'park_state_codes': np.array(state_codes, dtype=np.int16),
+        'state_names': np.array(list(state_index), dtype=str),
+        'park_kids_bits': np.packbits(np.array(kids, dtype=bool)),
+        'park_strings': strings,
+        'park_string_offsets': string_offsets,
+        'park_name_codes': np.array(name_codes, dtype=np.int32),
+        'park_image_codes': np.array(image_codes, dtype=np.int32),
+        'park_website_codes': np.array(website_codes, dtype=np.int32),
+    }
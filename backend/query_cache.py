@@ -0,0 +1,212 @@
+"""
+Helper file implementing the result cache for the /parks endpoint, so that
+popular searches are served without re-running filtering and scoring, and
+the cursors that page through the results of a search.
+"""
+
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import math
+import os
+import secrets
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# user coordinates are rounded to this many decimal places (about 7 miles of
+# latitude) so that nearby users share cache entries
+LOCATION_PRECISION = 1
+
+# key signing the cursors, so that only cursors made by the app are accepted;
+# set CURSOR_SECRET to share it between processes that are not forked from
+# one another, otherwise it is random per app start (and shared by the
+# workers forked from it)
+CURSOR_SECRET = os.environ.get('CURSOR_SECRET', '').encode('utf-8') or secrets.token_bytes(32)
+# bytes of the signature kept in a cursor
+CURSOR_SIGNATURE_BYTES = 16
+
+def quantize_location(latitude, longitude) -> tuple:
+    """
+    Function to round a user location to LOCATION_PRECISION decimal places.
+    Returns (None, None) if either coordinate is missing, malformed or not
+    finite.
+    """
+    try:
+        latitude, longitude = float(latitude), float(longitude)
+    except (TypeError, ValueError):
+        return None, None
+    if not (math.isfinite(latitude) and math.isfinite(longitude)):
+        return None, None
+    return round(latitude, LOCATION_PRECISION), round(longitude, LOCATION_PRECISION)
+
+def make_key(query_counts, locations, latitude, longitude, distance, good_for_kids) -> tuple:
+    """
+    Function to build the cache key of a search from its stemmed query term
+    counts and its filters. Filters are normalized so that equivalent
+    searches map to the same key: state order is ignored, coordinates only
+    matter when a bounded travel distance is selected, and only "yes" turns on
+    the good for kids filter.
+    """
+    query_key = tuple(sorted(query_counts.items()))
+    states = tuple(sorted(set(locations))) if locations else ()
+    if latitude and longitude and distance and distance != "fly":
+        location_key = (latitude, longitude, distance)
+    else:
+        location_key = None
+    return query_key, states, location_key, good_for_kids == "yes"
+
+def key_search(key) -> tuple:
+    """
+    Function to recover, from the cache key of a search, the query term
+    counts, states, latitude, longitude, travel distance and good for kids
+    filter of a search that is equivalent to it.
+    """
+    query_key, states, location_key, good_for_kids = key
+    latitude, longitude, distance = location_key if location_key is not None else (None,) * 3
+    return dict(query_key), list(states) or None, latitude, longitude, distance, \
+        "yes" if good_for_kids else None
+
+def make_cursor(version, key, mode, offset) -> str:
+    """
+    Function to encode the page starting at offset of the search with the
+    given cache key and ranking mode as an opaque, signed cursor. The cursor
+    carries the search itself, so that any worker can serve it, and the
+    version of the index it was ranked on, so that it expires once the index
+    changes.
+    """
+    query_key, states, location_key, good_for_kids = key
+    payload = json.dumps([version, query_key, states, location_key, good_for_kids, mode, offset],
+                         separators=(',', ':')).encode('utf-8')
+    return encode_part(payload) + '.' + encode_part(cursor_signature(payload))
+
+class InvalidCursor(ValueError):
+    pass
+
+def parse_cursor(cursor, version, n_terms):
+    """
+    Function to decode a cursor made by make_cursor. Returns the index
+    version, cache key, ranking mode and offset it holds, or None if the
+    cursor is malformed or was not signed with CURSOR_SECRET. The terms of a
+    cursor made on the given index version must be within the n_terms of its
+    vocabulary; a cursor made on another version is returned without its
+    key, since its search can no longer be paged through.
+    """
+    try:
+        payload, signature = cursor.split('.')
+        payload = decode_part(payload)
+        if not hmac.compare_digest(decode_part(signature), cursor_signature(payload)):
+            return None
+        cursor_version, query_key, states, location_key, good_for_kids, mode, offset = \
+            json.loads(payload)
+        if not isinstance(cursor_version, str) or not (mode is None or isinstance(mode, str)):
+            return None
+        offset = max(int(offset), 0)
+        if cursor_version != version:
+            return cursor_version, None, mode, offset
+        query_key = tuple((int(term), int(count)) for term, count in query_key)
+        if any(not 0 <= term < n_terms or count <= 0 for term, count in query_key):
+            return None
+        key = (query_key,
+               tuple(str(state) for state in states),
+               None if location_key is None else
+               (float(location_key[0]), float(location_key[1]), str(location_key[2])),
+               bool(good_for_kids))
+        return cursor_version, key, mode, offset
+    except (ValueError, TypeError, IndexError, AttributeError, binascii.Error):
+        return None
+
+def cursor_signature(payload) -> bytes:
+    return hmac.new(CURSOR_SECRET, payload, hashlib.sha256).digest()[:CURSOR_SIGNATURE_BYTES]
+
+def encode_part(data) -> str:
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+def decode_part(text) -> bytes:
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+def entry_size(value) -> int:
+    # tuples, such as a response and its cursor, are measured part by part
+    if isinstance(value, tuple):
+        return sum(entry_size(part) for part in value)
+    return sys.getsizeof(value)
+
+class QueryCache(object):
+    """
+    Thread-safe LRU cache of search results, such as serialized responses,
+    bounded by the total size of the cached results and expiring entries
+    after ttl seconds.
+    Entries are tied to the version of the index they were computed from,
+    and the whole cache is dropped as soon as a different version is seen.
+    """
+
+    def __init__(self, max_bytes=16 * 1024 * 1024, ttl=600):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.version = None
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, version):
+        """
+        Returns the cached response for key, or None on a miss.
+        """
+        with self.lock:
+            self._check_version(version)
+            entry = self.entries.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, version, response):
+        """
+        Caches response under key, evicting the least recently used entries
+        until the cache fits within max_bytes.
+        """
+        size = entry_size(response) + sys.getsizeof(key)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            self._check_version(version)
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (response, time.monotonic() + self.ttl, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self.entries),
+            'bytes': self.size,
+        }
+
+    def _check_version(self, version):
+        if version != self.version:
+            self.entries.clear()
+            self.size = 0
+            self.version = version
+
+    def _remove(self, key):
+        self.size -= self.entries.pop(key)[2]
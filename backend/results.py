@@ -0,0 +1,92 @@
+"""
+Helper file to assemble the JSON response of the /parks endpoint from the top
+scoring parks, using response fragments precomputed for every park and the
+reviews most relevant to the query, read from the index's review store.
+"""
+
+import json
+import math
+import numpy as np
+
+import park_store
+import snippets
+
+DEFAULT_IMAGE_URL = "static/images/default-park.jpg"
+DEFAULT_RESULTS = 10
+MAX_RESULTS = 100
+# offset of the last page that can be asked for, which bounds how deep a
+# search is ever ranked
+MAX_OFFSET = 1000
+# reviews shown with every result
+TOP_REVIEWS = 3
+
+def build_fragments(index) -> list[tuple[str, str, str]]:
+    """
+    Function to precompute the serialized response record of every park of
+    index from its columnar park metadata. Each record is split into the JSON
+    text around its score, the only field that depends on the query, and its
+    reviews, which are only read for the parks that are returned.
+    """
+    strings = np.asarray(index.park_strings)
+    string_offsets = np.asarray(index.park_string_offsets)
+    state_names = np.asarray(index.state_names).tolist()
+    fragments = []
+    for name_code, state_code, rating, image_code, website_code, tags in zip(
+            index.park_name_codes.tolist(), index.park_state_codes.tolist(),
+            index.ratings.tolist(), index.park_image_codes.tolist(),
+            index.park_website_codes.tolist(), index.tags.tolist()):
+        image_url = park_store.read_string(strings, string_offsets, image_code)
+        if not image_url or image_url == "None":
+            image_url = DEFAULT_IMAGE_URL
+
+        head = json.dumps({
+            'name': park_store.read_string(strings, string_offsets, name_code),
+            'location': state_names[state_code],
+        })
+        middle = ', "rating": ' + json.dumps(float(rating)) + ', "reviews": '
+        tail = json.dumps({
+            'image_url': image_url,
+            'website_url': park_store.read_string(strings, string_offsets, website_code),
+            'tag1': tags[0],
+            'tag2': tags[1],
+            'tag3': tags[2],
+        })
+        fragments.append((head[:-1] + ', "score": ', middle, ', ' + tail[1:]))
+    return fragments
+
+def top_k(rows, scores, k=DEFAULT_RESULTS, offset=0) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Function to select the results offset to offset + k, in descending order
+    of score, without sorting every candidate. Parks with a NaN score rank
+    last and ties keep the order of rows. Returns the selected rows and
+    their scores.
+    """
+    rows = np.asarray(rows)
+    # negate so that an ascending partition ranks the best scores first, and
+    # NaN scores, which numpy orders last, stay last
+    keys = -np.asarray(scores, dtype=np.float64)
+    end = min(offset + k, len(keys))
+    if offset >= end:
+        return rows[:0], keys[:0]
+    if end < len(keys):
+        selected = np.argpartition(keys, end - 1)[:end]
+    else:
+        selected = np.arange(len(keys))
+    selected = selected[np.lexsort((selected, keys[selected]))][offset:end]
+    return rows[selected], -keys[selected]
+
+def serialize(fragments, rows, scores, index, query_counts=None) -> str:
+    """
+    Function to serialize the given parks and scores as the JSON list of
+    records returned by /parks, reading the reviews of each park most
+    relevant to query_counts from index along with the offsets of the words
+    matching the query in each.
+    """
+    records = []
+    for row, score in zip(rows.tolist(), scores.tolist()):
+        head, middle, tail = fragments[row]
+        texts, highlights = snippets.top_reviews(index, row, query_counts or {}, TOP_REVIEWS)
+        records.append(head + (json.dumps(score) if math.isfinite(score) else 'null')
+                       + middle + json.dumps(texts) + ', "highlights": ' + json.dumps(highlights)
+                       + tail)
+    return '[' + ', '.join(records) + ']'
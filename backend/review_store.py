@@ -0,0 +1,70 @@
+"""
+Helper file implementing the on-disk store of review texts saved with the
+search index. The UTF-8 text of every review is concatenated into one byte
+array, alongside the offset of each review and the range of reviews of each
+park, so that with the arrays memory-mapped only the reviews of the parks
+actually returned are read from disk.
+"""
+
+import tempfile
+from array import array
+import numpy as np
+
+class ReviewStoreWriter(object):
+    """
+    Writes review texts to a temporary file as they are streamed in, so that
+    building the store holds no review text in memory. Parks may be added in
+    any order, and adding a park again replaces its reviews.
+    """
+
+    def __init__(self, n_parks):
+        self.file = tempfile.TemporaryFile()
+        self.size = 0
+        self.offsets = array('q', [0])
+        self.ranges = np.zeros((n_parks, 2), dtype=np.int64)
+
+    def add(self, row, texts):
+        """
+        Function to append the review texts of the park at row.
+        """
+        first = len(self.offsets) - 1
+        for text in texts:
+            data = text.encode('utf-8')
+            self.file.write(data)
+            self.size += len(data)
+            self.offsets.append(self.size)
+        self.ranges[row] = first, len(self.offsets) - 1
+
+    def arrays(self) -> dict[str, np.ndarray]:
+        """
+        Returns the store as index arrays. The review text array maps the
+        temporary file rather than reading it back into memory.
+        """
+        self.file.flush()
+        if self.size:
+            text = np.memmap(self.file, dtype=np.uint8, mode='r', shape=(self.size,))
+        else:
+            text = np.zeros(0, dtype=np.uint8)
+        return {
+            'review_text': text,
+            'review_offsets': np.frombuffer(self.offsets, dtype=np.int64).copy(),
+            'review_ranges': self.ranges,
+        }
+
+def read_reviews(text, offsets, ranges, row, limit=None) -> list[str]:
+    """
+    Function to read the texts of the reviews of the park at row, or of its
+    first limit reviews, from the store arrays.
+    """
+    first, end = (int(value) for value in ranges[row])
+    if limit is not None:
+        end = min(end, first + limit)
+    bounds = np.asarray(offsets[first:end + 1]) - int(offsets[first])
+    data = bytes(text[int(offsets[first]):int(offsets[end])])
+    return [data[start:stop].decode('utf-8') for start, stop in zip(bounds[:-1], bounds[1:])]
+
+def read_review(text, offsets, review) -> str:
+    """
+    Function to read the text of one review, by its number in the store.
+    """
+    return bytes(text[int(offsets[review]):int(offsets[review + 1])]).decode('utf-8')
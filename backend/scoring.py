@@ -0,0 +1,99 @@
+"""
+Helper file to score queries against every park at once using a sparse
+park-by-term TF-IDF matrix built from the search index.
+"""
+
+import numpy as np
+from scipy import sparse
+
+class ScoringEngine(object):
+    """
+    Scores tokenized queries against the parks in a search index. Queries are
+    passed as dictionaries mapping vocabulary columns to counts (see
+    helper_functions.query_term_counts), and a batch of queries is scored with
+    a single sparse matrix product.
+    """
+
+    def __init__(self, index):
+        self.n_parks = len(index.park_ids)
+        self.n_terms = len(index.vocabulary)
+        self.idf = np.asarray(index.idf)
+        # the index stores the TF-IDF matrix park by park, in CSR layout, so
+        # the matrix wraps its memory-mapped arrays without copying them
+        self.tfidf = sparse.csr_matrix((index.tfidf_weights, index.tfidf_terms,
+                                        index.tfidf_indptr),
+                                       shape=(self.n_parks, self.n_terms), copy=False)
+        self.binary = None
+        self.park_norms = np.asarray(index.park_norms)
+        self.park_term_counts = np.asarray(index.park_term_counts)
+
+    def query_matrix(self, queries) -> sparse.csr_matrix:
+        """
+        Returns a sparse matrix with one row of term counts per query.
+        """
+        indptr = [0]
+        indices = []
+        data = []
+        for query_counts in queries:
+            indices.extend(query_counts.keys())
+            data.extend(query_counts.values())
+            indptr.append(len(indices))
+        return sparse.csr_matrix((np.array(data, dtype=np.float64),
+                                  np.array(indices, dtype=np.int32),
+                                  np.array(indptr, dtype=np.int32)),
+                                 shape=(len(queries), self.n_terms))
+
+    def dot_products(self, query_mat) -> np.ndarray:
+        """
+        Returns the parks x queries matrix of TF-IDF inner products, where both
+        the query and park term counts are weighted by idf.
+        """
+        weighted_queries = query_mat.multiply(self.idf).tocsr()
+        return (self.tfidf @ weighted_queries.T).toarray()
+
+    def jaccard_scores(self, query_mat, full_vocabulary=True) -> np.ndarray:
+        """
+        Returns the parks x queries matrix of inner products normalized by
+        len(query) + len(park) - common, the number of distinct terms in either
+        the query or the park's reviews. When full_vocabulary is set, the
+        query is treated as a vector over the whole vocabulary, as the search
+        path does, in which case the denominator is the vocabulary size for
+        every park.
+        """
+        dots = self.dot_products(query_mat)
+        if full_vocabulary:
+            return dots / self.n_terms
+        if self.binary is None:
+            self.binary = self.tfidf.sign()
+        query_terms = query_mat.sign()
+        common = (self.binary @ query_terms.T).toarray()
+        total_tokens = query_terms.getnnz(axis=1)[np.newaxis, :] \
+                       + self.park_term_counts[:, np.newaxis] - common
+        return dots / np.maximum(total_tokens, 1)
+
+    def cosine_scores(self, query_mat) -> np.ndarray:
+        """
+        Returns the parks x queries matrix of cosine similarities between the
+        TF-IDF vectors of the queries and of each park's reviews.
+        """
+        dots = self.dot_products(query_mat)
+        weighted_queries = query_mat.multiply(self.idf).tocsr()
+        query_norms = np.sqrt(weighted_queries.multiply(weighted_queries).sum(axis=1)).A1
+        denominator = np.outer(self.park_norms, query_norms)
+        return np.divide(dots, denominator, out=np.zeros_like(dots),
+                         where=denominator > 0)
+
+    def score(self, query_counts, method='jaccard') -> np.ndarray:
+        """
+        Returns the score of every park for a single query.
+        """
+        return self.score_batch([query_counts], method)[:, 0]
+
+    def score_batch(self, queries, method='jaccard') -> np.ndarray:
+        """
+        Returns the parks x queries matrix of scores for a batch of queries.
+        """
+        query_mat = self.query_matrix(queries)
+        if method == 'cosine':
+            return self.cosine_scores(query_mat)
+        return self.jaccard_scores(query_mat)
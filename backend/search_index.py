@@ -0,0 +1,529 @@
+"""
+Helper file to build, save and load the on-disk search index artifact, so that
+the app can memory-map a prebuilt index at startup instead of re-tokenizing the
+whole review corpus every time a worker starts.
+
+Run `python search_index.py` in the backend folder to (re)build the index.
+"""
+
+import argparse
+import collections
+import contextlib
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from scipy import sparse
+
+import bm25
+import helper_functions
+import park_store
+import review_store
+import spelling
+import suggest
+import svd
+import vector_index
+
+logger = logging.getLogger(__name__)
+
+# bump whenever the layout or contents of the artifact change
+INDEX_FORMAT_VERSION = 11
+
+DEFAULT_INDEX_DIR = os.environ.get('PARKS_INDEX_DIR',
+                                   os.path.join(helper_functions.current_directory, 'index'))
+MANIFEST_FILE = 'manifest.json'
+# file beside the artifact that processes lock while checking and rebuilding
+# it, so that workers starting together build it once
+LOCK_SUFFIX = '.lock'
+# parks tokenized together while building, and the number of shards queued
+# per worker process during a parallel build, which bounds how much of the
+# dataset is in memory at once while keeping every worker busy
+SHARD_SIZE = 64
+SHARDS_PER_WORKER = 2
+ARRAY_NAMES = (
+    'park_ids',             # business id of each park row
+    'vocabulary',           # sorted unique stemmed terms
+    'postings_indptr',      # term -> slice of postings_parks/postings_counts
+    'postings_parks',       # park row of each posting, ascending per term
+    'postings_counts',      # number of times the term appears for that park
+    'doc_freq',             # number of reviews containing each term
+    'idf',                  # inverse document frequency of each term
+    'park_norms',           # norm of each park's TF-IDF vector
+    'park_term_counts',     # number of distinct terms in each park's reviews
+    'ratings',              # average review rating of each park
+    'review_counts',        # number of reviews of each park
+    'truncated_mat',        # parks projected onto the SVD dimensions
+    'svd_components',       # fitted SVD components (dimensions x terms)
+    'svd_singular_values',  # singular value of each SVD dimension
+    'svd_norms',            # norm of each row of truncated_mat
+    'svd_embeddings',       # rows of truncated_mat scaled to unit length
+    'tfidf_indptr',         # park -> slice of tfidf_terms/tfidf_weights
+    'tfidf_terms',          # term column of each park's postings, ascending
+    'tfidf_weights',        # count times idf of each park's postings
+    'park_lengths',         # number of terms in each park's reviews
+    'bm25_block_first',     # first park row of each BM25 postings block
+    'bm25_block_last',      # last park row of each block
+    'bm25_block_max',       # largest BM25 term frequency factor in each block
+    'bm25_gap_widths',      # bytes per park row gap of each term
+    'bm25_gap_bytes',       # park row gaps of every term's postings, packed
+    'bm25_count_widths',    # bytes per posting count of each term
+    'bm25_count_bytes',     # counts of every term's postings, packed
+    'review_text',          # UTF-8 text of every review, concatenated
+    'review_offsets',       # review -> slice of review_text
+    'review_ranges',        # park -> first and end review of that park
+    'review_term_indptr',   # review -> slice of review_terms/review_term_counts
+    'review_terms',         # term column of each review's postings, ascending
+    'review_term_counts',   # number of times the term appears in that review
+    'review_lengths',       # number of terms in each review
+    'park_latitudes',       # latitude of each park
+    'park_longitudes',      # longitude of each park
+    'park_state_codes',     # row of each park's state in state_names
+    'state_names',          # distinct states of the parks
+    'park_kids_bits',       # bitset of the parks that are good for kids
+    'park_strings',         # UTF-8 text of the interned park strings
+    'park_string_offsets',  # string code -> slice of park_strings
+    'park_name_codes',      # string code of each park's name
+    'park_image_codes',     # string code of each park's image URL
+    'park_website_codes',   # string code of each park's website URL
+    'tags',                 # three descriptive tags per park
+    'surface_forms',        # word each term most often appears as in reviews
+    'suggest_terms',        # sorted completion keys of the surface forms
+    'suggest_term_ids',     # term column of each key of suggest_terms
+    'suggest_names',        # sorted completion keys of the park names
+    'suggest_name_rows',    # park row of each key of suggest_names
+    'spelling_deletes',     # sorted deletes of the term prefixes, for corrections
+    'spelling_indptr',      # delete -> slice of spelling_terms
+    'spelling_terms',       # term columns each delete was obtained from
+    'stopwords',            # stopwords dropped while tokenizing, sorted
+)
+
+def source_checksum(json_file_path) -> str:
+    """
+    Function to compute the checksum of the source dataset, used to detect an
+    index artifact that is stale with respect to parks_details.json.
+    """
+    digest = hashlib.sha256()
+    with open(json_file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def count_shard(parks) -> tuple[dict, dict, int, dict, collections.Counter]:
+    """
+    Function to tokenize the reviews of one shard of parks and count them.
+    Returns the per-park term counts, the per-term review counts, the
+    number of reviews in the shard, the per-review term counts and the
+    counts of the unstemmed tokens.
+    """
+    surface_counts = collections.Counter()
+    review_tokens = helper_functions.tokenize_corpus(parks, surface_counts)
+    return helper_functions.aggregate_reviews(review_tokens), \
+           helper_functions.get_doc_freqs(review_tokens), \
+           helper_functions.num_docs(review_tokens), \
+           helper_functions.count_review_terms(review_tokens), \
+           surface_counts
+
+def count_parks(shards, workers=1) -> tuple[dict, dict, int, dict, collections.Counter]:
+    """
+    Function to count the terms of every park in an iterable of shards, each
+    a dictionary of consecutive parks, tokenizing them across a pool of
+    worker processes when workers > 1. Only a few shards are queued at a
+    time, and they are merged back in order, so the result is identical to a
+    serial count.
+    """
+    park_token_dict = {}
+    doc_freqs = {}
+    n_docs = 0
+    review_term_dict = {}
+    surface_counts = collections.Counter()
+
+    def merge(counts):
+        nonlocal n_docs
+        shard_tokens, shard_freqs, shard_docs, shard_review_terms, shard_surfaces = counts
+        park_token_dict.update(shard_tokens)
+        review_term_dict.update(shard_review_terms)
+        surface_counts.update(shard_surfaces)
+        for token, count in shard_freqs.items():
+            doc_freqs[token] = doc_freqs.get(token, 0) + count
+        n_docs += shard_docs
+
+    if workers <= 1:
+        for shard in shards:
+            merge(count_shard(shard))
+        return park_token_dict, doc_freqs, n_docs, review_term_dict, surface_counts
+
+    pending = collections.deque()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for shard in shards:
+            pending.append(pool.submit(count_shard, shard))
+            if len(pending) >= workers * SHARDS_PER_WORKER:
+                merge(pending.popleft().result())
+        while pending:
+            merge(pending.popleft().result())
+    return park_token_dict, doc_freqs, n_docs, review_term_dict, surface_counts
+
+def tfidf_arrays(counts, idf) -> dict[str, np.ndarray]:
+    """
+    Function to lay out the park x term count matrix, weighted by idf, park by
+    park (the CSR layout), so that the scoring engine can use the saved arrays
+    as its matrix directly instead of building a private copy.
+    """
+    tfidf = sparse.csr_matrix(counts.multiply(np.asarray(idf)), dtype=np.float64)
+    tfidf.sort_indices()
+    return {
+        'tfidf_indptr': tfidf.indptr,
+        'tfidf_terms': tfidf.indices,
+        'tfidf_weights': tfidf.data,
+    }
+
+def review_index_arrays(park_ids, review_term_dict, review_ranges,
+                        term_reverse_index) -> dict[str, np.ndarray]:
+    """
+    Function to lay out the review-level index: the term counts of every
+    review, numbered as in the review store, review by review (the CSR
+    layout), along with the number of terms in each review. Scoring the
+    reviews of a park then only reads that park's contiguous slice.
+    """
+    n_reviews = int(np.max(review_ranges[:, 1], initial=0))
+    review_postings = [None] * n_reviews
+    for row, park in enumerate(park_ids):
+        first = int(review_ranges[row, 0])
+        for review, token_dict in enumerate(review_term_dict[park], first):
+            review_postings[review] = sorted((term_reverse_index[token], count)
+                                             for token, count in token_dict.items())
+    review_term_indptr = np.zeros(n_reviews + 1, dtype=np.int64)
+    review_term_indptr[1:] = np.cumsum([len(postings) for postings in review_postings])
+    postings = [posting for postings in review_postings for posting in postings]
+    review_term_counts = np.array([count for _, count in postings], dtype=np.int32)
+    posting_reviews = np.repeat(np.arange(n_reviews), np.diff(review_term_indptr))
+    return {
+        'review_term_indptr': review_term_indptr,
+        'review_terms': np.array([term for term, _ in postings], dtype=np.int32),
+        'review_term_counts': review_term_counts,
+        'review_lengths': np.bincount(posting_reviews, weights=review_term_counts,
+                                      minlength=n_reviews).astype(np.int32),
+    }
+
+def build_index(json_file_path=helper_functions.json_file_path, workers=1,
+                svd_options=None) -> tuple[dict, dict]:
+    """
+    Function to build every array stored in the index artifact from the
+    dataset at json_file_path, tokenizing across workers processes.
+    svd_options override svd.DEFAULT_OPTIONS for the latent model and are
+    recorded in the manifest. Returns the arrays along with the manifest
+    describing them.
+    """
+    # the stopwords are fixed for the build, and bundled with the index so
+    # that serving it needs neither the NLTK data nor the network
+    stopwords = helper_functions.stopword_list()
+    helper_functions.use_stopwords(stopwords)
+
+    # a first pass finds the rows of the parks, in order of first appearance,
+    # and the entry that holds each park's data, its last one
+    rows = {}
+    last_positions = {}
+    for position, entry in enumerate(helper_functions.iter_parks(json_file_path)):
+        rows.setdefault(entry['business_id'], len(rows))
+        last_positions[entry['business_id']] = position
+    park_ids = list(rows)
+
+    # the second pass writes the review texts to the review store and hands
+    # the reviews to the tokenizer shard by shard
+    store = review_store.ReviewStoreWriter(len(park_ids))
+    records = [None] * len(park_ids)
+    rating_sums = np.zeros(len(park_ids))
+    review_counts = np.zeros(len(park_ids), dtype=np.int32)
+
+    def shards():
+        shard = {}
+        for position, entry in enumerate(helper_functions.iter_parks(json_file_path)):
+            park = entry['business_id']
+            if last_positions[park] != position:
+                continue
+            row = rows[park]
+            records[row] = helper_functions.park_record(entry)
+            store.add(row, (review['text'] for review in entry['reviews']))
+            rating_sums[row] = sum(review['stars'] for review in entry['reviews'])
+            review_counts[row] = len(entry['reviews'])
+            shard[park] = {'reviews': [{'text': review['text']} for review in entry['reviews']]}
+            if len(shard) == SHARD_SIZE:
+                yield shard
+                shard = {}
+        if shard:
+            yield shard
+
+    park_token_dict, doc_freqs, n_docs, review_term_dict, surface_counts = \
+        count_parks(shards(), workers)
+    vocabulary = sorted(doc_freqs)
+    term_reverse_index = {token : index for index, token in enumerate(vocabulary)}
+
+    # flatten the per-park term counts into CSR-style postings arrays; parks
+    # are visited in row order, so every posting list comes out sorted
+    posting_lists = [[] for _ in vocabulary]
+    for row, park in enumerate(park_ids):
+        for token, count in park_token_dict[park].items():
+            posting_lists[term_reverse_index[token]].append((row, count))
+    postings_indptr = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+    postings_indptr[1:] = np.cumsum([len(postings) for postings in posting_lists])
+    postings = [posting for postings in posting_lists for posting in postings]
+    postings_parks = np.array([row for row, _ in postings], dtype=np.int32)
+    postings_counts = np.array([count for _, count in postings], dtype=np.int32)
+
+    doc_freq = np.array([doc_freqs[token] for token in vocabulary], dtype=np.int32)
+    idf = np.array([n_docs / doc_freqs[token] for token in vocabulary], dtype=np.float64)
+    posting_terms = np.repeat(np.arange(len(vocabulary)),
+                              np.diff(postings_indptr))
+    park_norms = np.sqrt(np.bincount(postings_parks,
+                                     weights=(postings_counts * idf[posting_terms]) ** 2,
+                                     minlength=len(park_ids)))
+    park_term_counts = np.bincount(postings_parks, minlength=len(park_ids))
+
+    # fit the latent model on the sparse park-term matrix, which the postings
+    # already hold in CSC layout
+    counts = sparse.csc_matrix((postings_counts, postings_parks, postings_indptr),
+                               shape=(len(park_ids), len(vocabulary)))
+    model, truncated_mat, svd_options = svd.fit_latent_model(counts, idf, svd_options)
+
+    arrays = {
+        'park_ids': np.array(park_ids),
+        'vocabulary': np.array(vocabulary),
+        'postings_indptr': postings_indptr,
+        'postings_parks': postings_parks,
+        'postings_counts': postings_counts,
+        'doc_freq': doc_freq,
+        'idf': idf,
+        'park_norms': park_norms,
+        'park_term_counts': park_term_counts.astype(np.int32),
+        'ratings': rating_sums / np.maximum(review_counts, 1),
+        'review_counts': review_counts,
+        'truncated_mat': truncated_mat,
+        'svd_components': model.components_,
+        'svd_singular_values': model.singular_values_,
+        'svd_norms': np.linalg.norm(truncated_mat, axis=1),
+        'svd_embeddings': vector_index.normalize_rows(truncated_mat),
+        'tags': np.array(svd.assign_tags(truncated_mat)),
+        'stopwords': np.array(stopwords),
+    }
+    arrays.update(tfidf_arrays(counts, idf))
+    arrays.update(bm25.postings_arrays(postings_indptr, postings_parks, postings_counts,
+                                       len(park_ids)))
+    arrays.update(store.arrays())
+    arrays.update(review_index_arrays(park_ids, review_term_dict, arrays['review_ranges'],
+                                      term_reverse_index))
+    arrays.update(park_store.metadata_arrays(records))
+    arrays['surface_forms'] = suggest.surface_forms(vocabulary, surface_counts)
+    arrays.update(suggest.suggestion_arrays(arrays['surface_forms'],
+                                            [record['name'] for record in records]))
+    arrays.update(spelling.correction_arrays(vocabulary))
+    manifest = {
+        'format_version': INDEX_FORMAT_VERSION,
+        'source_file': os.path.basename(json_file_path),
+        'source_checksum': source_checksum(json_file_path),
+        'n_parks': len(park_ids),
+        'n_terms': len(vocabulary),
+        'n_reviews': n_docs,
+        'avg_review_length': float(np.mean(arrays['review_lengths'])) if n_docs else 0.0,
+        'svd': svd_options,
+    }
+    return arrays, manifest
+
+def save_index(arrays, manifest, index_dir=DEFAULT_INDEX_DIR):
+    """
+    Function to write the index arrays and manifest to index_dir. The artifact
+    is written to a temporary directory first and then swapped into place, so
+    that readers never observe a half-written index.
+    """
+    parent_dir = os.path.dirname(os.path.abspath(index_dir))
+    os.makedirs(parent_dir, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix='.index-', dir=parent_dir)
+    for name in ARRAY_NAMES:
+        np.save(os.path.join(tmp_dir, name + '.npy'), arrays[name],
+                allow_pickle=False)
+    with open(os.path.join(tmp_dir, MANIFEST_FILE), 'w') as file:
+        json.dump(manifest, file, indent=2)
+
+    old_dir = None
+    if os.path.exists(index_dir):
+        old_dir = tmp_dir + '-old'
+        os.replace(index_dir, old_dir)
+    try:
+        os.replace(tmp_dir, index_dir)
+    except OSError:
+        # another process swapped its artifact in first; keep that one
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        if old_dir is not None and not os.path.exists(index_dir):
+            os.replace(old_dir, index_dir)
+            old_dir = None
+        if read_manifest(index_dir) is None:
+            raise
+        logger.info("search index in %s was built by another process", index_dir)
+    if old_dir is not None:
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+@contextlib.contextmanager
+def build_lock(index_dir=DEFAULT_INDEX_DIR):
+    """
+    Function to hold an exclusive lock on the lock file beside index_dir, so
+    that only one process at a time checks and rebuilds the artifact there.
+    """
+    path = os.path.abspath(index_dir).rstrip(os.sep) + LOCK_SUFFIX
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a') as file:
+        fcntl.flock(file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(file, fcntl.LOCK_UN)
+
+def read_manifest(index_dir=DEFAULT_INDEX_DIR):
+    """
+    Function to read the manifest of the artifact in index_dir. Returns None if
+    there is no readable artifact there.
+    """
+    try:
+        with open(os.path.join(index_dir, MANIFEST_FILE), 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+def is_stale(manifest, json_file_path=helper_functions.json_file_path) -> bool:
+    """
+    Function to determine whether an artifact needs to be rebuilt, either
+    because it was written by a different format version or because the
+    source dataset has changed since it was built.
+    """
+    return manifest is None \
+        or manifest.get('format_version') != INDEX_FORMAT_VERSION \
+        or manifest.get('source_checksum') != source_checksum(json_file_path)
+
+class SearchIndex(object):
+    """
+    Read-only view over a saved index artifact. Every array is memory-mapped,
+    so loading is cheap, pages are only read from disk when touched, and
+    processes that load the same artifact share its pages instead of each
+    holding a copy.
+    """
+
+    def __init__(self, index_dir, manifest):
+        self.index_dir = index_dir
+        self.manifest = manifest
+        self.version = manifest['source_checksum'][:16]
+        for name in ARRAY_NAMES:
+            setattr(self, name, np.load(os.path.join(index_dir, name + '.npy'),
+                                        mmap_mode='r', allow_pickle=False))
+
+    def term_id(self, token) -> int:
+        """
+        Returns the column of token in the vocabulary, or -1 if the token does
+        not appear in any review.
+        """
+        position = int(np.searchsorted(self.vocabulary, token))
+        if position < len(self.vocabulary) and self.vocabulary[position] == token:
+            return position
+        return -1
+
+    def postings(self, term_index):
+        """
+        Returns the park rows and counts of every posting for term_index.
+        """
+        start = self.postings_indptr[term_index]
+        end = self.postings_indptr[term_index + 1]
+        return self.postings_parks[start:end], self.postings_counts[start:end]
+
+    def review_texts(self, row, limit=None) -> list[str]:
+        """
+        Returns the texts of the reviews of the park at row, or of its first
+        limit reviews.
+        """
+        return review_store.read_reviews(self.review_text, self.review_offsets,
+                                         self.review_ranges, row, limit)
+
+    def review_texts_at(self, row, positions) -> list[str]:
+        """
+        Returns the texts of the reviews of the park at row at the given
+        positions among its reviews.
+        """
+        first = int(self.review_ranges[row][0])
+        return [review_store.read_review(self.review_text, self.review_offsets, first + position)
+                for position in positions]
+
+    def review_postings(self, row) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Returns the review-level postings of the park at row: the offsets of
+        each of its reviews into the term and count arrays that follow, and
+        the length of each review.
+        """
+        first, end = (int(value) for value in self.review_ranges[row])
+        start, stop = int(self.review_term_indptr[first]), int(self.review_term_indptr[end])
+        return np.asarray(self.review_term_indptr[first:end + 1]) - start, \
+               self.review_terms[start:stop], self.review_term_counts[start:stop], \
+               self.review_lengths[first:end]
+
+def load_index(index_dir=DEFAULT_INDEX_DIR, json_file_path=helper_functions.json_file_path,
+               rebuild=True) -> SearchIndex:
+    """
+    Function to load the index artifact in index_dir. If the artifact is
+    missing or stale and rebuild is set, it is rebuilt from json_file_path
+    first.
+    """
+    manifest = read_manifest(index_dir)
+    if is_stale(manifest, json_file_path):
+        if not rebuild:
+            raise RuntimeError(f"search index in {index_dir} is missing or stale; "
+                               "run `python search_index.py` to rebuild it")
+        with build_lock(index_dir):
+            # another process may have rebuilt it while this one waited
+            manifest = read_manifest(index_dir)
+            if is_stale(manifest, json_file_path):
+                logger.info("search index in %s is missing or stale, rebuilding it", index_dir)
+                arrays, manifest = build_index(json_file_path)
+                save_index(arrays, manifest, index_dir)
+                manifest = read_manifest(index_dir)
+    index = SearchIndex(index_dir, manifest)
+    # queries are tokenized with the stopwords the index was built with
+    helper_functions.use_stopwords(np.asarray(index.stopwords).tolist())
+    return index
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the search index artifact.")
+    parser.add_argument('--source', default=helper_functions.json_file_path,
+                        help="path to the parks dataset")
+    parser.add_argument('--index-dir', default=DEFAULT_INDEX_DIR,
+                        help="directory to write the artifact to")
+    parser.add_argument('--force', action='store_true',
+                        help="rebuild even if the artifact is up to date")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="number of processes to tokenize the reviews with")
+    parser.add_argument('--svd-components', type=int,
+                        default=svd.DEFAULT_OPTIONS['n_components'],
+                        help="rank of the latent model")
+    parser.add_argument('--svd-algorithm', choices=('randomized', 'arpack'),
+                        default=svd.DEFAULT_OPTIONS['algorithm'],
+                        help="solver used to fit the latent model")
+    parser.add_argument('--svd-weighting', choices=('count', 'tfidf'),
+                        default=svd.DEFAULT_OPTIONS['weighting'],
+                        help="term weighting of the matrix the latent model is fit on")
+    parser.add_argument('--svd-seed', type=int,
+                        default=svd.DEFAULT_OPTIONS['random_state'],
+                        help="random seed of the latent model")
+    args = parser.parse_args()
+
+    with build_lock(args.index_dir):
+        if args.force or is_stale(read_manifest(args.index_dir), args.source):
+            svd_options = {
+                'n_components': args.svd_components,
+                'algorithm': args.svd_algorithm,
+                'weighting': args.svd_weighting,
+                'random_state': args.svd_seed,
+            }
+            arrays, manifest = build_index(args.source, args.workers, svd_options)
+            save_index(arrays, manifest, args.index_dir)
+            print(f"Built index with {manifest['n_parks']} parks and "
+                  f"{manifest['n_terms']} terms in {args.index_dir}")
+        else:
+            print(f"Index in {args.index_dir} is up to date")
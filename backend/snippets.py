@@ -0,0 +1,87 @@
+"""
+Helper file to pick the reviews shown with each result. The reviews of a
+returned park are scored against the query terms with BM25, using the
+review-level postings of the index, so that only the returned parks' reviews
+are scored and no review is tokenized while searching. The words of the
+chosen reviews that match a query term are located for highlighting.
+"""
+
+import re
+from functools import lru_cache
+import numpy as np
+
+import helper_functions
+
+# BM25 term frequency saturation and review length normalization
+K1 = 1.2
+B = 0.75
+
+# leading characters of a stem that the word it was stemmed from is assumed
+# to start with; stemming only rewrites the ends of words
+STEM_PREFIX_LENGTH = 3
+
+def rank_reviews(index, row, query_counts, limit) -> list[int]:
+    """
+    Function to rank the reviews of the park at row by their BM25 score
+    against query_counts, as returned by helper_functions.query_term_counts.
+    Returns the positions among the park's reviews of its best limit
+    reviews; reviews scoring the same, including those matching no query
+    term, keep their order in the dataset.
+    """
+    indptr, terms, counts, lengths = index.review_postings(row)
+    n_reviews = len(lengths)
+    if not query_counts or n_reviews == 0:
+        return list(range(min(limit, n_reviews)))
+
+    query_terms = np.array(sorted(query_counts), dtype=np.int64)
+    terms = np.asarray(terms)
+    matched = np.flatnonzero(np.isin(terms, query_terms))
+    if len(matched) == 0:
+        return list(range(min(limit, n_reviews)))
+
+    reviews = np.searchsorted(indptr, matched, side='right') - 1
+    matched_terms = terms[matched]
+    tf = np.asarray(counts)[matched].astype(np.float64)
+    query_weights = np.array([query_counts[term] for term in query_terms.tolist()], dtype=np.float64)
+    weights = query_weights[np.searchsorted(query_terms, matched_terms)] \
+        * np.log1p(np.asarray(index.idf)[matched_terms])
+    average_length = index.manifest.get('avg_review_length') or 1.0
+    norms = K1 * (1 - B + B * np.asarray(lengths)[reviews] / average_length)
+    scores = np.bincount(reviews, weights=weights * tf * (K1 + 1) / (tf + norms),
+                         minlength=n_reviews)
+    order = np.lexsort((np.arange(n_reviews), -scores))
+    return order[:limit].tolist()
+
+def highlight_spans(text, stems) -> list[list[int]]:
+    """
+    Function to locate the words of text that normalize to one of stems, the
+    stemmed query terms. Returns the [start, end) character offsets of each
+    matching word, in order.
+    """
+    if not stems:
+        return []
+    spans = []
+    for match in candidate_words(frozenset(stems)).finditer(text):
+        if helper_functions.normalize_token(match.group().lower()) in stems:
+            spans.append([match.start(), match.end()])
+    return spans
+
+@lru_cache(maxsize=1024)
+def candidate_words(stems):
+    """
+    Function to compile a pattern matching the words that start like one of
+    stems, so that only those words need to be stemmed to find the matches.
+    """
+    prefixes = sorted({stem[:max(min(STEM_PREFIX_LENGTH, len(stem) - 1), 1)] for stem in stems},
+                      key=len, reverse=True)
+    return re.compile(r'(?<!\w)(?:' + '|'.join(map(re.escape, prefixes)) + r')\w*', re.IGNORECASE)
+
+def top_reviews(index, row, query_counts, limit) -> tuple[list[str], list[list[list[int]]]]:
+    """
+    Function to select the limit reviews of the park at row most relevant to
+    query_counts. Returns their texts along with the highlight spans of each.
+    """
+    positions = rank_reviews(index, row, query_counts, limit)
+    texts = index.review_texts_at(row, positions)
+    stems = {str(index.vocabulary[term]) for term in query_counts}
+    return texts, [highlight_spans(text, stems) for text in texts]
@@ -0,0 +1,147 @@
+"""
+Helper file to answer travel distance filters with a precomputed ball tree over
+park coordinates instead of a geodesic calculation for every park.
+"""
+
+import numpy as np
+
+EARTH_RADIUS_MILES = 3958.7613
+
+# maximum distance, in miles, for each travel distance option; "fly" accepts
+# every park and so has no entry
+DISTANCE_MILES = {
+    "local": 100,
+    "regional": 250,
+    "long": 500,
+}
+
+# the haversine distance assumes a spherical earth and differs from the WGS-84
+# geodesic distance by well under 1%, so only parks within this relative
+# margin of the cutoff need an exact geodesic check
+HAVERSINE_TOLERANCE = 0.01
+
+def bounding_box(latitude, longitude, miles) -> tuple[float, float, float, float]:
+    """
+    Function to compute a latitude/longitude box containing every point within
+    the given number of miles of (latitude, longitude), as (min latitude, max
+    latitude, min longitude, max longitude). The box is widened by
+    HAVERSINE_TOLERANCE. A box crossing the antimeridian has a min longitude
+    greater than its max longitude.
+    """
+    latitude = float(latitude)
+    longitude = float(longitude)
+    angle = float(np.degrees(miles * (1 + HAVERSINE_TOLERANCE) / EARTH_RADIUS_MILES))
+    min_latitude = latitude - angle
+    max_latitude = latitude + angle
+    if min_latitude <= -90 or max_latitude >= 90:
+        # the circle contains a pole, so it spans every longitude
+        return max(min_latitude, -90.0), min(max_latitude, 90.0), -180.0, 180.0
+    spread = np.degrees(np.arcsin(min(np.sin(np.radians(angle)) / np.cos(np.radians(latitude)), 1.0)))
+    if spread >= 180:
+        return min_latitude, max_latitude, -180.0, 180.0
+    min_longitude = (longitude - spread + 180) % 360 - 180
+    max_longitude = (longitude + spread + 180) % 360 - 180
+    return min_latitude, max_latitude, float(min_longitude), float(max_longitude)
+
+def is_location(latitude, longitude) -> bool:
+    """
+    Function to check that latitude and longitude are finite numbers, as a
+    radius query needs.
+    """
+    try:
+        return bool(np.isfinite(float(latitude)) and np.isfinite(float(longitude)))
+    except (TypeError, ValueError):
+        return False
+
+def haversine_miles(latitude, longitude, latitudes, longitudes) -> np.ndarray:
+    """
+    Function to compute the haversine distance, in miles, from (latitude,
+    longitude) to each of the points given by latitudes and longitudes.
+    """
+    latitude = np.radians(float(latitude))
+    longitude = np.radians(float(longitude))
+    latitudes = np.radians(np.asarray(latitudes, dtype=np.float64))
+    longitudes = np.radians(np.asarray(longitudes, dtype=np.float64))
+    a = np.sin((latitudes - latitude) / 2) ** 2 \
+        + np.cos(latitude) * np.cos(latitudes) * np.sin((longitudes - longitude) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+class ParkLocator(object):
+    """
+    Ball tree over park coordinates, answering "which parks are within this
+    many miles" as a radius query. Rows returned are positions in the
+    latitude and longitude arrays the locator was built from. The tree, and
+    scikit-learn with it, is only loaded by the first radius query.
+    """
+
+    def __init__(self, latitudes, longitudes):
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)
+        self._tree = None
+
+    @property
+    def tree(self):
+        if self._tree is None:
+            from sklearn.neighbors import BallTree
+            self._tree = BallTree(np.radians(np.column_stack([self.latitudes,
+                                                              self.longitudes])),
+                                  metric='haversine')
+        return self._tree
+
+    def within(self, latitude, longitude, miles) -> np.ndarray:
+        """
+        Returns the sorted rows of every park whose geodesic distance from
+        (latitude, longitude) is at most the given number of miles, or no
+        rows if the location is not a pair of finite numbers.
+        """
+        if not is_location(latitude, longitude):
+            return np.zeros(0, dtype=np.int64)
+        point = np.radians([[float(latitude), float(longitude)]])
+        rows, distances = self.tree.query_radius(
+            point, r=miles * (1 + HAVERSINE_TOLERANCE) / EARTH_RADIUS_MILES,
+            return_distance=True)
+        return self._confirm(rows[0], distances[0] * EARTH_RADIUS_MILES,
+                             latitude, longitude, miles)
+
+    def rows_within(self, rows, latitude, longitude, miles) -> np.ndarray:
+        """
+        Returns the sorted rows, among the given rows, of the parks whose
+        geodesic distance from (latitude, longitude) is at most the given
+        number of miles. Only those rows are measured, so this is the check
+        to use on rows already narrowed down, e.g. to a bounding box.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if not is_location(latitude, longitude):
+            return rows[:0]
+        distances = haversine_miles(latitude, longitude,
+                                    self.latitudes[rows], self.longitudes[rows])
+        near = distances <= miles * (1 + HAVERSINE_TOLERANCE)
+        return self._confirm(rows[near], distances[near], latitude, longitude, miles)
+
+    def _confirm(self, rows, distances, latitude, longitude, miles) -> np.ndarray:
+        # rows within the haversine radius widened by HAVERSINE_TOLERANCE, and
+        # their haversine distances, narrowed to those within the geodesic one
+        from geopy.distance import geodesic
+        latitude = float(latitude)
+        longitude = float(longitude)
+
+        # parks comfortably inside the radius are accepted outright, and only
+        # the borderline ones are checked against the exact geodesic distance
+        inside = distances <= miles * (1 - HAVERSINE_TOLERANCE)
+        borderline = [row for row in rows[~inside]
+                      if geodesic((latitude, longitude),
+                                  (self.latitudes[row], self.longitudes[row])).miles <= miles]
+        return np.sort(np.concatenate([rows[inside],
+                                       np.array(borderline, dtype=rows.dtype)]))
+
+    def distance_mask(self, latitude, longitude, distance) -> np.ndarray:
+        """
+        Function to return a boolean mask over the parks marking those within
+        the travel distance option selected by the user.
+        """
+        if distance == "fly":
+            return np.ones(len(self.latitudes), dtype=bool)
+        mask = np.zeros(len(self.latitudes), dtype=bool)
+        if distance in DISTANCE_MILES:
+            mask[self.within(latitude, longitude, DISTANCE_MILES[distance])] = True
+        return mask
@@ -0,0 +1,133 @@
+"""
+Helper file to correct misspelled query terms. Every term of the vocabulary
+is indexed under the strings left after deleting up to MAX_EDIT_DISTANCE of
+its characters (the symmetric delete method), so the terms close to a
+misspelling are found by looking up the misspelling's own deletes instead
+of comparing it with the whole vocabulary.
+"""
+
+from functools import lru_cache
+import numpy as np
+
+# largest edit distance corrected, and the shortest terms that may be
+# corrected at distance 1 and 2; shorter terms are too ambiguous to correct
+MAX_EDIT_DISTANCE = 2
+MIN_LENGTHS = (3, 6)
+# only the first PREFIX_LENGTH characters of a term are indexed, which bounds
+# the deletes of long terms; candidates are then checked in full
+PREFIX_LENGTH = 7
+# corrections remembered per corrector
+CORRECTION_CACHE_SIZE = 1 << 12
+
+def deletes(word, distance) -> set[str]:
+    """
+    Function to generate every string obtained by deleting up to distance
+    characters from word, word included.
+    """
+    found = {word}
+    frontier = {word}
+    for _ in range(distance):
+        frontier = {candidate[:position] + candidate[position + 1:]
+                    for candidate in frontier for position in range(len(candidate))}
+        found |= frontier
+    return found
+
+def edit_distances(word, codes, lengths) -> np.ndarray:
+    """
+    Function to compute the optimal string alignment distance between word
+    and each of a set of terms: the insertions, deletions, substitutions and
+    transpositions of adjacent characters turning one into the other. The
+    terms are given as the rows of codes, their code points padded with
+    zeros, along with their lengths. Every term is compared at once, a row
+    of the dynamic program at a time.
+    """
+    word = [ord(character) for character in word]
+    codes = np.asarray(codes, dtype=np.int64)
+    columns = np.arange(codes.shape[1] + 1)
+    earlier = None
+    before = np.broadcast_to(columns, (len(codes), len(columns)))
+    for i, code in enumerate(word, 1):
+        row = np.empty_like(before)
+        row[:, 0] = i
+        # deletions and substitutions, then transpositions
+        row[:, 1:] = np.minimum(before[:, 1:] + 1, before[:, :-1] + (codes != code))
+        if i > 1:
+            swapped = (codes[:, :-1] == code) & (codes[:, 1:] == word[i - 2])
+            row[:, 2:] = np.where(swapped, np.minimum(row[:, 2:], earlier[:, :-2] + 1), row[:, 2:])
+        # insertions: row[j] = min(row[j], row[j - 1] + 1), as a running minimum
+        row = np.minimum.accumulate(row - columns, axis=1) + columns
+        earlier, before = before, row
+    return before[np.arange(len(codes)), lengths]
+
+def max_distance(term) -> int:
+    """
+    Function to determine how many edits away from term a correction may be.
+    """
+    return sum(len(term) >= length for length in MIN_LENGTHS)
+
+def correction_arrays(vocabulary) -> dict[str, np.ndarray]:
+    """
+    Function to build the symmetric delete index of vocabulary: the sorted
+    distinct deletes of the prefixes of its terms, and for each the terms
+    it was obtained from (the CSR layout).
+    """
+    keys = []
+    terms = []
+    for term_index, term in enumerate(np.asarray(vocabulary).tolist()):
+        for delete in deletes(term[:PREFIX_LENGTH], MAX_EDIT_DISTANCE):
+            keys.append(delete)
+            terms.append(term_index)
+    keys = np.array(keys, dtype=str)
+    terms = np.array(terms, dtype=np.int32)
+    order = np.lexsort((terms, keys))
+    keys, terms = keys[order], terms[order]
+    starts = np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1]])) if len(keys) \
+        else np.zeros(0, dtype=np.int64)
+    return {
+        'spelling_deletes': keys[starts],
+        'spelling_indptr': np.append(starts, len(keys)).astype(np.int64),
+        'spelling_terms': terms,
+    }
+
+class SpellingCorrector(object):
+    """
+    Corrections of terms missing from the vocabulary of an index, to the
+    closest terms by edit distance; among equally close terms, the one found
+    in the most reviews wins.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        # plain views of the arrays, which index faster than memory maps
+        self.deletes = np.asarray(index.spelling_deletes)
+        self.indptr = np.asarray(index.spelling_indptr)
+        self.terms = np.asarray(index.spelling_terms)
+        # the code points of each term, zero padded, and its length
+        vocabulary = np.ascontiguousarray(index.vocabulary)
+        self.codes = vocabulary.view(np.uint32).reshape(len(vocabulary), -1)
+        self.lengths = np.char.str_len(vocabulary)
+        self.correct = lru_cache(maxsize=CORRECTION_CACHE_SIZE)(self._correct)
+
+    def _correct(self, token) -> int:
+        # column of the correction of token, a stemmed term missing from the
+        # vocabulary, or -1 if no term is close enough
+        distance = max_distance(token)
+        if distance == 0 or len(self.deletes) == 0:
+            return -1
+        keys = np.array(sorted(deletes(token[:PREFIX_LENGTH], distance)))
+        positions = np.minimum(np.searchsorted(self.deletes, keys), len(self.deletes) - 1)
+        positions = positions[self.deletes[positions] == keys]
+        if len(positions) == 0:
+            return -1
+        candidates = np.unique(np.concatenate(
+            [self.terms[start:end] for start, end in zip(self.indptr[positions].tolist(),
+                                                         self.indptr[positions + 1].tolist())]))
+        lengths = self.lengths[candidates]
+        close = np.abs(lengths - len(token)) <= distance
+        candidates, lengths = candidates[close], lengths[close]
+        if len(candidates) == 0:
+            return -1
+
+        distances = edit_distances(token, self.codes[candidates, :lengths.max()], lengths)
+        best = np.lexsort((candidates, -np.asarray(self.index.doc_freq)[candidates], distances))[0]
+        return int(candidates[best]) if distances[best] <= distance else -1
@@ -0,0 +1,88 @@
+"""
+Helper file reporting where the startup time of the app goes: the time spent
+importing each package, as measured by Python's -X importtime, and the time
+spent in each stage of loading the search state. The app is started in a
+fresh interpreter, so nothing is imported beforehand.
+
+Run `python startup_report.py` in the backend folder; `--module asgi` reports
+on the ASGI entry point, and `--warm-up` also loads what the first searches
+would otherwise load.
+"""
+
+import argparse
+import collections
+import json
+import os
+import subprocess
+import sys
+
+# run in the fresh interpreter; the last line it prints holds the time taken
+# to import the module and the time spent in each load stage
+STARTUP_SCRIPT = """
+import json, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+if {warm_up}:
+    import app
+    app.warm_up()
+import metrics
+print(json.dumps({{'seconds': seconds, 'stages': metrics.LOAD_SECONDS.sums()}}))
+"""
+
+def measure_startup(module='app', warm_up=False) -> tuple[float, dict, list]:
+    """
+    Function to import module in a fresh interpreter. Returns the seconds the
+    import took, the seconds spent in each load stage, and the import time
+    of every imported module as (name, self seconds, cumulative seconds)
+    tuples in import order.
+    """
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c',
+         STARTUP_SCRIPT.format(module=module, warm_up=warm_up)],
+        cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True)
+    if process.returncode != 0:
+        raise RuntimeError(f"starting {module} failed:\n{process.stderr}")
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+
+    imports = []
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        imports.append((fields[2].strip(), int(fields[0]) / 1e6, int(fields[1]) / 1e6))
+    return result['seconds'], result['stages'], imports
+
+def package_times(imports) -> list[tuple[str, float]]:
+    """
+    Function to total the self import time of the modules of each top-level
+    package, slowest first.
+    """
+    totals = collections.Counter()
+    for name, self_seconds, _ in imports:
+        totals[name.split('.')[0]] += self_seconds
+    return totals.most_common()
+
+def print_report(module, seconds, stages, imports, top):
+    print(f"importing {module} took {seconds:.3f}s")
+    print(f"modules imported: {len(imports)}, taking "
+          f"{sum(self_seconds for _, self_seconds, _ in imports):.3f}s as measured by -X importtime")
+    print(f"\n{'package':<32}{'import (s)':>12}")
+    for package, package_seconds in package_times(imports)[:top]:
+        print(f"{package:<32}{package_seconds:>12.3f}")
+    print(f"\n{'load stage':<32}{'time (s)':>12}")
+    for stage, stage_seconds in sorted(stages.items(), key=lambda item: -item[1]):
+        print(f"{stage:<32}{stage_seconds:>12.3f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report where the startup time of the app goes.")
+    parser.add_argument('--module', default='app', choices=('app', 'asgi'),
+                        help="entry point to start")
+    parser.add_argument('--warm-up', action='store_true',
+                        help="also load what the first searches would otherwise load")
+    parser.add_argument('--top', type=int, default=15,
+                        help="number of packages to list")
+    args = parser.parse_args()
+    print_report(args.module, *measure_startup(args.module, args.warm_up), args.top)
@@ -0,0 +1,185 @@
+"""
+Helper file to complete partially typed queries. Park names and the words of
+the review vocabulary are kept as sorted arrays of keys, built with the index,
+so that the keys starting with a typed prefix are found by binary search and
+only that range is ranked, without scanning every name or word.
+"""
+
+import re
+import numpy as np
+
+import helper_functions
+import park_store
+
+# characters of a name or word kept in its key; longer prefixes are matched
+# on their first MAX_KEY_LENGTH characters
+MAX_KEY_LENGTH = 32
+# completions of each kind returned by default, and at most
+DEFAULT_SUGGESTIONS = 5
+MAX_SUGGESTIONS = 20
+# sorts after every character, so that the keys starting with a prefix are
+# the keys from the prefix up to the prefix followed by KEY_END
+KEY_END = '\U0010ffff'
+
+def normalize_key(text) -> str:
+    """
+    Function to convert a name, word or typed prefix to the form it is
+    matched in: lowercased, with runs of whitespace collapsed.
+    """
+    return ' '.join(text.lower().split())[:MAX_KEY_LENGTH]
+
+def surface_forms(vocabulary, surface_counts) -> np.ndarray:
+    """
+    Function to pick the word shown for each stemmed term of vocabulary: the
+    word it is most often stemmed from in the reviews, given surface_counts,
+    the counts of the unstemmed tokens of the reviews. Terms no token stems
+    to are shown as the stem itself.
+    """
+    words = {}
+    for token, count in surface_counts.items():
+        word = re.sub(r'\W+', '', token)
+        words[word] = words.get(word, 0) + count
+    best = {}
+    for word, count in words.items():
+        stem = helper_functions.normalize_token(word)
+        if stem is None:
+            continue
+        best_count, best_word = best.get(stem, (0, word))
+        if count > best_count or (count == best_count and word <= best_word):
+            best[stem] = (count, word)
+    return np.array([best.get(term, (0, term))[1] for term in vocabulary], dtype=str)
+
+def name_keys(names, first_row=0) -> tuple[list[str], list[int]]:
+    """
+    Function to key the parks with the given names, numbered from first_row,
+    from every word of their name, so that "coney" completes to "Luna Park
+    Coney Island" as well as "luna" does.
+    """
+    keys, rows = [], []
+    for row, name in enumerate(names, first_row):
+        words = name.split()
+        for start in range(len(words)):
+            keys.append(normalize_key(' '.join(words[start:])))
+            rows.append(row)
+    return keys, rows
+
+def sort_keys(keys, ids) -> tuple[np.ndarray, np.ndarray]:
+    keys = np.array(keys, dtype=str)
+    order = np.argsort(keys, kind='stable')
+    return keys[order], np.asarray(ids, dtype=np.int32)[order]
+
+def suggestion_arrays(surface_forms, names, base=None) -> dict[str, np.ndarray]:
+    """
+    Function to build the sorted completion keys of the terms whose surface
+    forms, as returned by surface_forms, and of the parks whose names are
+    given in row order. If base, an index holding suggestion arrays, is
+    given, the terms and parks are appended to its terms and parks.
+    """
+    first_term = first_row = 0
+    term_keys, term_ids = [], []
+    name_key_list, name_rows = [], []
+    if base is not None:
+        first_term = len(base.surface_forms)
+        first_row = len(base.park_ids)
+        term_keys = np.asarray(base.suggest_terms).tolist()
+        term_ids = np.asarray(base.suggest_term_ids).tolist()
+        name_key_list = np.asarray(base.suggest_names).tolist()
+        name_rows = np.asarray(base.suggest_name_rows).tolist()
+    term_keys.extend(normalize_key(word) for word in surface_forms)
+    term_ids.extend(range(first_term, first_term + len(surface_forms)))
+    new_keys, new_rows = name_keys(names, first_row)
+    name_key_list.extend(new_keys)
+    name_rows.extend(new_rows)
+
+    suggest_terms, suggest_term_ids = sort_keys(term_keys, term_ids)
+    suggest_names, suggest_name_rows = sort_keys(name_key_list, name_rows)
+    return {
+        'suggest_terms': suggest_terms,
+        'suggest_term_ids': suggest_term_ids,
+        'suggest_names': suggest_names,
+        'suggest_name_rows': suggest_name_rows,
+    }
+
+class Suggester(object):
+    """
+    Completions of typed prefixes over the suggestion arrays of an index.
+    Parks are ranked by their number of reviews and words by the number of
+    reviews they appear in, with ties broken alphabetically.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.term_keys = index.suggest_terms
+        self.term_ids = index.suggest_term_ids
+        self.term_weights = np.asarray(index.doc_freq)[np.asarray(self.term_ids)]
+        self.name_keys = index.suggest_names
+        self.name_rows = index.suggest_name_rows
+        self.name_weights = np.asarray(index.review_counts)[np.asarray(self.name_rows)]
+
+    def complete(self, query, limit=DEFAULT_SUGGESTIONS) -> dict[str, list[str]]:
+        """
+        Function to complete query, the text typed so far. Returns the names
+        of the limit best parks whose name, or a word of it onwards, starts
+        with query, and the limit best completions of the query's last
+        word, each with the rest of the query in front of it.
+        """
+        key = normalize_key(query)
+        # a space typed after a word ends it, so "kid " does not complete to
+        # "kiddie"
+        if key and query[-1].isspace() and len(key) < MAX_KEY_LENGTH:
+            key += ' '
+        parks = []
+        if key:
+            positions = self._best(self.name_keys, self.name_weights, key, limit,
+                                   self.name_rows)
+            parks = [self._park_name(int(self.name_rows[position])) for position in positions]
+
+        terms = []
+        words = query.split()
+        # a query ending in a space has no word being typed
+        if words and not query[-1].isspace():
+            word = normalize_key(re.sub(r'\W+', '', words[-1]))
+            if word:
+                head = ' '.join(words[:-1])
+                positions = self._best(self.term_keys, self.term_weights, word, limit)
+                for position in positions:
+                    surface = str(self.index.surface_forms[int(self.term_ids[position])])
+                    terms.append(f"{head} {surface}" if head else surface)
+        return {'parks': parks, 'terms': terms}
+
+    def _best(self, keys, weights, prefix, limit, ids=None) -> list[int]:
+        # positions of the limit heaviest keys starting with prefix; if ids is
+        # given, only the first key of each id counts, and more keys are
+        # ranked until limit distinct ids are found or the range runs out
+        start = int(np.searchsorted(keys, prefix, side='left'))
+        end = int(np.searchsorted(keys, prefix + KEY_END, side='left'))
+        if end <= start or limit <= 0:
+            return []
+        range_weights = np.asarray(weights[start:end])
+        fetch = limit
+        while True:
+            if fetch < end - start:
+                # the keys heavier than the fetch-th heaviest, then the
+                # earliest keys as heavy as it
+                threshold = -np.partition(-range_weights, fetch - 1)[fetch - 1]
+                top = np.flatnonzero(range_weights > threshold)
+                ties = np.flatnonzero(range_weights == threshold)[:fetch - len(top)]
+                top = np.concatenate([top, ties])
+            else:
+                top = np.arange(end - start)
+            top = top[np.lexsort((top, -range_weights[top]))] + start
+            if ids is None:
+                return top[:limit].tolist()
+            best = []
+            seen = set()
+            for position in top.tolist():
+                if int(ids[position]) not in seen:
+                    seen.add(int(ids[position]))
+                    best.append(position)
+            if len(best) >= limit or fetch >= end - start:
+                return best[:limit]
+            fetch *= 2
+
+    def _park_name(self, row) -> str:
+        return park_store.read_string(self.index.park_strings, self.index.park_string_offsets,
+                                      int(self.index.park_name_codes[row]))
@@ -4,23 +4,18 @@ reviews.
 """
 
 import numpy as np
-from helper_functions import park_dict, tokenize, all_tokens
-from sklearn.decomposition import TruncatedSVD
-
-def get_term_park_matrix(parks, tokens):
-    """
-    Function to obtain matrix that stores, for each distinct park in the dataset,
-    frequency counts of each unique term from across all park reviews
-    """
-    park_reverse_index = {park : index for index, park in enumerate(parks)}
-    term_reverse_index = {token : index for index, token in enumerate(tokens)}
-    mat = np.zeros((len(park_reverse_index), len(term_reverse_index)))
-    for park, attributes in parks.items():
-        for review in attributes['reviews']:
-            tokens = tokenize(review['text'])
-            for token in tokens:
-                mat[park_reverse_index[park]][term_reverse_index[token]] += 1
-    return mat
+from scipy import sparse
+
+# default settings of the latent model. The seed is fixed so that refitting on
+# the same dataset reproduces the same dimensions, which the hard-coded
+# dimension to tag mapping in assign_tags relies on.
+DEFAULT_OPTIONS = {
+    'n_components': 15,
+    'n_iter': 10,
+    'algorithm': 'randomized',     # or 'arpack'
+    'random_state': 4300,
+    'weighting': 'count',          # or 'tfidf'
+}
 
 # def compute_review_norms(park_reviews_dict, idf_dict):
 #     """
@@ -37,28 +32,75 @@ def get_term_park_matrix(parks, tokens):
 #         norm_dict[park] = math.sqrt(sum)
 #     return norm_dict
 
-def get_tfidf_park_matrix(parks, tokens, idf_dict):
-    park_reverse_index = {park: i for i, park in enumerate(parks)}
-    token_reverse_index = {token: i for i, token in enumerate(tokens)}
-    mat = np.zeros((len(parks), len(tokens)))
-
-    for park, attributes in parks.items():
-        row = park_reverse_index[park]
-        token_counts = {}
-        for review in attributes['reviews']:
-            for token in tokenize(review['text']):
-                if token not in idf_dict:
-                    continue
-                token_counts[token] = token_counts.get(token, 0) + 1
-
-        for token, count in token_counts.items():
-            col = token_reverse_index[token]
-            tfidf = count * idf_dict[token]
-            mat[row][col] = tfidf
-
-    return mat
+def weight_matrix(counts, idf, weighting='count') -> sparse.csr_matrix:
+    """
+    Function to apply the term weighting of the latent model to a sparse
+    park-term count matrix.
+    """
+    counts = sparse.csr_matrix(counts, dtype=np.float64)
+    if weighting == 'tfidf':
+        return counts.multiply(np.asarray(idf)[:counts.shape[1]]).tocsr()
+    return counts
 
-term_park_mat = get_term_park_matrix(park_dict, all_tokens)
+def fit_truncated_svd(term_park_mat, n_components=15, n_iter=10, algorithm='randomized',
+                      random_state=None):
+    """
+    Function to fit a truncated SVD to the park-term matrix, which may be
+    sparse. Returns the fitted model along with the reduced park matrix.
+    """
+    # scikit-learn is only imported when a model is fit, not to serve one
+    from sklearn.decomposition import TruncatedSVD
+    svd = TruncatedSVD(n_components=n_components, n_iter=n_iter,
+                       algorithm=algorithm, random_state=random_state)
+    truncated_mat = svd.fit_transform(term_park_mat)
+    return svd, truncated_mat
+
+def fit_latent_model(counts, idf, options=None):
+    """
+    Function to weight the sparse park-term count matrix and fit the latent
+    model to it. options override DEFAULT_OPTIONS. Returns the fitted model,
+    the reduced park matrix and the options used.
+    """
+    options = dict(DEFAULT_OPTIONS, **(options or {}))
+    model, truncated_mat = fit_truncated_svd(weight_matrix(counts, idf, options['weighting']),
+                                             n_components=options['n_components'],
+                                             n_iter=options['n_iter'],
+                                             algorithm=options['algorithm'],
+                                             random_state=options['random_state'])
+    return model, truncated_mat, options
+
+def assign_tags(truncated_mat) -> list[list[str]]:
+    """
+    Function to pick three descriptive tags for each park based on the latent
+    dimensions that the park loads on most strongly.
+    """
+    park_tags = []
+    for r in range(len(truncated_mat)):
+        sorted_dimensions = np.argsort(truncated_mat[r])[::-1]
+        # dictionary used as an insertion-ordered set, so that tags come out
+        # strongest dimension first rather than in hash order
+        tags = {}
+        d = 0
+        while len(tags) < 3 and d < len(sorted_dimensions):
+            dimension = sorted_dimensions[d]
+            if dimension in [2, 4]:
+                tags.setdefault("Kid-Friendly")
+            if dimension == 1:
+                tags.setdefault("High Thrill")
+            if dimension in [2, 7, 8, 12]:
+                tags.setdefault("Water Rides")
+            if dimension in [2, 3, 13, 14]:
+                tags.setdefault("Adventure")
+            if dimension in [4, 9, 11, 13]:
+                tags.setdefault("Fantasy")
+            if dimension in [10, 12]:
+                tags.setdefault("Holiday Light Shows")
+            if dimension in [0, 2, 5, 7]:
+                tags.setdefault("Fun For Everyone")
+            d += 1
+        # models with fewer dimensions may not reach three tags
+        park_tags.append((list(tags) + [''] * 3)[:3])
+    return park_tags
 
 # token_freq = np.sum(term_park_mat > 0, axis=0) 
 # doc_freq_threshold = len(park_dict) * 0.6
@@ -67,37 +109,6 @@ term_park_mat = get_term_park_matrix(park_dict, all_tokens)
 # term_park_mat = term_park_mat[:, keep_indices]  
 # all_tokens = [all_tokens[i] for i in keep_indices]  
 
-svd = TruncatedSVD(n_components=15, n_iter=10)
-truncated_mat = svd.fit_transform(term_park_mat)
-park_norms = np.linalg.norm(truncated_mat, axis=1)
-
-park_ids = []
-for park_id, _ in park_dict.items():
-    park_ids.append(park_id)
-
-for r in range(len(truncated_mat)):
-    sorted_dimensions = np.argsort(truncated_mat[r])[::-1]
-    tags = set()
-    d = 0
-    while len(tags) < 3:
-        dimension = sorted_dimensions[d]
-        if dimension in [2, 4]:
-            tags.add("Kid-Friendly")
-        if dimension == 1:
-            tags.add("High Thrill")
-        if dimension in [2, 7, 8, 12]:
-            tags.add("Water Rides")
-        if dimension in [2, 3, 13, 14]:
-            tags.add("Adventure")
-        if dimension in [4, 9, 11, 13]:
-            tags.add("Fantasy")
-        if dimension in [10, 12]:
-            tags.add("Holiday Light Shows")
-        if dimension in [0, 2, 5, 7]:
-            tags.add("Fun For Everyone")
-        d += 1
-    park_dict[park_ids[r]]['tags'] = list(tags)
-
 ## code to print parks most associated with each dimension
 # truncated_df = pd.DataFrame(truncated_mat)
 # truncated_df["Park Name"] = park_names
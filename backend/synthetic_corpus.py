@@ -0,0 +1,116 @@
+"""
+Script to generate synthetic datasets in the parks_details.json format, used to
+benchmark the search at corpus sizes well beyond the real dataset.
+
+Run `python synthetic_corpus.py OUTPUT --parks 10000` in the backend folder.
+"""
+
+import argparse
+import json
+import numpy as np
+
+STATES = [
+    "Alabama", "Arizona", "California", "Colorado", "Florida", "Georgia",
+    "Idaho", "Illinois", "Indiana", "Louisiana", "Michigan", "Missouri",
+    "Nevada", "New Jersey", "New York", "North Carolina", "Ohio",
+    "Pennsylvania", "Tennessee", "Texas", "Virginia", "Washington",
+    "Wisconsin",
+]
+
+# words common in real park reviews, mixed with generated words so that the
+# vocabulary grows with the corpus the way real review text does
+PARK_WORDS = [
+    "roller", "coaster", "coasters", "ride", "rides", "water", "slide",
+    "slides", "kids", "family", "fun", "thrill", "drop", "line", "lines",
+    "wait", "food", "staff", "clean", "park", "season", "pass", "halloween",
+    "haunted", "christmas", "lights", "show", "shows", "wave", "pool",
+    "lazy", "river", "splash", "wooden", "launch", "loop", "tickets",
+    "price", "expensive", "games", "arcade", "carousel", "ferris", "wheel",
+    "zoo", "animals", "fireworks", "parade", "summer", "hot", "shade",
+]
+SYLLABLES = ["ka", "lo", "mi", "ren", "to", "sa", "vel", "qui", "dor", "pan",
+             "ex", "bri", "tus", "lan", "gor", "fi", "nel", "om", "ard", "cy"]
+
+def make_vocabulary(size, rng) -> list[str]:
+    """
+    Function to create a vocabulary of the given size, starting with real park
+    review words and padding it with pronounceable generated words.
+    """
+    words = list(PARK_WORDS[:size])
+    seen = set(words)
+    while len(words) < size:
+        word = ''.join(rng.choice(SYLLABLES, size=rng.integers(2, 5)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+def generate_parks(n_parks, reviews_per_park=5, words_per_review=60,
+                   vocabulary_size=20000, seed=0):
+    """
+    Function to yield n_parks synthetic park entries. Review words are drawn
+    from a Zipf distribution over the vocabulary, approximating the skew of
+    real review text, and review counts vary around reviews_per_park.
+    """
+    rng = np.random.default_rng(seed)
+    vocabulary = np.array(make_vocabulary(vocabulary_size, rng))
+    for park in range(n_parks):
+        business_id = f"synthetic-{park:07d}"
+        reviews = []
+        for review in range(max(1, rng.poisson(reviews_per_park))):
+            n_words = max(1, rng.poisson(words_per_review))
+            ranks = np.minimum(rng.zipf(1.3, size=n_words), vocabulary_size) - 1
+            reviews.append({
+                "review_id": f"{business_id}-{review}",
+                "user_id": "synthetic",
+                "business_id": business_id,
+                "stars": int(rng.integers(1, 6)),
+                "useful": 0,
+                "funny": 0,
+                "cool": 0,
+                "text": ' '.join(vocabulary[ranks]).capitalize() + '.',
+            })
+        yield {
+            "business_id": business_id,
+            "name": f"{' '.join(vocabulary[rng.integers(0, 200, size=2)]).title()} Park {park}",
+            "state": STATES[rng.integers(len(STATES))],
+            "latitude": float(rng.uniform(25.0, 48.0)),
+            "longitude": float(rng.uniform(-124.0, -68.0)),
+            "stars": round(float(rng.uniform(1, 5)), 1),
+            "review_count": len(reviews),
+            "attributes": {"GoodForKids": str(bool(rng.random() < 0.7))},
+            "reviews": reviews,
+        }
+
+def write_corpus(output_path, n_parks, **kwargs) -> int:
+    """
+    Function to stream a synthetic dataset of n_parks parks to output_path as
+    a JSON list, one park at a time. Returns the number of reviews written.
+    """
+    n_reviews = 0
+    with open(output_path, 'w') as file:
+        file.write('[\n')
+        for position, entry in enumerate(generate_parks(n_parks, **kwargs)):
+            if position:
+                file.write(',\n')
+            json.dump(entry, file)
+            n_reviews += len(entry['reviews'])
+        file.write('\n]\n')
+    return n_reviews
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic parks dataset.")
+    parser.add_argument('output', help="path to write the dataset to")
+    parser.add_argument('--parks', type=int, default=266)
+    parser.add_argument('--reviews-per-park', type=float, default=5)
+    parser.add_argument('--words-per-review', type=float, default=60)
+    parser.add_argument('--vocabulary-size', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    n_reviews = write_corpus(args.output, args.parks,
+                             reviews_per_park=args.reviews_per_park,
+                             words_per_review=args.words_per_review,
+                             vocabulary_size=args.vocabulary_size,
+                             seed=args.seed)
+    print(f"Wrote {args.parks} parks and {n_reviews} reviews to {args.output}")
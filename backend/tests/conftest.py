@@ -0,0 +1,6 @@
+import os
+import sys
+
+# the backend modules import each other by name, as when run from the backend
+# folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
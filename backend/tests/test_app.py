@@ -0,0 +1,134 @@
+"""
+Tests of the /parks endpoint, run against the app serving the search index
+of the bundled dataset.
+"""
+
+import asyncio
+import json
+import time
+import warnings
+
+import pytest
+
+import app
+import asgi
+import query_cache
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+def test_search_returns_a_page_of_parks(client):
+    response = client.get("/parks", query_string={"title": "roller coaster", "k": 5})
+    assert response.status_code == 200
+    assert len(json.loads(response.data)) == 5
+
+@pytest.mark.parametrize('latitude', ['nan', 'inf', '1e400', 'north'])
+def test_non_finite_location_is_rejected(client, latitude):
+    response = client.get("/parks", query_string={"title": "water", "latitude": latitude,
+                                                  "longitude": "-74.0",
+                                                  "travel-distance": "regional"})
+    assert response.status_code == 400
+
+def test_invalid_cursor_is_rejected_and_stale_cursor_expires(client):
+    cursor = client.get("/parks", query_string={"title": "roller coaster"}).headers["X-Next-Cursor"]
+    assert client.get("/parks", query_string={"cursor": cursor}).status_code == 200
+    for invalid in ("junk", cursor[:-2] + "AA", cursor.split('.')[0]):
+        response = client.get("/parks", query_string={"cursor": invalid})
+        assert response.status_code == 400
+
+    # a cursor the app issued on an index that has since changed
+    version = app.search_state.index.version
+    _, key, mode, offset = query_cache.parse_cursor(cursor, version,
+                                                    len(app.search_state.index.vocabulary))
+    stale = query_cache.make_cursor(version + "+old", key, mode, offset)
+    assert client.get("/parks", query_string={"cursor": stale}).status_code == 410
+
+def failing_bm25(monkeypatch):
+    # BM25 searches fail, while the other modes still work
+    def fail(*args, **kwargs):
+        raise RuntimeError("bm25 failed")
+    monkeypatch.setattr(app.search_state.ranker, 'search', fail)
+    app.result_cache.clear()
+    app.rankings.clear()
+
+def test_failed_search_does_not_fail_its_batch(monkeypatch):
+    failing_bm25(monkeypatch)
+    lexical, failed, latent = app.json_search_batch([
+        app.search_arguments({"title": "water slide"}),
+        app.search_arguments({"title": "water slide", "mode": "bm25"}),
+        app.search_arguments({"title": "water slide", "mode": "latent"}),
+    ])
+    assert isinstance(failed, RuntimeError)
+    assert json.loads(lexical[0]) and json.loads(latent[0])
+
+def test_batcher_fails_only_the_failed_search(monkeypatch):
+    failing_bm25(monkeypatch)
+
+    async def main():
+        batcher = asgi.SearchBatcher(window=0.05)
+        try:
+            return await asyncio.gather(
+                batcher.search(app.search_arguments({"title": "haunted house"})),
+                batcher.search(app.search_arguments({"title": "haunted house", "mode": "bm25"})),
+                return_exceptions=True)
+        finally:
+            await batcher.stop()
+    answered, failed = asyncio.run(main())
+    assert isinstance(failed, RuntimeError)
+    assert json.loads(answered[0])
+
+def test_unknown_mode_is_rejected(client):
+    response = client.get("/parks", query_string={"title": "water", "mode": "junk0"})
+    assert response.status_code == 400
+    assert set(app.search_count.values) <= {"lexical", "latent", "bm25"}
+    assert client.get("/parks", query_string={"title": "water", "mode": ""}).status_code == 200
+
+def test_ingest_without_database_is_refused_beside_other_workers(client, monkeypatch):
+    monkeypatch.setenv("INGEST_TOKEN", "secret")
+    monkeypatch.setattr(app, 'local_ingest', False)
+    response = client.post("/ingest", headers={"X-Ingest-Token": "secret"}, json={"reviews": []})
+    assert response.status_code == 503
+
+def test_searches_do_not_wait_for_a_refresh(client, monkeypatch):
+    version = app.search_state.index.version
+    refresh = app.index.refresh
+    def slow_refresh(*args):
+        time.sleep(1)
+        return refresh(*args)
+    monkeypatch.setattr(app.index, 'refresh', slow_refresh)
+    with app.index_lock:
+        app.index.add_reviews(str(app.index.park_ids[0]), [{'text': 'Quiet on weekdays', 'stars': 4}])
+
+    # the search starts the refresh in the background and is answered from
+    # the current state
+    start = time.monotonic()
+    response = client.get("/parks", query_string={"title": "quiet weekdays"})
+    assert response.status_code == 200 and time.monotonic() - start < 0.5
+    assert app.search_state.index.version == version
+    app.refresher.join()
+    assert app.search_state.index.version != version
+
+def test_ingested_park_is_searchable_once_ingest_returns(client, monkeypatch):
+    monkeypatch.setenv("INGEST_TOKEN", "secret")
+    park = {"business_id": "zebra-water-kingdom", "name": "Zebra Water Kingdom", "state": "NY",
+            "latitude": 40.7, "longitude": -74.0, "attributes": {"GoodForKids": "True"},
+            "reviews": [{"text": "Zebra slides and a zebra wave pool", "stars": 5}]}
+    response = client.post("/ingest", headers={"X-Ingest-Token": "secret"}, json={"parks": [park]})
+    assert response.status_code == 200
+    response = client.get("/parks", query_string={"title": "zebra", "mode": "bm25", "k": 1})
+    assert json.loads(response.data)[0]['name'] == "Zebra Water Kingdom"
+
+def test_park_ingested_without_reviews_does_not_break_similarity(client, monkeypatch):
+    monkeypatch.setenv("INGEST_TOKEN", "secret")
+    park = {"business_id": "quiet-meadow", "name": "Quiet Meadow", "state": "NY",
+            "latitude": 40.7, "longitude": -74.0, "attributes": {"GoodForKids": "True"},
+            "reviews": []}
+    response = client.post("/ingest", headers={"X-Ingest-Token": "secret"}, json={"parks": [park]})
+    assert response.status_code == 200
+    app.result_cache.clear()
+    app.rankings.clear()
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        response = client.get("/parks", query_string={"title": "roller coaster"})
+    assert response.status_code == 200 and json.loads(response.data)
@@ -0,0 +1,120 @@
+"""
+Tests of the crawler against a fixture HTTP server on localhost.
+"""
+
+import asyncio
+import collections
+import http.server
+import json
+import threading
+import time
+
+import pytest
+
+import crawler
+
+def detail_page(name, region, latitude, longitude, review):
+    place = {
+        '@context': 'https://schema.org',
+        '@type': 'AmusementPark',
+        'name': name,
+        'address': {'@type': 'PostalAddress', 'addressRegion': region},
+        'geo': {'latitude': latitude, 'longitude': longitude},
+        'review': [{'@type': 'Review', 'reviewBody': review,
+                    'reviewRating': {'ratingValue': 5}}],
+    }
+    return f'<html><script type="application/ld+json">{json.dumps(place)}</script></html>'
+
+PAGES = {
+    '/list': '<a href="/parks/cedar-point">Cedar Point</a> <a href="/parks/kennywood#rides">'
+             'Kennywood</a> <a href="/parks/flaky">Flaky</a> <a href="/about">About</a>',
+    '/parks/cedar-point': detail_page('Cedar Point', 'OH', 41.48, -82.68, 'Best coasters'),
+    '/parks/kennywood': detail_page('Kennywood', 'PA', 40.39, -79.86, 'Classic rides'),
+    '/parks/flaky': detail_page('Flaky Park', 'NY', 40.7, -74.0, 'Worth the wait'),
+}
+
+class FixtureHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves PAGES, counting the requests for each path. /parks/flaky answers
+    503 with a Retry-After of 0 the first time it is requested, and unknown
+    paths answer 404.
+    """
+
+    def do_GET(self):
+        self.server.requests[self.path] += 1
+        if self.path == '/parks/flaky' and self.server.requests[self.path] == 1:
+            self.send_response(503)
+            self.send_header('Retry-After', '0')
+            self.end_headers()
+            return
+        page = PAGES.get(self.path)
+        if page is None:
+            self.send_error(404)
+            return
+        body = page.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), FixtureHandler)
+    server.requests = collections.Counter()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def base_url(server):
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+def run_crawl(server, cache_dir, output_path):
+    async def main():
+        # a backoff far longer than the test shows that Retry-After is used
+        fetcher = crawler.Fetcher(crawler.HTTPCache(cache_dir), host_rate=100, backoff=60)
+        return await crawler.crawl([base_url(server) + '/list'], output_path, r'/parks/',
+                                   fetcher=fetcher)
+    return asyncio.run(main())
+
+def test_second_crawl_is_served_from_cache(server, tmp_path):
+    output_path = tmp_path / 'parks.json'
+    start = time.monotonic()
+    stats = run_crawl(server, tmp_path / 'cache', output_path)
+    assert time.monotonic() - start < 10
+    assert (stats['parks'], stats['fetched'], stats['retried'], stats['cached']) == (3, 4, 1, 0)
+    first = json.loads(output_path.read_text())
+    assert [(park['name'], park['state']) for park in first] == [
+        ('Cedar Point', 'Ohio'), ('Kennywood', 'Pennsylvania'), ('Flaky Park', 'New York')]
+    assert first[1]['reviews'][0]['text'] == 'Classic rides'
+    requests = dict(server.requests)
+
+    stats = run_crawl(server, tmp_path / 'cache', output_path)
+    assert (stats['parks'], stats['fetched'], stats['cached']) == (3, 0, 4)
+    assert dict(server.requests) == requests
+    assert json.loads(output_path.read_text()) == first
+
+def test_final_errors_are_not_retried(server, tmp_path):
+    async def main():
+        fetcher = crawler.Fetcher(crawler.HTTPCache(tmp_path / 'cache'), backoff=60)
+        with pytest.raises(crawler.FetchError):
+            await fetcher.fetch(base_url(server) + '/missing')
+        return fetcher.stats
+    stats = asyncio.run(main())
+    assert stats['failed'] == 1 and stats['retried'] == 0
+    assert server.requests['/missing'] == 1
+
+def test_requests_to_a_host_are_rate_limited(server, tmp_path):
+    async def main():
+        fetcher = crawler.Fetcher(crawler.HTTPCache(tmp_path / 'cache'), host_rate=10)
+        start = time.monotonic()
+        await asyncio.gather(*(fetcher.fetch(base_url(server) + path)
+                               for path in ('/list', '/parks/cedar-point', '/parks/kennywood')))
+        return time.monotonic() - start
+    # three requests to one host at 10 per second span at least two intervals
+    assert asyncio.run(main()) >= 0.2
@@ -0,0 +1,184 @@
+"""
+Tests of the park database against SQLite, the local stand-in for MySQL.
+"""
+
+import json
+
+import numpy as np
+import pytest
+
+import search_index
+import spatial
+from helpers.ParkDatabase import ParkDatabase
+
+PARKS = [
+    {'business_id': 'nyc', 'name': 'Coney Island', 'state': 'NY',
+     'latitude': 40.5755, 'longitude': -73.9707, 'attributes': {'GoodForKids': 'True'},
+     'reviews': [{'text': 'Classic coasters', 'stars': 5}]},
+    {'business_id': 'philly', 'name': 'Sesame Place', 'state': 'PA',
+     'latitude': 40.1851, 'longitude': -74.8719, 'attributes': {'GoodForKids': 'False'},
+     'reviews': [{'text': 'Fun for toddlers', 'stars': 4}, {'text': 'Crowded', 'stars': 3}]},
+    {'business_id': 'la', 'name': 'Universal Studios', 'state': 'CA',
+     'latitude': 34.1381, 'longitude': -118.3534, 'attributes': {'GoodForKids': 'True'},
+     'reviews': [{'text': 'Great rides', 'stars': 5}]},
+]
+
+NEW_PARK = ('bronx', {'name': 'Bronx Zoo', 'state': 'NY', 'latitude': 40.8506,
+                      'longitude': -73.8769, 'image_url': None, 'website_url': None,
+                      'good_for_kids': 'True'},
+            [{'text': 'Lots of animals', 'stars': 4}])
+
+class ParkRows(object):
+    """
+    The part of a LiveIndex the database filters use: its business ids, in
+    row order.
+    """
+
+    def __init__(self, park_ids):
+        self.park_ids = np.array(park_ids)
+
+    def park_row(self, park) -> int:
+        rows = np.flatnonzero(self.park_ids == park)
+        return int(rows[0]) if len(rows) else -1
+
+@pytest.fixture
+def dataset(tmp_path):
+    path = tmp_path / 'parks_details.json'
+    path.write_text(json.dumps(PARKS))
+    return str(path)
+
+@pytest.fixture
+def url(tmp_path):
+    return f"sqlite:///{tmp_path / 'parks.db'}"
+
+@pytest.fixture
+def database(url, dataset):
+    database = ParkDatabase(url)
+    database.load(dataset)
+    return database
+
+def test_load_records_source_checksum(url, dataset):
+    database = ParkDatabase(url)
+    assert database.source_checksum() is None
+    database.load(dataset)
+    assert database.source_checksum() == search_index.source_checksum(dataset)
+
+def test_filter_rows_selects_dataset_rows(database):
+    rows, new_parks = database.filter_rows(states=['NY', 'CA'])
+    assert rows.tolist() == [0, 2] and new_parks == []
+    rows, _ = database.filter_rows(good_for_kids=True)
+    assert rows.tolist() == [0, 2]
+
+def test_apply_filters_without_filters_skips_sql(database, monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("queried the database")
+    monkeypatch.setattr(database, 'filter_rows', fail)
+    mask = database.apply_filters(ParkRows(['nyc', 'philly', 'la']))
+    assert mask.tolist() == [True, True, True]
+
+def test_apply_filters_checks_distance_of_box_rows(database):
+    index = ParkRows(['nyc', 'philly', 'la'])
+    locator = spatial.ParkLocator([park['latitude'] for park in PARKS],
+                                  [park['longitude'] for park in PARKS])
+    mask = database.apply_filters(index, latitude=40.7128, longitude=-74.0060,
+                                  distance="local", locator=locator)
+    assert mask.tolist() == [True, True, False]
+    mask = database.apply_filters(index, latitude=40.7128, longitude=-74.0060,
+                                  distance="local", good_for_kids="yes", locator=locator)
+    assert mask.tolist() == [True, False, False]
+    assert not database.apply_filters(index, latitude=40.7128, longitude=-74.0060,
+                                      distance="bogus", locator=locator).any()
+
+def test_ingested_parks_are_mapped_by_business_id(database):
+    database.add([NEW_PARK], [])
+    index = ParkRows(['nyc', 'philly', 'la', 'bronx'])
+    assert database.apply_filters(index, locations=['NY']).tolist() == [True, False, False, True]
+    # a park ingested by another process is not in this index
+    assert database.apply_filters(ParkRows(['nyc', 'philly', 'la']),
+                                  locations=['NY']).tolist() == [True, False, False]
+
+def test_ingested_parks_and_reviews_survive_a_restart(database, url):
+    database.add([NEW_PARK], [{'business_id': 'philly', 'text': 'Shorter lines now', 'stars': 5}])
+    # a restarted process, or another worker, ingests a park of its own
+    restarted = ParkDatabase(url)
+    other = ('kennywood', dict(NEW_PARK[1], name='Kennywood', state='PA'), [])
+    restarted.add([other], [{'business_id': 'bronx', 'text': 'Bring water', 'stars': 3}])
+
+    new_parks, new_reviews, sequence = restarted.ingested()
+    assert sequence == 2
+    assert [(park, record['name'], [review['text'] for review in park_reviews])
+            for park, record, park_reviews in new_parks] == [
+        ('bronx', 'Bronx Zoo', ['Lots of animals']),
+        ('kennywood', 'Kennywood', []),
+    ]
+    assert new_parks[0][1] == NEW_PARK[1]
+    # reviews come in ingest order, after the parks they belong to
+    assert [(review['business_id'], review['text']) for review in new_reviews] == [
+        ('philly', 'Shorter lines now'), ('bronx', 'Bring water')]
+
+def test_duplicate_park_stores_nothing(database):
+    database.add([NEW_PARK], [])
+    other = ('kennywood', dict(NEW_PARK[1], name='Kennywood'), [])
+    with pytest.raises(ValueError):
+        database.add([other, NEW_PARK], [])
+    assert [park for park, _, _ in database.ingested()[0]] == ['bronx']
+    assert database.ingested()[2] == 1
+
+def test_ingested_reads_only_later_ingests(database):
+    assert database.ingested() == ([], [], 0)
+    assert database.add([NEW_PARK], []) == 1
+    assert database.add([], [{'business_id': 'bronx', 'text': 'Bring water', 'stars': 3},
+                             {'business_id': 'nyc', 'text': 'Hot dogs', 'stars': 4}]) == 2
+    # a process that added the first ingest to its index only reads the second
+    new_parks, new_reviews, sequence = database.ingested(after=1)
+    assert new_parks == [] and sequence == 2
+    assert [(review['business_id'], review['text']) for review in new_reviews] == [
+        ('bronx', 'Bring water'), ('nyc', 'Hot dogs')]
+    assert database.ingested(after=2) == ([], [], 2)
+
+def test_reload_keeps_ingested_parks_and_reviews(database, dataset, tmp_path):
+    database.add([NEW_PARK], [{'business_id': 'philly', 'text': 'Shorter lines now', 'stars': 5}])
+    kennywood = ('kennywood', dict(NEW_PARK[1], name='Kennywood', state='PA'),
+                 [{'text': 'Old wooden coasters', 'stars': 5}])
+    database.add([kennywood], [])
+    database.add([], [{'business_id': 'kennywood', 'text': 'Potato patch fries', 'stars': 4}])
+
+    # the new dataset adds a review to philly and now holds kennywood itself
+    changed = [dict(PARKS[0]), dict(PARKS[1], reviews=PARKS[1]['reviews'] + [
+        {'text': 'New water ride', 'stars': 4}]), dict(PARKS[2]),
+        {'business_id': 'kennywood', 'name': 'Kennywood', 'state': 'PA', 'latitude': 40.39,
+         'longitude': -79.86, 'attributes': {'GoodForKids': 'True'},
+         'reviews': [{'text': 'Old wooden coasters', 'stars': 5}]}]
+    path = tmp_path / 'changed.json'
+    path.write_text(json.dumps(changed))
+    database.load(str(path))
+    assert database.source_checksum() == search_index.source_checksum(str(path))
+
+    new_parks, new_reviews, sequence = database.ingested()
+    assert sequence == 3
+    assert [(park, [review['text'] for review in park_reviews])
+            for park, _, park_reviews in new_parks] == [('bronx', ['Lots of animals'])]
+    # the review kennywood was ingested with is in the dataset, its later one
+    # is kept
+    assert [(review['business_id'], review['text']) for review in new_reviews] == [
+        ('philly', 'Shorter lines now'), ('kennywood', 'Potato patch fries')]
+    rows, new_park_ids = database.filter_rows(states=['PA'])
+    assert rows.tolist() == [1, 3] and new_park_ids == []
+
+    # later ingests carry on from the kept sequence, after the dataset reviews
+    assert database.add([], [{'business_id': 'philly', 'text': 'Great shade', 'stars': 4}]) == 4
+
+def test_reload_refuses_to_drop_older_tables_with_ingested_rows(url, dataset):
+    import sqlalchemy as db
+    engine = db.create_engine(url)
+    with engine.begin() as conn:
+        conn.execute(db.text("CREATE TABLE parks (business_id VARCHAR(64) PRIMARY KEY, "
+                             "row_id INTEGER)"))
+        conn.execute(db.text("CREATE TABLE reviews (id INTEGER PRIMARY KEY, "
+                             "park_id VARCHAR(64), ingested BOOLEAN)"))
+        conn.execute(db.text("INSERT INTO parks VALUES ('bronx', NULL)"))
+    database = ParkDatabase(url)
+    with pytest.raises(RuntimeError):
+        database.load(dataset)
+    with engine.connect() as conn:
+        assert conn.execute(db.text("SELECT COUNT(*) FROM parks")).scalar() == 1
@@ -0,0 +1,65 @@
+"""
+Tests of building and loading the search index artifact.
+"""
+
+import json
+import threading
+
+import pytest
+
+import search_index
+
+PARKS = [
+    {'business_id': f'park-{number}', 'name': f'Park {number}', 'state': 'NY',
+     'latitude': 40.0 + number, 'longitude': -74.0, 'attributes': {'GoodForKids': 'True'},
+     'reviews': [{'text': f'{ride} rides and {food} food', 'stars': 4}]}
+    for number, (ride, food) in enumerate([('wooden', 'fried'), ('water', 'cheap'),
+                                           ('steel', 'great'), ('dark', 'sweet')])
+]
+# the latent model of a dataset this small has a lower rank
+SVD_OPTIONS = {'n_components': 2}
+
+@pytest.fixture
+def dataset(tmp_path):
+    path = tmp_path / 'parks_details.json'
+    path.write_text(json.dumps(PARKS))
+    return str(path)
+
+def test_workers_starting_together_build_the_index_once(tmp_path, dataset, monkeypatch):
+    builds = []
+    build_index = search_index.build_index
+    def counted_build(json_file_path):
+        builds.append(json_file_path)
+        return build_index(json_file_path, svd_options=SVD_OPTIONS)
+    monkeypatch.setattr(search_index, 'build_index', counted_build)
+
+    index_dir = str(tmp_path / 'index')
+    versions = []
+    def load():
+        versions.append(search_index.load_index(index_dir, dataset).version)
+    threads = [threading.Thread(target=load) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(builds) == 1
+    assert versions == [search_index.source_checksum(dataset)[:16]] * 3
+
+def test_save_keeps_the_artifact_another_process_swapped_in(tmp_path, dataset, monkeypatch):
+    index_dir = str(tmp_path / 'index')
+    arrays, manifest = search_index.build_index(dataset, svd_options=SVD_OPTIONS)
+    search_index.save_index(arrays, manifest, index_dir)
+
+    # another process swaps its artifact in between this one moving the old
+    # artifact aside and swapping its own in
+    replace = search_index.os.replace
+    def racing_replace(source, target):
+        replace(source, target)
+        if source == index_dir:
+            search_index.save_index(arrays, dict(manifest, built_by='other'), index_dir)
+    monkeypatch.setattr(search_index.os, 'replace', racing_replace)
+    search_index.save_index(arrays, manifest, index_dir)
+    monkeypatch.undo()
+
+    assert search_index.read_manifest(index_dir)['built_by'] == 'other'
+    assert [path.name for path in tmp_path.iterdir() if path.name.startswith('.index-')] == []
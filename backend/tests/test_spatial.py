@@ -0,0 +1,31 @@
+"""
+Tests of the travel distance filter and the rounding of user locations.
+"""
+
+import numpy as np
+import pytest
+
+import query_cache
+import spatial
+
+LATITUDES = [40.5755, 40.1851, 34.1381]
+LONGITUDES = [-73.9707, -74.8719, -118.3534]
+
+@pytest.fixture
+def locator():
+    return spatial.ParkLocator(LATITUDES, LONGITUDES)
+
+def test_distance_mask_selects_parks_within_range(locator):
+    assert locator.distance_mask(40.7128, -74.0060, "local").tolist() == [True, True, False]
+    assert locator.distance_mask(40.7128, -74.0060, "fly").all()
+
+@pytest.mark.parametrize('latitude, longitude', [
+    (float('nan'), -74.0), (40.7, float('inf')), ('1e400', '-74.0'), ('north', '-74.0')])
+def test_non_finite_location_matches_no_park(locator, latitude, longitude):
+    assert not locator.distance_mask(latitude, longitude, "long").any()
+    assert len(locator.rows_within(np.arange(3), latitude, longitude, 500)) == 0
+    assert query_cache.quantize_location(latitude, longitude) == (None, None)
+
+def test_quantize_location_rounds_coordinates():
+    assert query_cache.quantize_location('40.7128', -74.006) == (40.7, -74.0)
+    assert query_cache.quantize_location(None, -74.006) == (None, None)
@@ -0,0 +1,115 @@
+"""
+Helper file implementing nearest-neighbour search over the SVD park
+embeddings, used to rank parks directly against a query projected into the
+latent space.
+"""
+
+import numpy as np
+
+# corpora up to this many parks are searched exhaustively; larger ones use an
+# inverted file index over k-means clusters of the embeddings
+EXACT_SEARCH_LIMIT = 20000
+
+def normalize_rows(mat) -> np.ndarray:
+    """
+    Function to scale every row of mat to unit length, leaving all-zero rows
+    as they are.
+    """
+    mat = np.asarray(mat, dtype=np.float64)
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    return np.divide(mat, norms, out=np.zeros_like(mat), where=norms > 0)
+
+def project_query(query_counts, components, term_weights=None) -> np.ndarray:
+    """
+    Function to project a query, given as a dictionary mapping vocabulary
+    columns to counts, onto the fitted SVD components the same way
+    TruncatedSVD.transform projects a park. term_weights, if given, are the
+    per-term weights the model was fit with. Terms the components were not
+    fit on are ignored.
+    """
+    vector = np.zeros(components.shape[0])
+    for term_index, count in query_counts.items():
+        if term_index < components.shape[1]:
+            if term_weights is not None:
+                count = count * term_weights[term_index]
+            vector += count * components[:, term_index]
+    return vector
+
+def project_queries(query_mat, components, term_weights=None) -> np.ndarray:
+    """
+    Function to project a batch of queries, given as a sparse matrix with one
+    row of term counts per query, onto the fitted SVD components with a single
+    matrix product. Equivalent to calling project_query on every row.
+    """
+    query_mat = query_mat[:, :components.shape[1]]
+    if term_weights is not None:
+        query_mat = query_mat.multiply(np.asarray(term_weights)[:components.shape[1]]).tocsr()
+    return np.asarray(query_mat @ components.T)
+
+class ExactVectorIndex(object):
+    """
+    Exhaustive cosine similarity search over pre-normalized embeddings. If
+    normalized is set, embeddings already have unit length rows and are used
+    as they are, without a copy.
+    """
+
+    def __init__(self, embeddings, normalized=False):
+        self.embeddings = embeddings if normalized else normalize_rows(embeddings)
+
+    def search(self, query, n, mask=None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the rows and cosine similarities of up to n embeddings most
+        similar to query, considering only rows where mask is set.
+        """
+        rows = np.arange(len(self.embeddings)) if mask is None else np.flatnonzero(mask)
+        return _best(rows, self.embeddings[rows] @ normalize_rows([query])[0], n)
+
+class IVFVectorIndex(object):
+    """
+    Approximate cosine similarity search that clusters the normalized
+    embeddings with k-means and only scans the n_probe clusters whose
+    centroids are closest to the query.
+    """
+
+    def __init__(self, embeddings, n_lists=None, n_probe=8, random_state=0, normalized=False):
+        self.embeddings = embeddings if normalized else normalize_rows(embeddings)
+        n_lists = n_lists or max(1, int(np.sqrt(len(self.embeddings))))
+        # scikit-learn is only imported by the indexes that need it
+        from sklearn.cluster import KMeans
+        kmeans = KMeans(n_clusters=n_lists, n_init=1, random_state=random_state)
+        assignments = kmeans.fit_predict(self.embeddings)
+        self.centroids = normalize_rows(kmeans.cluster_centers_)
+        order = np.argsort(assignments, kind='stable')
+        self.list_rows = order
+        self.list_indptr = np.searchsorted(assignments[order], np.arange(n_lists + 1))
+        self.n_probe = min(n_probe, n_lists)
+
+    def search(self, query, n, mask=None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the rows and cosine similarities of up to n embeddings most
+        similar to query, considering only rows where mask is set.
+        """
+        query = normalize_rows([query])[0]
+        probes = np.argsort(-(self.centroids @ query))[:self.n_probe]
+        rows = np.concatenate([self.list_rows[self.list_indptr[probe]:self.list_indptr[probe + 1]]
+                               for probe in probes])
+        if mask is not None:
+            rows = rows[mask[rows]]
+        return _best(rows, self.embeddings[rows] @ query, n)
+
+def build_vector_index(embeddings, normalized=False):
+    """
+    Function to build an exact index for small corpora and an approximate one
+    for corpora with more than EXACT_SEARCH_LIMIT parks.
+    """
+    if len(embeddings) <= EXACT_SEARCH_LIMIT:
+        return ExactVectorIndex(embeddings, normalized)
+    return IVFVectorIndex(embeddings, normalized=normalized)
+
+def _best(rows, similarities, n) -> tuple[np.ndarray, np.ndarray]:
+    if n <= 0:
+        return rows[:0], similarities[:0]
+    if n < len(rows):
+        selected = np.argpartition(-similarities, n - 1)[:n]
+        rows, similarities = rows[selected], similarities[selected]
+    return rows, similarities